@@ -1,36 +1,66 @@
 import discord
 from discord.ext import commands
 import os
-import groq
-import redis
 import json
 import datetime
 import asyncio
-from langdetect import detect 
 import re
+import math
 import time
+from memory_store import MemoryStore, MemoryOffline
+from redis_pool import close_redis
+from groq_scheduler import GroqScheduler, SchedulerBusy, estimate_tokens, reserved_tokens, stream_usage, rate_limit_error
+from language_detector import LanguageDetector
+from prompt_builder import PromptBuilder
+from response_cache import ResponseCache, CACHE_USER_NAME, mentions_channel, normalize_prompt
+from fact_retrieval import select_facts
+from fact_ingestion import FactIngestionWorker
+from channel_history import ChannelHistoryBuffer, TranslationCache
+from translation import ChunkedTranslation, chunk_max_tokens, TRANSLATE_MAX_MESSAGES, TRANSLATE_MAX_WAIT
+from conversation_cache import ConversationCache, Turn
+from singleflight import SingleFlight, GROQ_CALLS_SAVED
+from cooldowns import get_cooldowns
+from ai_jobs import AIJobQueue, AI_JOB_MODE, build_job
+from message_router import MessageRouter, HUMAN, AI_MENTION, AI_REPLY
+from logs import get_logger, message_extra
+import metrics
+from metrics import span, AI_STAGE_SECONDS
+
+log = get_logger("ai_cog")
 
 # --- 1. GROQ CONFIGURATION ---
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
 
 if GROQ_API_KEY:
-    groq_client = groq.AsyncGroq(api_key=GROQ_API_KEY)
-    print("AI Cog: API Key Groq successfully loaded.")
+    log.info("API Key Groq successfully loaded.")
 else:
-    groq_client = None
-    print("AI Cog: WARNING!!!: GROQ_API_KEY Can't be found.")
+    log.warning("GROQ_API_KEY Can't be found.")
+
+_groq_client = None
+
+
+def get_groq_client():
+    """The AsyncGroq client, built on first use (or by the cog's background warm-up)."""
+    global _groq_client
+    if _groq_client is None:
+        import groq
+        # Retries belong to the GroqScheduler (it honours retry-after and pauses every
+        # queued job); SDK retries on top would multiply attempts behind its back.
+        _groq_client = groq.AsyncGroq(api_key=GROQ_API_KEY, max_retries=0)
+    return _groq_client
 
 MODEL_GROQ = "llama-3.1-8b-instant"
 
 # --- 2. REDIS CONFIGURATION ---
-try:
-    REDIS_URL = os.environ.get("REDIS_URL") 
-    r = redis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL else redis.Redis(decode_responses=True)
-    r.ping() 
-    print("AI Cog: Redis client initialized successfully. Memory system ONLINE.")
-except Exception as e:
-    r = None
-    print(f"AI Cog: ERROR!!! Failed to connect to Redis. Memory system DISABLED. Error: {e}")
+# The async client + bounded pool live in redis_pool.py; MemoryStore wraps every
+# call with a timeout and reconnects on its own, so a Redis outage only degrades
+# the memory features instead of disabling them until the next restart.
+MEMORY_OFFLINE_MSG = "❌ Memory system is offline. Please check Redis connection."
+FACTS_PER_PAGE = 10
+EMBED_DESCRIPTION_LIMIT = 4096
+TRANSLATOR_COOLDOWN = 300                                            # Seconds between translations per user
+AI_MENTION_LIMIT = int(os.environ.get("AI_MENTION_LIMIT", 6))        # AI calls per user...
+AI_MENTION_WINDOW = float(os.environ.get("AI_MENTION_WINDOW", 60.0)) # ...per sliding window of this many seconds
 
 # --- 3. NEW: ROLE FLAG CONFIGURATION ---
 ROLE_LANGUAGE_MAP = {
@@ -82,17 +112,133 @@ DEFAULT_RAILS = """
 </ABILITY_DENIALS>
 """
 
+# --- 4. STREAMING CONFIGURATION ---
+STREAM_RESPONSES = os.environ.get("AI_STREAM_RESPONSES", "1") == "1"
+STREAM_FLUSH_INTERVAL = float(os.environ.get("AI_STREAM_FLUSH_INTERVAL", 1.0)) # Min seconds between edits (Discord allows ~5 edits / 5s)
+STREAM_FLUSH_TOKENS = int(os.environ.get("AI_STREAM_FLUSH_TOKENS", 20))        # Min new tokens before an edit is worth sending
+STREAM_PLACEHOLDER = "💭 ..."
+DISCORD_MESSAGE_LIMIT = 2000
+
+
+def split_discord_message(text, limit=DISCORD_MESSAGE_LIMIT):
+    """Splits text into <= limit chunks, preferring newline then space boundaries."""
+    pages = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = text.rfind(" ", 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        pages.append(text[:cut])
+        text = text[cut:].lstrip()
+    pages.append(text)
+    return [page for page in pages if page.strip()]
+
+
+class StreamingReply:
+    """
+    Shows a (possibly still growing) AI response as a reply plus follow-up
+    messages, editing them in place instead of sending a new message per chunk.
+    """
+
+    def __init__(self, message):
+        self.message = message
+        self.sent = []      # discord.Message objects already posted
+        self.rendered = []  # Content currently shown in each of them
+
+    @property
+    def has_content(self):
+        return bool(self.rendered) and self.rendered[0] != STREAM_PLACEHOLDER
+
+    async def start(self):
+        self.sent.append(await self.message.reply(STREAM_PLACEHOLDER))
+        self.rendered.append(STREAM_PLACEHOLDER)
+
+    async def render(self, text):
+        pages = split_discord_message(text)
+        for i, page in enumerate(pages):
+            if i < len(self.sent):
+                if self.rendered[i] != page:
+                    await self.sent[i].edit(content=page)
+                    self.rendered[i] = page
+            else:
+                if i == 0:
+                    sent = await self.message.reply(page)
+                else:
+                    sent = await self.message.channel.send(page)
+                self.sent.append(sent)
+                self.rendered.append(page)
+        # The text got shorter (e.g. the final render differs from the streamed one): drop the leftover pages
+        while len(self.sent) > max(1, len(pages)):
+            stale = self.sent.pop()
+            self.rendered.pop()
+            try:
+                await stale.delete()
+            except discord.HTTPException as e:
+                log.warning(f"Could not delete a stale reply page. Error: {e}")
+
 
 # --- 5. COG CLASS ---
 class AICog(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
-        self.translator_cooldowns = {}
-        print("AI Cog: Loaded")
+        self.cooldowns = get_cooldowns()  # Shared with the leveling cog
+        self.memory = MemoryStore()
+        self.scheduler = GroqScheduler()
+        self.language = LanguageDetector()
+        self.prompts = PromptBuilder(
+            self.memory,
+            default_rails=DEFAULT_RAILS,
+            personas={'id': ID_PERSONA},  # Every other language uses the English persona
+            default_persona=DEFAULT_PERSONA,
+            languages=LANGUAGE_PRIORITY_ORDER,
+        )
+        self.response_cache = ResponseCache(self.memory)
+        self.fact_cleaner = FactIngestionWorker(
+            self.memory,
+            complete=lambda **create_kwargs: self.groq_completion(None, None, **create_kwargs),
+            model=MODEL_GROQ,
+        )
+        self.history = ChannelHistoryBuffer()
+        self.translations = TranslationCache()
+        self.conversations = ConversationCache(self.memory, summarize=self.summarize_turns)
+        self.inflight = SingleFlight("coalesced")  # Identical prompts answered by one Groq call
+        self.user_requests = {}                    # (channel_id, user_id) -> (normalized prompt, task, message id)
+        self.superseded = set()                    # Message ids whose answer was cancelled by a newer prompt
+        self.rails_listener = None
+        self.warm_up_task = None
+        self.router = MessageRouter.install(bot)
+        self.jobs = AIJobQueue(self.memory) if AI_JOB_MODE == "queue" else None
+        log.info("Loaded")
+
+    async def cog_load(self):
+        self.router.subscribe(self.record_history, *HUMAN)
+        self.router.subscribe(self.handle_ai_message, AI_MENTION, AI_REPLY)
+        self.scheduler.start()
+        if GROQ_API_KEY:
+            self.fact_cleaner.start()
+        self.rails_listener = asyncio.create_task(self.prompts.listen_for_updates())
+        metrics.gauge("groq_queue_depth", "Groq requests waiting in the scheduler", lambda: self.scheduler.queue_depth)
+        # Heavy imports, clients and the Redis check don't hold up login / the first event
+        self.warm_up_task = asyncio.create_task(self.warm_up())
+
+    async def warm_up(self):
+        """Background start-up work: Groq client, language profiles, Redis ping."""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        if GROQ_API_KEY:
+            await asyncio.to_thread(get_groq_client)
+        await self.language.warm_up()
+        try:
+            await self.memory.ping()
+            log.info("Redis client initialized successfully. Memory system ONLINE.")
+        except MemoryOffline as e:
+            log.warning(f"Redis not reachable yet, will keep retrying per call. Error: {e}")
+        log.info(f"Warm-up finished in {loop.time() - started:.2f}s")
 
     # --- 6. NEW: ADVANCED LANGUAGE DETERMINATION LOGIC ---
-    def determine_language(self, prompt_text, author_roles: list[discord.Role]):
+    async def determine_language(self, prompt_text, author_roles: list[discord.Role]):
         """
         Determines the target language based on prompt and role priority.
         Priority 1: High-confidence prompt language.
@@ -101,16 +247,13 @@ class AICog(commands.Cog):
         """
         
         # Priority 1: High-confidence prompt detection
-        try:
-            clean_text = prompt_text.strip().split('\n')[0]
-            # We need enough text to be sure
-            if len(clean_text) > 25: 
-                lang = detect(clean_text)
-                if lang in LANGUAGE_PRIORITY_ORDER:
-                    print(f"[LangDetect] High-confidence prompt: {lang}")
-                    return lang # Confident detection
-        except Exception as e:
-            pass # langdetect failed, move to roles
+        clean_text = prompt_text.strip().split('\n')[0]
+        # We need enough text to be sure
+        if len(clean_text) > 25: 
+            lang = await self.language.detect(clean_text) # Runs in the worker pool, cached per first line
+            if lang in LANGUAGE_PRIORITY_ORDER:
+                log.debug(f"High-confidence prompt: {lang}")
+                return lang # Confident detection
 
         # Priority 2: Role-based detection (if prompt is short/ambiguous)
         author_role_ids = {role.id for role in author_roles}
@@ -118,81 +261,252 @@ class AICog(commands.Cog):
         for lang_code in LANGUAGE_PRIORITY_ORDER:
             for role_id, lang in ROLE_LANGUAGE_MAP.items():
                 if lang == lang_code and role_id in author_role_ids:
-                    print(f"[LangDetect] Role-based priority: {lang}")
+                    log.debug(f"Role-based priority: {lang}")
                     return lang # Found highest priority role
 
         # Priority 3: Default fallback
-        print("[LangDetect] Fallback: en")
+        log.debug("Fallback: en")
         return 'en'
 
+    # --- 6a. SCHEDULED GROQ CALL ---
+    async def groq_completion(self, guild_id, user_id, max_wait=None, **create_kwargs):
+        """Every Groq request goes through the scheduler (RPM/TPM buckets + fair queue)."""
+        return await self.scheduler.run(
+            lambda: get_groq_client().chat.completions.create(**create_kwargs),
+            guild_id=guild_id,
+            user_id=user_id,
+            est_tokens=reserved_tokens(create_kwargs),
+            max_wait=max_wait,
+        )
+
+    # --- 6b. STREAMED GROQ COMPLETION ---
+    async def stream_completion(self, reply: StreamingReply, messages_payload, temperature, max_tokens):
+        """
+        Streams a completion into `reply`. The first token is shown right away,
+        later ones are coalesced into edits of at least STREAM_FLUSH_TOKENS
+        tokens, no more than once per STREAM_FLUSH_INTERVAL seconds. The
+        stream's final chunk carries its usage, which settles the tokens the
+        scheduler reserved for it. Returns (text, total tokens or None).
+        """
+        message = reply.message
+        create_kwargs = dict(messages=messages_payload, model=MODEL_GROQ, temperature=temperature, max_tokens=max_tokens, stream=True)
+        stream = await self.groq_completion(message.guild.id if message.guild else None, message.author.id, **create_kwargs)
+        if not reply.sent:
+            await reply.start()
+
+        loop = asyncio.get_running_loop()
+        response_text = ""
+        pending_tokens = 0
+        last_flush = loop.time()
+        tokens_used = None
+
+        async for chunk in stream:
+            usage = stream_usage(chunk)
+            if usage is not None:
+                self.scheduler.settle(usage, reserved_tokens(create_kwargs))
+                tokens_used = usage.total_tokens
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            response_text += chunk.choices[0].delta.content
+            pending_tokens += 1
+
+            now = loop.time()
+            if not reply.has_content or (pending_tokens >= STREAM_FLUSH_TOKENS and now - last_flush >= STREAM_FLUSH_INTERVAL):
+                await reply.render(response_text)
+                pending_tokens = 0
+                last_flush = now
+
+        await reply.render(response_text)
+        return response_text, tokens_used
+
+    # --- 6c. CHUNK TRANSLATION ---
+    async def translate_texts(self, message, texts, target_lang, instructions=""):
+        """Translates one chunk of chat texts in a JSON-mode call. Returns translations in the same order (None if missing)."""
+        system_prompt = (
+            f"You are a skilled translator. Translate every chat message into {target_lang}. "
+            "Keep names, emojis and formatting. "
+            'Reply only with JSON: {"translations": [{"id": <input id>, "text": "<translation>"}]}'
+        )
+        if instructions:
+            system_prompt += f"\nExtra instructions from the user: {instructions}"
+        items = [{"id": i, "text": text} for i, text in enumerate(texts)]
+
+        chat_completion = await self.groq_completion(
+            message.guild.id if message.guild else None,
+            message.author.id,
+            max_wait=TRANSLATE_MAX_WAIT,  # Its placeholder page is already up; waiting beats failing
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": json.dumps(items, ensure_ascii=False)}
+            ],
+            model=MODEL_GROQ,
+            temperature=0.0,
+            max_tokens=chunk_max_tokens(texts),
+            response_format={"type": "json_object"},
+        )
+        result = json.loads(chat_completion.choices[0].message.content)
+
+        translated = [None] * len(texts)
+        for entry in result.get("translations", []):
+            try:
+                index = int(entry["id"])
+                if 0 <= index < len(texts):
+                    translated[index] = str(entry["text"])
+            except (KeyError, TypeError, ValueError):
+                continue
+        return translated
+
+    async def send_translation(self, message, records, target_lang, instructions=""):
+        """
+        Translates a history window chunk by chunk (translation.ChunkedTranslation)
+        into one embed per page. With several pages, placeholders go out first, in
+        order, and each is edited as soon as its chunk is back. Returns True if any
+        page was translated.
+        """
+        lang_key = target_lang.lower()
+        # Extra user instructions make the output non-reusable
+        cached = {} if instructions else self.translations.get_many([r.id for r in records], lang_key)
+
+        async def translate(texts):
+            with span(AI_STAGE_SECONDS, stage="translate"):
+                return await self.translate_texts(message, texts, target_lang, instructions)
+
+        job = ChunkedTranslation(records, translate, known=cached)
+        # Later chunks queue behind earlier ones for TPM budget: a window that couldn't
+        # finish within TRANSLATE_MAX_WAIT is refused now instead of failing halfway
+        budget = self.scheduler.token_budget(TRANSLATE_MAX_WAIT)
+        if job.reserved_tokens > budget:
+            fits = max(1, int(len(records) * budget / job.reserved_tokens))
+            await message.reply(f"Sorry, {len(records)} messages are too much to translate right now. Try {fits} or fewer, or wait a minute.")
+            return False
+        job.start()
+        title = f"🌐 Translation ({len(records)} Messages to {target_lang.capitalize()})"
+        total = len(job.pages)
+
+        def page_embeds(index, lines, note=None):
+            """One embed per EMBED_DESCRIPTION_LIMIT of translated text: translations can run longer than their input."""
+            description = "\n".join(f"- **{r.author_name}**: {text or r.content}" for r, text in lines)
+            parts = split_discord_message(description, EMBED_DESCRIPTION_LIMIT) or [description]
+            embeds = []
+            for part_index, part in enumerate(parts):
+                embed = discord.Embed(title=title, description=part, color=discord.Color.dark_green())
+                footer = f"Page {index + 1}/{total}" if total > 1 else ""
+                if len(parts) > 1:
+                    footer = f"{footer} · Part {part_index + 1}/{len(parts)}" if footer else f"Part {part_index + 1}/{len(parts)}"
+                if note:
+                    footer = f"{footer} · {note}" if footer else note
+                if footer:
+                    embed.set_footer(text=footer)
+                embeds.append(embed)
+            return embeds
+
+        sent = []
+        if total > 1:
+            for index, page in enumerate(job.pages):
+                placeholder = discord.Embed(
+                    title=title,
+                    description=f"⏳ Translating {len(page)} message(s)...",
+                    color=discord.Color.dark_grey(),
+                ).set_footer(text=f"Page {index + 1}/{total}")
+                send = message.reply if index == 0 else message.channel.send
+                sent.append(await send(embed=placeholder))
+
+        any_translated = False
+        async for index, error in job.as_completed():
+            lines = job.lines(index)
+            if error is None:
+                any_translated = True
+                if not instructions:
+                    self.translations.put_many({r.id: text for r, text in lines if text and r.id not in cached}, lang_key)
+                embeds = page_embeds(index, lines)
+            elif total == 1 and isinstance(error, (rate_limit_error(), SchedulerBusy)):
+                await message.reply("Oops, the translator is busy right now (Rate Limit)! Try again in a few seconds.")
+                continue
+            elif total == 1:
+                raise error
+            else:
+                log.warning(f"Translation chunk failed. Error: {error}", extra=message_extra(message, page=index + 1, pages=total))
+                embeds = page_embeds(index, lines, note="⚠️ Part of this page couldn't be translated, originals shown")
+
+            if sent:
+                page_message = sent[index]
+                await page_message.edit(embed=embeds[0])
+            else:
+                page_message = await message.reply(embed=embeds[0])
+            for embed in embeds[1:]:
+                # Overflow parts reply to their page, which may no longer be the newest message
+                await page_message.reply(embed=embed, mention_author=False)
+        return any_translated
+
+    # --- 6d. CONVERSATION THREADS ---
+    async def remember_turn(self, message, prompt_text, reply: StreamingReply, response_text):
+        """Records the answer so replies to any of its messages continue the thread without REST calls."""
+        parent_id = message.reference.message_id if message.reference else None
+        turn = Turn([m.id for m in reply.sent], prompt_text, response_text, parent_id, message.author.id, message.author.display_name)
+        await self.conversations.record(message.channel.id, turn)
+
+    async def summarize_turns(self, turns, previous_summary):
+        """Folds turns that fell out of the token budget into a short running summary."""
+        transcript = "\n".join(f"{t.author_name}: {t.prompt}\nZ-Bot: {t.response}" for t in turns)
+        if previous_summary:
+            transcript = f"Earlier summary: {previous_summary}\n{transcript}"
+        chat_completion = await self.groq_completion(
+            None,
+            None,
+            messages=[
+                {"role": "system", "content": "Summarize this chat thread in at most 3 sentences. Keep names, facts, decisions and open questions."},
+                {"role": "user", "content": transcript},
+            ],
+            model=MODEL_GROQ,
+            temperature=0.2,
+            max_tokens=200,
+        )
+        return chat_completion.choices[0].message.content.strip()
+
     # --- 7. MAIN AI FUNCTION (CONTEXT & LANGUAGE AWARE) ---
     async def panggil_ai(self, message, prompt_text):
-        COOLDOWN_TIME = 300 # 5 minutes
-        MAX_MESSAGE_LIMIT = 15
-
         # --- LOGIC 1: HISTORY TRANSLATOR CHECK ---
         translation_match = re.search(r'(translate to (.*?))\s*\[(\d+)\]', prompt_text, re.IGNORECASE)
 
         if translation_match:
             user_id = message.author.id
-            current_time = time.time()
             
             # (Translation logic remains the same... we assume 'id' or 'en' for cooldown messages)
             language_id = 'id' # Default cooldown message to ID for simplicity
-            try: 
-                if detect(prompt_text) == 'en': language_id = 'en'
-            except: pass
-
-            # Cooldown Check
-            if user_id in self.translator_cooldowns:
-                time_since_last = current_time - self.translator_cooldowns[user_id]
-                if time_since_last < COOLDOWN_TIME:
-                    remaining = int(COOLDOWN_TIME - time_since_last)
-                    if language_id == 'id':
-                        return await message.reply(f"Waduh, fitur translator lagi cooldown nih. Coba lagi dalam {remaining} detik, ya.")
-                    else:
-                        return await message.reply(f"Sorry, the translator is on cooldown. Try again in {remaining} seconds.")
+            if await self.language.detect(prompt_text) == 'en': language_id = 'en'
+
+            # Cooldown Check (only started once a translation actually succeeds)
+            remaining = math.ceil(await self.cooldowns.remaining(f"translator:{user_id}"))
+            if remaining:
+                if language_id == 'id':
+                    return await message.reply(f"Waduh, fitur translator lagi cooldown nih. Coba lagi dalam {remaining} detik, ya.")
+                else:
+                    return await message.reply(f"Sorry, the translator is on cooldown. Try again in {remaining} seconds.")
             
             # (Rest of translation logic remains the same)
             target_lang = translation_match.group(2).strip() 
             limit = int(translation_match.group(3))
             
-            if limit < 2 or limit > MAX_MESSAGE_LIMIT:
-                return await message.reply(f"Sorry, the message limit must be between 2 and {MAX_MESSAGE_LIMIT}.")
+            if limit < 2 or limit > TRANSLATE_MAX_MESSAGES:
+                return await message.reply(f"Sorry, the message limit must be between 2 and {TRANSLATE_MAX_MESSAGES}.")
                 
-            clean_prompt_text = prompt_text[:translation_match.start()].strip()
-            if not clean_prompt_text:
-                clean_prompt_text = f"Please translate the following {limit} messages into {target_lang}."
-
-            messages = []
-            async for msg in message.channel.history(limit=limit + 1, before=message):
-                if msg.author.bot or msg.id == message.id:
-                    continue
-                messages.append(msg)
-            
-            messages.reverse()
-            
-            if not messages:
+            # Extra user instructions (text before "translate to")
+            instructions = prompt_text[:translation_match.start()].strip()
+
+            try:
+                # Served from the gateway-fed buffer; REST history is only hit to backfill
+                with span(AI_STAGE_SECONDS, stage="history"):
+                    records = await self.history.window(message.channel, before=message, limit=limit)
+            except discord.HTTPException as e:
+                return await message.reply(f"Sorry, translation failed. Error: {e}")
+
+            if not records:
                 return await message.reply("No messages found above this command to translate.")
 
-            history_context = "\n".join([f"[{m.author.display_name}]: {m.content}" for m in messages])
-            full_prompt_to_groq = f"{clean_prompt_text}\n\n--- CHAT HISTORY ({len(messages)} MESSAGES) ---\n{history_context}"
-            
             await message.channel.typing()
             try:
-                chat_completion = await groq_client.chat.completions.create(
-                    messages=[
-                        {"role": "system", "content": f"You are a skilled translator and formatter. You must translate the user's provided chat history into {target_lang} and output the result in a clean, itemized list format."},
-                        {"role": "user", "content": full_prompt_to_groq}
-                    ],
-                    model=MODEL_GROQ,
-                    temperature=0.0,
-                    max_tokens=2048,
-                )
-                translation_result = chat_completion.choices[0].message.content
-                embed = discord.Embed(title=f"🌐 Translation ({len(messages)} Messages to {target_lang.capitalize()})", description=translation_result, color=discord.Color.dark_green())
-                await message.reply(embed=embed)
-                self.translator_cooldowns[user_id] = current_time 
+                if await self.send_translation(message, records, target_lang, instructions):
+                    await self.cooldowns.set(f"translator:{user_id}", TRANSLATOR_COOLDOWN)
                 return 
             except Exception as e:
                 await message.reply(f"Sorry, translation failed. Error: {e}")
@@ -201,33 +515,18 @@ class AICog(commands.Cog):
         # --- LOGIC 2: DEFAULT RAG/PERSONA (The Core Agent) ---
         await message.channel.typing()
         
-        if not groq_client:
+        if not GROQ_API_KEY:
             await message.reply("Sorry, This bot has been disabled.")
             return
 
-        # Load Rails from DB
-        rails_str = r.get("prompt_rails") if r else DEFAULT_RAILS 
-        
         # --- NEW LANGUAGE LOGIC ---
-        target_language = self.determine_language(prompt_text, message.author.roles)
+        with span(AI_STAGE_SECONDS, stage="language"):
+            target_language = await self.determine_language(prompt_text, message.author.roles)
         user_display_name = message.author.display_name
         user_id = message.author.id
 
-        if target_language == 'id':
-            persona_str = ID_PERSONA.format(user_display_name=user_display_name)
-        else:
-            # Default to English persona for 'en' or any other lang (th, vi)
-            persona_str = DEFAULT_PERSONA.format(user_display_name=user_display_name)
-        
-        # Inject Language-Specific Denials into Rails
-        if target_language == 'id':
-            rails_str = rails_str.replace("Sorry, I can't directly read chat history, you'll need to tell me what to look for.\" (EN)", "'Waduh, gw gak bisa liat isi chat langsung, lu harus bilang apa yang gw perlu tau.'")
-            rails_str = rails_str.replace("Sorry, I can't process images/audio, describe it to me instead.\" (EN)", "'Waduh, mata gue masih analog, cik. Nggak bisa liat gambar. Ceritain aja isinya apa.'")
-        else:
-            rails_str = rails_str.replace("Waduh, gw gak bisa liat isi chat langsung, lu harus bilang apa yang gw perlu tau.\" (ID) OR \"", "")
-            rails_str = rails_str.replace("Waduh, mata gue masih analog, cik. Nggak bisa liat gambar. Ceritain aja isinya apa.\" (ID) OR \"", "")
-
-
+        reply = StreamingReply(message)
+        started = time.monotonic()
         try:
             # Context Assembly
             current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -235,65 +534,82 @@ class AICog(commands.Cog):
             channel_name = message.channel.name
 
             # RAG Memory Loading (from Redis)
-            user_memory_blob = r.get(f"memory_{user_id}") if r else None
-            if user_memory_blob:
-                user_memory_blob_parsed = json.loads(user_memory_blob)
-                memory_str = json.dumps(user_memory_blob_parsed.get("facts", []), indent=2) 
-            else:
-                memory_str = "No facts stored about this user."
-
-            # System Prompt Template
-            system_template = """
-<CORE_SYSTEM_PROMPT>
-{core_prompt}
-</CORE_SYSTEM_PROMPT>
-
-<CURRENT_CONTEXT>
-Timestamp: {current_time}
-Server: {server_name}
-Channel: #{channel_name}
-User: {user_display_name}
-</CURRENT_CONTEXT>
-
-<LONG_TERM_MEMORY>
-Known facts about {user_display_name}:
-{memory_str}
-</LONG_TERM_MEMORY>
-
-<OPERATIONAL_RAILS>
-{rails_str}
-</OPERATIONAL_RAILS>
-            """
-
-            system_prompt = system_template.format(
-                core_prompt=persona_str, # Menggunakan persona yang sudah ditentukan
-                current_time=current_time,
-                server_name=server_name,
-                channel_name=channel_name,
-                user_display_name=user_display_name,
-                memory_str=memory_str,
-                rails_str=rails_str
-            )
+            with span(AI_STAGE_SECONDS, stage="memory"):
+                try:
+                    user_facts, fact_stats = await self.memory.search_facts(user_id, prompt_text)
+                except MemoryOffline:
+                    user_facts, fact_stats = [], None
+                if user_facts:
+                    # Only the top-k facts relevant to this prompt, within the token budget
+                    memory_str = json.dumps(select_facts(user_facts, prompt_text, stats=fact_stats), indent=2)
+                else:
+                    memory_str = "No facts stored about this user."
+
+            # Response Cache (only for prompts that aren't personalized by facts or reply context)
+            cacheable = self.response_cache.enabled and not user_facts and not message.reference
+            if cacheable:
+                # A shared answer must not depend on who asked or when: the name and the time
+                # of day stay out of its prompt, and it is only shared within the guild and day
+                # (and the channel, if the prompt is about the channel)
+                user_display_name = CACHE_USER_NAME
+                current_time = current_time[:10]
+                with span(AI_STAGE_SECONDS, stage="cache_lookup"):
+                    await self.prompts.prefix_for(target_language)  # Makes sure prompts.version is current
+                    cache_scope = self.response_cache.scope(
+                        target_language,
+                        self.prompts.version,
+                        message.guild.id,
+                        message.channel.id if mentions_channel(prompt_text, channel_name) else None,
+                        current_time,
+                    )
+                    cached_text = await self.response_cache.get(prompt_text, cache_scope)
+                if cached_text:
+                    await reply.render(cached_text)
+                    await self.remember_turn(message, prompt_text, reply, cached_text)
+                    log.info("AI reply sent", extra=message_extra(message, latency_ms=round((time.monotonic() - started) * 1000), cached=True))
+                    return
+
+            # System Prompt (persona + rails prefix is precompiled per language)
+            with span(AI_STAGE_SECONDS, stage="prompt_build"):
+                system_prompt = await self.prompts.build(
+                    target_language,
+                    current_time=current_time,
+                    server_name=server_name,
+                    channel_name=channel_name,
+                    user_display_name=user_display_name,
+                    memory_str=memory_str,
+                )
 
-            # Message Payload (FIXED Reply Context)
+            # Message Payload (reply chain from the conversation cache, within its token budget)
             messages_payload = [
                 {"role": "system", "content": system_prompt}
             ]
 
-            if message.reference and message.reference.resolved:
+            thread = None
+            if message.reference and message.reference.message_id:
+                with span(AI_STAGE_SECONDS, stage="conversation"):
+                    thread = await self.conversations.context(message.channel.id, message.reference.message_id)
+
+            if thread is not None:
+                summary, turns = thread
+                if summary:
+                    messages_payload.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+                for turn in turns:
+                    prompt = turn.prompt if turn.author_id == user_id else f"[{turn.author_name}]: {turn.prompt}"
+                    messages_payload.append({"role": "user", "content": prompt})
+                    messages_payload.append({"role": "assistant", "content": turn.response})
+
+            elif message.reference and message.reference.resolved:
+                # Not a cached bot reply (older than the cache, or a human message): one hop of context
                 original_message = message.reference.resolved
                 
                 if original_message.author.bot:
-                    if original_message.content.startswith("Hello! What can I help you with?") or \
-                       original_message.content.startswith("Saya siap membantu"):
-                        pass
-                    else:
-                        messages_payload.append({
-                            "role": "assistant",
-                            "content": original_message.content
-                        })
+                    messages_payload.append({
+                        "role": "assistant",
+                        "content": original_message.content
+                    })
                 
-                elif not original_message.author.bot: 
+                else: 
                     original_author = original_message.author.display_name
                     original_content = original_message.content
                     messages_payload.append({"role": "user", "content": f"[Context from '{original_author}']: \"{original_content}\""})
@@ -301,113 +617,131 @@ Known facts about {user_display_name}:
             
             messages_payload.append({"role": "user", "content": prompt_text})
 
-            # GROQ API Call
-            chat_completion = await groq_client.chat.completions.create(
-                messages=messages_payload,
-                model=MODEL_GROQ,
-                temperature=0.7,
-                max_tokens=1024,
+            # GROQ API Call (streamed, with one-shot fallback)
+            async def generate():
+                response_text = tokens_used = None
+                if STREAM_RESPONSES:
+                    try:
+                        with span(AI_STAGE_SECONDS, stage="generate_stream"):  # Groq stream + progressive edits
+                            response_text, tokens_used = await self.stream_completion(reply, messages_payload, temperature=0.7, max_tokens=1024)
+                    except (rate_limit_error(), SchedulerBusy):
+                        raise
+                    except Exception as e:
+                        log.warning(f"Streaming failed, falling back to one-shot. Error: {e}", extra=message_extra(message))
+
+                if response_text is None:
+                    with span(AI_STAGE_SECONDS, stage="generate"):
+                        chat_completion = await self.groq_completion(
+                            message.guild.id if message.guild else None,
+                            user_id,
+                            messages=messages_payload,
+                            model=MODEL_GROQ,
+                            temperature=0.7,
+                            max_tokens=1024,
+                        )
+                    response_text = chat_completion.choices[0].message.content
+                    tokens_used = chat_completion.usage.total_tokens if chat_completion.usage else None
+                    if response_text:
+                        with span(AI_STAGE_SECONDS, stage="send"):
+                            await reply.render(response_text)
+                return response_text, tokens_used
+
+            # Concurrent identical prompts (same channel, language, reply target and facts) share one call
+            flight_key = (
+                message.channel.id,
+                normalize_prompt(prompt_text),
+                target_language,
+                message.reference.message_id if message.reference else None,
+                memory_str if user_facts else None,
             )
-
-            response_text = chat_completion.choices[0].message.content
+            (response_text, tokens_used), shared = await self.inflight.do(flight_key, generate)
+            if shared and response_text:
+                await reply.render(response_text)
 
             if not response_text:
-                await message.reply("Sorry, the AI returned an empty response.")
+                await reply.render("Sorry, the AI returned an empty response.")
                 return
-
-            await message.reply(response_text)
-
-        except groq.RateLimitError:
-            await message.reply("Oops, AI is overwhelmed (Rate Limit)! 🤯 Try again in a few seconds.")
-            print("[Info AI]: Groq Rate Limit (429) triggered.")
+            await self.remember_turn(message, prompt_text, reply, response_text)
+            log.info("AI reply sent", extra=message_extra(
+                message, latency_ms=round((time.monotonic() - started) * 1000), shared=shared, tokens=tokens_used,
+            ))
+
+            if cacheable and not shared:
+                if tokens_used is None:  # A stream cut short before its final (usage) chunk
+                    tokens_used = estimate_tokens(messages_payload) + len(response_text) // 4
+                await self.response_cache.put(prompt_text, cache_scope, response_text, tokens_used)
+
+        except asyncio.CancelledError:
+            if message.id in self.superseded and reply.sent:
+                await reply.render("↪️ Skipped, answering your newer message instead.")
+            raise
+        except (rate_limit_error(), SchedulerBusy):
+            await reply.render("Oops, AI is overwhelmed (Rate Limit)! 🤯 Try again in a few seconds.")
+            log.warning("Groq Rate Limit (429) triggered.", extra=message_extra(message, latency_ms=round((time.monotonic() - started) * 1000)))
         except Exception as e:
-            await message.reply(f"Sorry, AI failed to respond. Error: {e}")
-            print(f"[Error AI Groq]: {e}")
+            await reply.render(f"Sorry, AI failed to respond. Error: {e}")
+            log.error(f"Groq call failed. Error: {e}", extra=message_extra(message, latency_ms=round((time.monotonic() - started) * 1000)))
 
     
     # --- RAG MEMORY COMMANDS ---
 
     @commands.hybrid_command(name='ingat', description='Store a fact about yourself in the bot\'s memory.')
     async def ingat_fakta(self, ctx, *, fakta: str):
-        if not r:
-            return await ctx.reply("❌ Memory system is offline. Please check Redis connection.", ephemeral=True)
-            
         user_id = str(ctx.author.id)
-        user_data_key = f"memory_{user_id}"
         await ctx.defer(ephemeral=True)
 
         try:
-            user_memory_raw = r.get(user_data_key)
-            if user_memory_raw:
-                user_memory = json.loads(user_memory_raw)
-            else:
-                user_memory = {"facts": [], "preferences": {}}
-
-            # RAG Cleaning Call (to Groq)
-            cleaning_prompt = f"Change the following sentence into a concise third-person fact (max 10 words). Example: 'My birthday is Dec 10' -> 'Their birthday is December 10th.' Sentence: '{fakta}'"
-
-            chat_completion = await groq_client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": "You are a concise fact cleaning machine."},
-                    {"role": "user", "content": cleaning_prompt}
-                ],
-                model=MODEL_GROQ,
-                temperature=0.0,
-                max_tokens=50
-            )
-            fakta_bersih = chat_completion.choices[0].message.content.strip().replace('"', '')
+            # Stored raw right away; the background cleaner rewrites it into a
+            # third-person fact in a batched Groq call a few seconds later.
+            # Without Groq there is no cleaner, so it is stored as final.
+            _, total_facts = await self.memory.add_fact(user_id, fakta, raw=bool(GROQ_API_KEY))
 
-            user_memory["facts"].append(fakta_bersih)
-            r.set(user_data_key, json.dumps(user_memory))
-
-            embed = discord.Embed(title="✅ Fact Stored", description=f"Bot now remembers about you:\n>>> **{fakta_bersih}**", color=discord.Color.green())
-            embed.set_footer(text=f"Total facts stored: {len(user_memory['facts'])}")
+            embed = discord.Embed(title="✅ Fact Stored", description=f"Bot now remembers about you:\n>>> **{fakta}**", color=discord.Color.green())
+            embed.set_footer(text=f"Total facts stored: {total_facts}")
             await ctx.reply(embed=embed, ephemeral=True)
 
-        except groq.RateLimitError:
-            await ctx.reply("Oops, AI is overwhelmed while processing memory (Rate Limit)!", ephemeral=True)
+        except MemoryOffline:
+            await ctx.reply(MEMORY_OFFLINE_MSG, ephemeral=True)
         except Exception as e:
             await ctx.reply(f"❌ ERROR: Failed to save memory. {e}", ephemeral=True)
 
 
     @commands.hybrid_command(name='daftar_ingatan', description='View all facts stored by the bot about you.')
-    async def daftar_ingatan(self, ctx):
-        if not r:
-            return await ctx.reply("❌ Memory system is offline. Please check Redis connection.", ephemeral=True)
-            
+    async def daftar_ingatan(self, ctx, halaman: int = 1):
         user_id = str(ctx.author.id)
-        user_data_key = f"memory_{user_id}"
+        start = (max(halaman, 1) - 1) * FACTS_PER_PAGE
 
-        user_memory_raw = r.get(user_data_key)
-        if user_memory_raw:
-            user_memory = json.loads(user_memory_raw)
-        else:
-            user_memory = {"facts": []}
+        try:
+            total_facts, facts = await self.memory.get_facts(user_id, start, start + FACTS_PER_PAGE - 1)
+        except MemoryOffline:
+            return await ctx.reply(MEMORY_OFFLINE_MSG, ephemeral=True)
 
-        if not user_memory.get("facts"):
+        if not total_facts:
             return await ctx.reply("❌ No facts stored about you. Use `/ingat [fact]`.", ephemeral=True)
+        if not facts:
+            return await ctx.reply(f"❌ Page {halaman} is empty. You have {total_facts} fact(s) stored.", ephemeral=True)
 
-        fact_list = [f"**{i+1}.** {fakta}" for i, fakta in enumerate(user_memory["facts"])]
+        total_pages = (total_facts + FACTS_PER_PAGE - 1) // FACTS_PER_PAGE
+        fact_list = [f"**{start+i+1}.** {fakta['text']}{' ⏳' if fakta.get('raw') else ''}" for i, fakta in enumerate(facts)]
 
         embed = discord.Embed(
             title=f"🧠 Z-Bot's Notebook on {ctx.author.display_name}",
             description="\n".join(fact_list),
             color=discord.Color.blue()
         )
-        embed.set_footer(text="Gunakan /lupa [nomor] untuk menghapus fakta.")
+        embed.set_footer(text=f"Page {max(halaman, 1)}/{total_pages} | Gunakan /lupa [nomor] untuk menghapus fakta.")
         await ctx.reply(embed=embed, ephemeral=True)
 
 
     @commands.hybrid_command(name='lupa', description='Delete a fact from the bot\'s memory by number or all.')
     async def lupa_fakta(self, ctx, nomor: str):
-        if not r:
-            return await ctx.reply("❌ Memory system is offline. Please check Redis connection.", ephemeral=True)
-
         user_id = str(ctx.author.id)
-        user_data_key = f"memory_{user_id}"
 
         if nomor.lower() == 'semua':
-            r.delete(user_data_key)
+            try:
+                await self.memory.clear_memory(user_id)
+            except MemoryOffline:
+                return await ctx.reply(MEMORY_OFFLINE_MSG, ephemeral=True)
             return await ctx.reply("✅ SUKSES! All memory about you has been wiped. Bot is now completely amnesiac.", ephemeral=True)
 
         try:
@@ -415,17 +749,16 @@ Known facts about {user_display_name}:
         except ValueError:
             return await ctx.reply("❌ Enter a valid fact number (e.g., 1, 2, 3) or the word 'semua'.", ephemeral=True)
 
-        user_memory_raw = r.get(user_data_key)
-        if user_memory_raw:
-            user_memory = json.loads(user_memory_raw)
-        else:
-            user_memory = {"facts": []}
-
-        if not user_memory.get("facts") or nomor_index < 0 or nomor_index >= len(user_memory["facts"]):
+        if nomor_index < 0:
             return await ctx.reply(f"❌ Fact number '{nomor}' is invalid. Check `/daftar_ingatan` for available numbers.", ephemeral=True)
 
-        fakta_terlupa = user_memory["facts"].pop(nomor_index)
-        r.set(user_data_key, json.dumps(user_memory))
+        try:
+            fakta_terlupa = await self.memory.remove_fact(user_id, nomor_index)
+        except MemoryOffline:
+            return await ctx.reply(MEMORY_OFFLINE_MSG, ephemeral=True)
+
+        if fakta_terlupa is None:
+            return await ctx.reply(f"❌ Fact number '{nomor}' is invalid. Check `/daftar_ingatan` for available numbers.", ephemeral=True)
 
         embed = discord.Embed(
             title="🗑️ Fact Deleted",
@@ -436,45 +769,124 @@ Known facts about {user_display_name}:
 
 
     # --- ADMIN / SETUP COMMANDS ---
+    @commands.hybrid_command(name='ai_cache_stats', description='(Admin) Shows the AI response cache hit rate and tokens saved.')
+    @commands.has_permissions(administrator=True)
+    async def ai_cache_stats(self, ctx):
+        if not self.response_cache.enabled:
+            return await ctx.reply("ℹ️ Response cache is disabled (set AI_RESPONSE_CACHE=1).", ephemeral=True)
+        try:
+            stats = await self.response_cache.stats()
+        except MemoryOffline:
+            return await ctx.reply(MEMORY_OFFLINE_MSG, ephemeral=True)
+
+        embed = discord.Embed(title="📦 AI Response Cache", color=discord.Color.blue())
+        embed.add_field(name="Hit Rate", value=f"{stats['hit_rate'] * 100:.1f}%", inline=True)
+        embed.add_field(name="Exact Hits", value=stats["hits_exact"], inline=True)
+        embed.add_field(name="Similar Hits", value=stats["hits_similar"], inline=True)
+        embed.add_field(name="Misses", value=stats["misses"], inline=True)
+        embed.add_field(name="Groq Tokens Saved", value=stats["tokens_saved"], inline=True)
+        await ctx.reply(embed=embed, ephemeral=True)
+
+
     @commands.hybrid_command(name='setup_persona', description='(Admin) Sets up core safety rails for the bot.')
     @commands.has_permissions(administrator=True)
     async def setup_persona(self, ctx):
-        if not r:
-            return await ctx.reply("❌ Memory system is offline. Please check Redis connection.", ephemeral=True)
-            
         await ctx.defer(ephemeral=True) 
 
         try:
-            r.set("prompt_rails", DEFAULT_RAILS)
+            await self.memory.set_rails(DEFAULT_RAILS)
+            self.prompts.invalidate()
             await ctx.reply("✅ SUCCESS! Core safety rails have been setup.", ephemeral=True)
 
         except Exception as e:
             await ctx.reply(f"❌ ERROR: Failed to save to DB. {e}", ephemeral=True)
 
     
-    # --- MESSAGE LISTENER ---
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if message.author.bot:
+    # --- MESSAGE HANDLERS (fed by the MessageRouter, already classified) ---
+    async def record_history(self, message: discord.Message, kind):
+        if message.guild is not None:
+            self.history.record(message)
+
+    async def handle_ai_message(self, message: discord.Message, kind):
+        is_reply_to_bot = kind == AI_REPLY
+        prompt_text = message.content.replace(self.bot.user.mention, "").strip()
+        if not prompt_text and is_reply_to_bot:
             return
 
-        is_mention = message.content.startswith(self.bot.user.mention)
-        is_reply_to_bot = False
-        if message.reference and message.reference.resolved:
-            if message.reference.resolved.author == self.bot.user:
-                is_reply_to_bot = True
+        if not prompt_text:
+            prompt_text = "Hello! What can I help you with?"
 
-        if is_mention or is_reply_to_bot:
-            prompt_text = message.content.replace(self.bot.user.mention, "").strip()
+        # Rate limit first: a rejected prompt must not cancel the answer already on its way
+        wait = await self.cooldowns.allow(f"ai_mention:{message.author.id}", AI_MENTION_LIMIT, AI_MENTION_WINDOW)
+        if wait:
+            await message.reply(f"Slow down a bit! Try again in {math.ceil(wait)} seconds.", delete_after=10)
+            return
 
-            if not prompt_text and not is_reply_to_bot: 
-                await self.panggil_ai(message, "Hello! What can I help you with?") 
+        if self.jobs is not None:
+            # Queue mode: an AI worker process answers it (python ai_jobs.py worker).
+            # Workers don't report back to the gateway, so queued prompts are never
+            # merged or superseded: each accepted mention gets its own answer
+            try:
+                await self.jobs.enqueue(build_job(message, prompt_text, ROLE_LANGUAGE_MAP))
                 return
-            elif not prompt_text and is_reply_to_bot:
-                return 
+            except MemoryOffline as e:
+                log.warning(f"Redis offline, answering inline. Error: {e}", extra=message_extra(message))
+
+        # Same user again while their previous prompt is still being answered:
+        # an identical prompt is merged into it, a different one replaces it
+        user_key = (message.channel.id, message.author.id)
+        prompt_key = normalize_prompt(prompt_text)
+        previous = self.user_requests.get(user_key)
+        if previous is not None and not previous[1].done():
+            if previous[0] == prompt_key:
+                GROQ_CALLS_SAVED.inc(reason="merged")
+                return
+            self.superseded.add(previous[2])
+            previous[1].cancel()
+            GROQ_CALLS_SAVED.inc(reason="superseded")
 
-            await self.panggil_ai(message, prompt_text)
-            return
+        task = asyncio.create_task(self.panggil_ai(message, prompt_text))
+        entry = self.user_requests[user_key] = (prompt_key, task, message.id)
+        try:
+            await task
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                task.cancel()
+                raise
+            # Superseded by the same user's newer prompt
+        finally:
+            if self.user_requests.get(user_key) is entry:
+                del self.user_requests[user_key]
+            self.superseded.discard(message.id)
+
+    async def cog_unload(self):
+        if self.warm_up_task:
+            self.warm_up_task.cancel()
+        self.router.unsubscribe(self.record_history)
+        self.router.unsubscribe(self.handle_ai_message)
+        if self.rails_listener:
+            self.rails_listener.cancel()
+        await self.fact_cleaner.close()
+        await self.scheduler.close()
+        self.language.close()
+        await close_redis()
+
+    # --- HISTORY BUFFER UPKEEP ---
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # A new session may have skipped events, so the buffers are no longer contiguous
+        self.history.clear()
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        if "content" in payload.data:
+            self.history.edit(payload.channel_id, payload.message_id, payload.data["content"])
+            self.translations.discard(payload.message_id)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        self.history.delete(payload.channel_id, payload.message_id)
+        self.translations.discard(payload.message_id)
 
 # --- SETUP FUNCTION ---
 async def setup(bot):
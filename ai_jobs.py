@@ -0,0 +1,366 @@
+import asyncio
+import json
+import os
+import socket
+import sys
+import time
+import discord
+from memory_store import MemoryStore, MemoryOffline
+from channel_history import ChannelHistoryBuffer, TranslationCache
+from logs import get_logger
+
+log = get_logger("ai_jobs")
+
+# --- AI JOB QUEUE CONFIGURATION ---
+# "inline": the gateway process answers AI mentions itself (default)
+# "queue": the gateway only enqueues jobs; `python ai_jobs.py worker` processes answer them
+#          (opt-in: add `aiworker: python ai_jobs.py worker` to the Procfile and set AI_JOB_MODE=queue)
+AI_JOB_MODE = os.environ.get("AI_JOB_MODE", "inline")
+AI_JOB_STREAM = "ai_jobs"
+AI_JOB_GROUP = "ai_workers"
+AI_JOB_ATTEMPTS_KEY = "ai_jobs:attempts"                                   # entry id -> deliveries so far
+AI_JOB_STREAM_MAXLEN = int(os.environ.get("AI_JOB_STREAM_MAXLEN", 10000))
+AI_JOB_VISIBILITY = float(os.environ.get("AI_JOB_VISIBILITY", 90.0))      # Seconds before an unacked job is redelivered
+AI_JOB_MAX_DELIVERIES = int(os.environ.get("AI_JOB_MAX_DELIVERIES", 3))
+AI_JOB_DEDUP_TTL = int(os.environ.get("AI_JOB_DEDUP_TTL", 3600))          # Seconds a message id is remembered
+AI_WORKER_CONCURRENCY = int(os.environ.get("AI_WORKER_CONCURRENCY", 4))   # Jobs in flight per worker process
+AI_WORKER_BLOCK_MS = 2000                                                  # Must stay under REDIS_CALL_TIMEOUT
+
+# Enqueue once per Discord message id: KEYS seen marker, stream | ARGV ttl, maxlen, job json
+ENQUEUE_SCRIPT = """
+if redis.call('SET', KEYS[1], 1, 'NX', 'EX', ARGV[1]) then
+    return redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], '*', 'job', ARGV[3])
+end
+return false
+"""
+
+
+def build_job(message, prompt_text, language_roles):
+    """The compact, JSON-safe part of an AI mention a worker needs to answer it."""
+    job = {
+        "message_id": message.id,
+        "channel_id": message.channel.id,
+        "channel_name": getattr(message.channel, "name", None),
+        "guild_id": message.guild.id if message.guild else None,
+        "guild_name": message.guild.name if message.guild else None,
+        "author_id": message.author.id,
+        "author_name": message.author.display_name,
+        "role_ids": [role.id for role in getattr(message.author, "roles", ()) if role.id in language_roles],  # Language hints
+        "prompt": prompt_text,
+        "has_reference": message.reference is not None,
+        "reference_id": message.reference.message_id if message.reference else None,  # Continues a cached conversation thread
+        "reference": None,
+        "enqueued_at": time.time(),
+    }
+    resolved = message.reference.resolved if message.reference else None
+    if isinstance(resolved, discord.Message):
+        job["reference"] = {
+            "author_name": resolved.author.display_name,
+            "author_bot": resolved.author.bot,
+            "content": resolved.content,
+        }
+    return job
+
+
+def job_extra(entry_id, job, **fields):
+    """extra= for a log call about a job: its ids and how long ago it was enqueued."""
+    return {"fields": {
+        "entry_id": entry_id,
+        "message_id": job["message_id"],
+        "guild_id": job["guild_id"],
+        "channel_id": job["channel_id"],
+        "user_id": job["author_id"],
+        "latency_ms": round((time.time() - job["enqueued_at"]) * 1000),
+        **fields,
+    }}
+
+
+class AIJobQueue:
+    """
+    Redis-stream job queue between the gateway and the AI workers:
+    - enqueue() is deduplicated by Discord message id (gateway replays, several gateway processes)
+    - workers read through one consumer group; a job stays pending until ack()
+    - jobs left unacked for AI_JOB_VISIBILITY seconds (crashed worker) are
+      reclaimed by another worker, up to AI_JOB_MAX_DELIVERIES deliveries,
+      so delivery is at-least-once; a "done" marker per message id keeps
+      a redelivered job from being answered twice
+    """
+
+    def __init__(self, store=None, stream=AI_JOB_STREAM, group=AI_JOB_GROUP):
+        self.store = store or MemoryStore()
+        self.stream = stream
+        self.group = group
+        self._enqueue_script = None
+
+    @staticmethod
+    def _seen_key(message_id):
+        return f"ai_jobs:seen:{message_id}"
+
+    @staticmethod
+    def _done_key(message_id):
+        return f"ai_jobs:done:{message_id}"
+
+    # --- PRODUCER (gateway) ---
+    async def enqueue(self, job):
+        """Returns the stream entry id, or None if this message was already queued."""
+        def op(client):
+            if self._enqueue_script is None:
+                self._enqueue_script = client.register_script(ENQUEUE_SCRIPT)
+            return self._enqueue_script(
+                keys=[self._seen_key(job["message_id"]), self.stream],
+                args=[AI_JOB_DEDUP_TTL, AI_JOB_STREAM_MAXLEN, json.dumps(job, ensure_ascii=False)],
+                client=client,
+            )
+        return await self.store.run(op)
+
+    # --- CONSUMER (workers) ---
+    async def ensure_group(self):
+        async def op(client):
+            try:
+                await client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+            except Exception as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+        await self.store.run(op)
+
+    async def claim(self, consumer, count, block_ms=AI_WORKER_BLOCK_MS):
+        """
+        Returns up to `count` [(entry id, job)]: stale jobs from dead workers
+        first, then new ones. Jobs past AI_JOB_MAX_DELIVERIES are dropped.
+        """
+        async def op(client):
+            reclaimed = await client.xautoclaim(
+                self.stream, self.group, consumer, min_idle_time=int(AI_JOB_VISIBILITY * 1000), start_id="0-0", count=count,
+            )
+            entries = [entry for entry in reclaimed[1] if entry[1]]
+            if not entries:
+                response = await client.xreadgroup(self.group, consumer, {self.stream: ">"}, count=count, block=block_ms)
+                entries = response[0][1] if response else []
+            if entries:
+                pipe = client.pipeline(transaction=False)
+                for entry_id, _ in entries:
+                    pipe.hincrby(AI_JOB_ATTEMPTS_KEY, entry_id, 1)
+                attempts = await pipe.execute()
+            else:
+                attempts = []
+            return entries, attempts
+
+        entries, attempts = await self.store.run(op)
+        jobs = []
+        for (entry_id, fields), delivery in zip(entries, attempts):
+            job = json.loads(fields["job"])
+            if delivery > AI_JOB_MAX_DELIVERIES:
+                log.warning(f"Dropping job {entry_id} after {delivery - 1} failed deliveries.", extra=job_extra(entry_id, job))
+                await self.ack(entry_id)
+                continue
+            jobs.append((entry_id, job))
+        return jobs
+
+    async def touch(self, consumer, entry_ids):
+        """Resets the idle time of jobs still being worked on, so they aren't redelivered."""
+        if entry_ids:
+            await self.store.run(lambda c: c.xclaim(self.stream, self.group, consumer, 0, list(entry_ids), justid=True))
+
+    async def is_done(self, job):
+        return bool(await self.store.run(lambda c: c.exists(self._done_key(job["message_id"]))))
+
+    def _ack_into(self, pipe, entry_id):
+        pipe.xack(self.stream, self.group, entry_id)
+        pipe.xdel(self.stream, entry_id)
+        pipe.hdel(AI_JOB_ATTEMPTS_KEY, entry_id)
+
+    async def complete(self, entry_id, job):
+        """Marks the message as answered, then acks the job."""
+        def op(client):
+            pipe = client.pipeline(transaction=False)
+            pipe.set(self._done_key(job["message_id"]), 1, ex=AI_JOB_DEDUP_TTL)
+            self._ack_into(pipe, entry_id)
+            return pipe.execute()
+        await self.store.run(op)
+
+    async def ack(self, entry_id):
+        def op(client):
+            pipe = client.pipeline(transaction=False)
+            self._ack_into(pipe, entry_id)
+            return pipe.execute()
+        await self.store.run(op)
+
+    async def depth(self):
+        return await self.store.run(lambda c: c.xlen(self.stream))
+
+
+# --- WORKER SIDE: A MESSAGE REBUILT FROM A JOB ---
+class _JobUser:
+    __slots__ = ("id", "display_name", "roles", "bot")
+
+    def __init__(self, id, display_name, roles=(), bot=False):
+        self.id = id
+        self.display_name = display_name
+        self.roles = list(roles)
+        self.bot = bot
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class _JobReferenced:
+    __slots__ = ("author", "content")
+
+    def __init__(self, author, content):
+        self.author = author
+        self.content = content
+
+
+class _JobReference:
+    __slots__ = ("message_id", "resolved")
+
+    def __init__(self, message_id, resolved):
+        self.message_id = message_id
+        self.resolved = resolved
+
+
+class _JobGuild:
+    __slots__ = ("id", "name")
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class _JobChannel:
+    """PartialMessageable (REST only) plus the channel name carried in the job."""
+
+    def __init__(self, channel, name):
+        self._channel = channel
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._channel, attr)
+
+
+class JobMessage:
+    """
+    Stand-in for the discord.Message a job was built from, with the fields
+    panggil_ai reads; replies and sends go straight through the REST API.
+    """
+
+    def __init__(self, client, job):
+        self.id = job["message_id"]
+        self.content = job["prompt"]
+        self.guild = _JobGuild(job["guild_id"], job["guild_name"]) if job["guild_id"] else None
+        self.channel = _JobChannel(client.get_partial_messageable(job["channel_id"], guild_id=job["guild_id"]), job["channel_name"])
+        self.author = _JobUser(job["author_id"], job["author_name"], roles=[discord.Object(id=r) for r in job["role_ids"]])
+        self.reference = None
+        if job["has_reference"]:
+            ref = job["reference"]
+            resolved = None
+            if ref:
+                resolved = _JobReferenced(_JobUser(0, ref["author_name"], bot=ref["author_bot"]), ref["content"])
+            self.reference = _JobReference(job.get("reference_id"), resolved)
+        self._partial = self.channel.get_partial_message(self.id)
+
+    async def reply(self, *args, **kwargs):
+        return await self._partial.reply(*args, **kwargs)
+
+
+# --- WORKER PROCESS ---
+async def run_worker(concurrency=AI_WORKER_CONCURRENCY):
+    """
+    Answers queued AI jobs over the REST API (no gateway connection).
+    Scale by running more worker processes; note that GROQ_RPM / GROQ_TPM
+    are enforced per process, so split the account's limits between them.
+    """
+    os.environ.setdefault("COOLDOWN_BACKEND", "redis")  # Translator cooldowns are shared with the other workers
+    os.environ.setdefault("CONVERSATION_BACKEND", "redis")  # Any worker may get the next message of a thread
+    from discord.ext import commands
+    from ai_cog import AICog
+
+    token = os.environ.get("DISCORD_TOKEN")
+    if not token:
+        sys.exit("ERROR: DISCORD_TOKEN not found!")
+
+    bot = commands.Bot(command_prefix="$", intents=discord.Intents.none())
+    await bot.login(token)  # REST only
+    cog = AICog(bot)
+    await cog.cog_load()
+    from metrics import start_metrics_server
+    from memory_store import ensure_memory_schema
+    await start_metrics_server()
+    await ensure_memory_schema()  # Waits if a bot process is still migrating
+    try:
+        await consume_jobs(cog, bot, concurrency)
+    finally:
+        await cog.cog_unload()
+        await bot.close()
+
+
+async def consume_jobs(cog, client, concurrency=AI_WORKER_CONCURRENCY, consumer=None):
+    """The worker loop: claims jobs and answers them with `cog`, replying through `client`, until cancelled."""
+    queue = AIJobQueue(cog.memory)
+    consumer = consumer or f"{socket.gethostname()}:{os.getpid()}"
+    in_flight = {}  # entry id -> task
+
+    # No gateway events reach a worker, so nothing could keep these in sync with
+    # new, edited or deleted messages: translations read REST history and keep nothing
+    cog.history = ChannelHistoryBuffer(gateway_fed=False)
+    cog.translations = TranslationCache(max_messages=0)
+
+    async def heartbeat(entry_id, job):
+        """Keeps a long-running job from looking abandoned and being redelivered."""
+        while True:
+            await asyncio.sleep(AI_JOB_VISIBILITY / 3)
+            try:
+                await queue.touch(consumer, [entry_id])
+            except MemoryOffline as e:
+                log.warning(f"Could not extend job {entry_id}. Error: {e}", extra=job_extra(entry_id, job))
+
+    async def handle(entry_id, job):
+        beat = asyncio.create_task(heartbeat(entry_id, job))
+        try:
+            if await queue.is_done(job):
+                await queue.ack(entry_id)  # Answered before, the ack was lost
+                return
+            await cog.panggil_ai(JobMessage(client, job), job["prompt"])
+            await queue.complete(entry_id, job)
+        except MemoryOffline as e:
+            log.warning(f"Redis offline, job {entry_id} will be redelivered. Error: {e}", extra=job_extra(entry_id, job))
+        except Exception as e:
+            log.warning(f"Job {entry_id} failed, will be redelivered. Error: {e}", extra=job_extra(entry_id, job))
+        finally:
+            beat.cancel()
+            in_flight.pop(entry_id, None)
+
+    log.info(f"AI Worker {consumer}: consuming '{AI_JOB_STREAM}' ({concurrency} at a time)")
+    try:
+        while True:
+            try:
+                await queue.ensure_group()
+                break
+            except MemoryOffline as e:
+                log.warning(f"Waiting for Redis. Error: {e}")
+                await asyncio.sleep(2)
+
+        while True:
+            free = concurrency - len(in_flight)
+            if free <= 0:
+                await asyncio.wait(list(in_flight.values()), return_when=asyncio.FIRST_COMPLETED)
+                continue
+            try:
+                jobs = await queue.claim(consumer, free)
+            except MemoryOffline as e:
+                log.warning(f"Redis offline. Error: {e}")
+                await asyncio.sleep(1)
+                continue
+            for entry_id, job in jobs:
+                in_flight[entry_id] = asyncio.create_task(handle(entry_id, job))
+    finally:
+        await asyncio.gather(*in_flight.values(), return_exceptions=True)
+
+if __name__ == "__main__":
+    # Usage: python ai_jobs.py worker
+    if len(sys.argv) != 2 or sys.argv[1] != "worker":
+        sys.exit("Usage: python ai_jobs.py worker")
+    asyncio.run(run_worker())
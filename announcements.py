@@ -0,0 +1,110 @@
+import asyncio
+import json
+import os
+import discord
+from logs import get_logger
+
+log = get_logger("announcements")
+
+# --- LEVEL-UP ANNOUNCEMENT CONFIGURATION ---
+ANNOUNCE_WINDOW = float(os.environ.get("ANNOUNCE_WINDOW", 2.0))              # Seconds level-ups are gathered per channel
+ANNOUNCE_MIN_INTERVAL = float(os.environ.get("ANNOUNCE_MIN_INTERVAL", 1.25))  # Min gap between sends to one channel (5 per 5s bucket)
+ANNOUNCE_MAX_CHARS = 2000
+# Optional dedicated channel per guild, e.g. '{"123456789": 987654321}'
+LEVELUP_CHANNELS = {int(g): int(c) for g, c in json.loads(os.environ.get("LEVELUP_CHANNELS") or "{}").items()}
+
+
+class _PendingChannel:
+    __slots__ = ("channel", "users", "task")
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.users = {}  # user_id -> (member, {track name: level})
+        self.task = None
+
+
+class AnnouncementDispatcher:
+    """
+    Outbound queue for level-up messages. announce() only records the level-up
+    and returns; one sender task per destination channel waits ANNOUNCE_WINDOW
+    seconds, merges everything gathered for that channel (several tracks,
+    several users) into one message and keeps at least ANNOUNCE_MIN_INTERVAL
+    between sends, so bursts stay inside the channel's rate-limit bucket
+    and the XP path never waits on Discord.
+    """
+
+    def __init__(self, bot, channels=LEVELUP_CHANNELS, window=ANNOUNCE_WINDOW, min_interval=ANNOUNCE_MIN_INTERVAL):
+        self.bot = bot
+        self.channels = channels  # guild_id -> dedicated announcement channel id
+        self.window = window
+        self.min_interval = min_interval
+        self._pending = {}  # channel_id -> _PendingChannel
+        self._closed = asyncio.Event()
+
+    def destination(self, guild_id, fallback):
+        channel_id = self.channels.get(guild_id)
+        channel = self.bot.get_channel(channel_id) if channel_id else None
+        return channel or fallback
+
+    def announce(self, guild_id, channel, member, level_ups):
+        """level_ups: [(track name, new level)]. Never blocks."""
+        if not level_ups or self._closed.is_set():
+            return
+        channel = self.destination(guild_id, channel)
+        pending = self._pending.get(channel.id)
+        if pending is None:
+            pending = self._pending[channel.id] = _PendingChannel(channel)
+        _, levels = pending.users.setdefault(member.id, (member, {}))
+        for track_name, level in level_ups:
+            levels[track_name] = max(level, levels.get(track_name, 0))
+        if pending.task is None:
+            pending.task = asyncio.create_task(self._sender(channel.id))
+
+    async def close(self):
+        """Sends whatever is still queued, right away."""
+        self._closed.set()
+        tasks = [pending.task for pending in self._pending.values() if pending.task]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _pause(self, seconds):
+        try:
+            await asyncio.wait_for(self._closed.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _sender(self, channel_id):
+        pending = self._pending[channel_id]
+        try:
+            while pending.users:
+                await self._pause(self.window)
+                users, pending.users = pending.users, {}
+                for content in render_level_ups(users.values()):
+                    try:
+                        await pending.channel.send(content, allowed_mentions=discord.AllowedMentions(users=True))
+                    except discord.HTTPException as e:
+                        log.warning(f"Send to channel {channel_id} failed. Error: {e}")
+                    await self._pause(self.min_interval)
+        finally:
+            # Anything queued after the last send gets a fresh sender
+            if pending.users and not self._closed.is_set():
+                pending.task = asyncio.create_task(self._sender(channel_id))
+            else:
+                del self._pending[channel_id]
+
+
+def render_level_ups(entries):
+    """entries: [(member, {track name: level})] -> message contents within Discord's limit."""
+    lines = []
+    for member, levels in entries:
+        reached = " and ".join(f"Level {level} for **{name}**" for name, level in levels.items())
+        lines.append(f"🎉 Congrats {member.mention}, you reached {reached}!")
+
+    chunks, current = [], ""
+    for line in lines:
+        if current and len(current) + 1 + len(line) > ANNOUNCE_MAX_CHARS:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        chunks.append(current)
+    return chunks
@@ -0,0 +1,169 @@
+import os
+from collections import OrderedDict, deque
+import discord
+from metrics import CACHE_REQUESTS
+
+# --- HISTORY BUFFER CONFIGURATION ---
+HISTORY_PER_CHANNEL = int(os.environ.get("HISTORY_PER_CHANNEL", 50))           # Human messages kept per channel
+HISTORY_MAX_CHANNELS = int(os.environ.get("HISTORY_MAX_CHANNELS", 500))        # Least recently active channels are dropped
+HISTORY_MAX_CHARS = int(os.environ.get("HISTORY_MAX_CHARS", 2_000_000))        # Rough memory cap across all channels
+HISTORY_BACKFILL_SCAN = 5                                                      # REST scan at most limit * this many messages
+TRANSLATION_CACHE_SIZE = int(os.environ.get("TRANSLATION_CACHE_SIZE", 5000))   # Messages with cached translations
+
+
+class BufferedMessage:
+    __slots__ = ("id", "author_name", "content")
+
+    def __init__(self, id, author_name, content):
+        self.id = id
+        self.author_name = author_name
+        self.content = content
+
+    @classmethod
+    def from_message(cls, message):
+        return cls(message.id, message.author.display_name, message.content)
+
+
+class _ChannelBuffer:
+    __slots__ = ("messages", "chars", "exhausted")
+
+    def __init__(self):
+        self.messages = deque(maxlen=HISTORY_PER_CHANNEL)
+        self.chars = 0
+        self.exhausted = False  # The buffer holds everything back to the start of the channel
+
+
+class ChannelHistoryBuffer:
+    """
+    Per-channel ring buffer of recent human messages, fed by gateway events.
+    Everything from the oldest buffered message onwards is contiguous, so the
+    translator can read its window from memory and only call the REST history
+    endpoint to backfill what is older than the buffer.
+    With gateway_fed=False (a process that gets no message events, like an AI
+    worker) nothing is buffered and every window is read over REST.
+    """
+
+    def __init__(self, gateway_fed=True):
+        self.gateway_fed = gateway_fed
+        self._channels = OrderedDict()  # channel_id -> _ChannelBuffer
+        self._chars = 0
+
+    def clear(self):
+        """After a fresh gateway session, events may have been missed."""
+        self._channels.clear()
+        self._chars = 0
+
+    def _buffer(self, channel_id):
+        buf = self._channels.get(channel_id)
+        if buf is None:
+            buf = self._channels[channel_id] = _ChannelBuffer()
+        self._channels.move_to_end(channel_id)
+        return buf
+
+    def _account(self, buf, delta):
+        buf.chars += delta
+        self._chars += delta
+        while (len(self._channels) > HISTORY_MAX_CHANNELS or self._chars > HISTORY_MAX_CHARS) and len(self._channels) > 1:
+            _, evicted = self._channels.popitem(last=False)
+            self._chars -= evicted.chars
+
+    # --- GATEWAY FEED ---
+    def record(self, message):
+        buf = self._buffer(message.channel.id)
+        if len(buf.messages) == buf.messages.maxlen:
+            dropped = buf.messages[0]
+            self._account(buf, -len(dropped.content))
+            buf.exhausted = False  # The start of the channel is no longer buffered
+        buf.messages.append(BufferedMessage.from_message(message))
+        self._account(buf, len(message.content))
+
+    def edit(self, channel_id, message_id, content):
+        buf = self._channels.get(channel_id)
+        for record in buf.messages if buf else ():
+            if record.id == message_id:
+                self._account(buf, len(content) - len(record.content))
+                record.content = content
+                return
+
+    def delete(self, channel_id, message_id):
+        buf = self._channels.get(channel_id)
+        for record in buf.messages if buf else ():
+            if record.id == message_id:
+                buf.messages.remove(record)
+                self._account(buf, -len(record.content))
+                return
+
+    # --- READ ---
+    @staticmethod
+    async def _fetch(channel, before_id, needed, limit):
+        """REST: up to `needed` human messages before `before_id`, oldest first, and whether the channel start was reached."""
+        fetched = []
+        scanned = 0
+        async for msg in channel.history(limit=limit * HISTORY_BACKFILL_SCAN, before=discord.Object(id=before_id)):
+            scanned += 1
+            if msg.author.bot:
+                continue
+            fetched.append(BufferedMessage.from_message(msg))
+            if len(fetched) >= needed:
+                break
+        fetched.reverse()
+        return fetched, scanned < limit * HISTORY_BACKFILL_SCAN and len(fetched) < needed
+
+    async def window(self, channel, before, limit):
+        """Returns up to `limit` human messages right before `before`, oldest first."""
+        if not self.gateway_fed:
+            fetched, _ = await self._fetch(channel, before.id, limit, limit)
+            return fetched
+        buf = self._buffer(channel.id)
+        records = [record for record in buf.messages if record.id < before.id][-limit:]
+        if len(records) >= limit or buf.exhausted:
+            return records
+
+        # Backfill only the part older than what we have
+        oldest_id = records[0].id if records else before.id
+        fetched, reached_start = await self._fetch(channel, oldest_id, limit - len(records), limit)
+
+        # Keep the backfill only if it extends the contiguous buffer from its oldest end
+        if not buf.messages or buf.messages[0].id == oldest_id:
+            kept = 0
+            for record in reversed(fetched):
+                if len(buf.messages) >= buf.messages.maxlen:
+                    break
+                buf.messages.appendleft(record)
+                self._account(buf, len(record.content))
+                kept += 1
+            # Only trusted while the buffer really reaches back to the channel's first message
+            buf.exhausted = reached_start and kept == len(fetched)
+        return fetched + records
+
+
+class TranslationCache:
+    """LRU of per-message translations: message id -> {target language: text}."""
+
+    def __init__(self, max_messages=TRANSLATION_CACHE_SIZE):
+        self.max_messages = max_messages
+        self._entries = OrderedDict()
+
+    def get_many(self, message_ids, lang):
+        found = {}
+        for message_id in message_ids:
+            text = self._entries.get(message_id, {}).get(lang)
+            if text is not None:
+                found[message_id] = text
+                self._entries.move_to_end(message_id)
+        CACHE_REQUESTS.inc(len(found), cache="translation", result="hit")
+        CACHE_REQUESTS.inc(len(message_ids) - len(found), cache="translation", result="miss")
+        return found
+
+    def put_many(self, translations, lang):
+        for message_id, text in translations.items():
+            self._entries.setdefault(message_id, {})[lang] = text
+            self._entries.move_to_end(message_id)
+        while len(self._entries) > self.max_messages:
+            self._entries.popitem(last=False)
+
+    def discard(self, message_id):
+        self._entries.pop(message_id, None)
+
+    def clear(self):
+        self._entries.clear()
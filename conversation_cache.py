@@ -0,0 +1,180 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from groq_scheduler import estimate_tokens
+from memory_store import MemoryOffline
+from logs import get_logger
+
+log = get_logger("conversation_cache")
+
+# --- CONVERSATION CACHE CONFIGURATION ---
+CONVERSATION_TOKEN_BUDGET = int(os.environ.get("CONVERSATION_TOKEN_BUDGET", 1500))  # Prompt tokens spent on earlier turns
+CONVERSATION_MAX_TURNS = int(os.environ.get("CONVERSATION_MAX_TURNS", 20))          # Hops walked up one reply chain
+CONVERSATION_PER_CHANNEL = int(os.environ.get("CONVERSATION_PER_CHANNEL", 200))     # Bot replies remembered per channel
+CONVERSATION_MAX_CHANNELS = int(os.environ.get("CONVERSATION_MAX_CHANNELS", 500))   # Least recently active channels are dropped
+CONVERSATION_TTL = int(os.environ.get("CONVERSATION_TTL", 6 * 3600))                # Seconds a turn can be continued
+CONVERSATION_BACKEND = os.environ.get("CONVERSATION_BACKEND", "memory")             # "memory" or "redis" (shared by every process)
+CONVERSATION_SUMMARIZE = os.environ.get("CONVERSATION_SUMMARIZE", "0") == "1"       # Summarize turns past the budget instead of dropping them
+CONVERSATION_PREFIX = "conversation"
+
+
+class Turn:
+    """One bot reply and the prompt that produced it. `summary` covers the thread up to and including this turn."""
+    __slots__ = ("message_ids", "prompt", "response", "parent_id", "author_id", "author_name", "created", "summary")
+
+    def __init__(self, message_ids, prompt, response, parent_id, author_id, author_name, created=None, summary=None):
+        self.message_ids = tuple(message_ids)  # Every message the reply was split into
+        self.prompt = prompt
+        self.response = response
+        self.parent_id = parent_id             # Message the prompt replied to (the previous bot reply, in a thread)
+        self.author_id = author_id
+        self.author_name = author_name
+        self.created = time.time() if created is None else created
+        self.summary = summary
+
+    @property
+    def tokens(self):
+        return estimate_tokens([{"content": self.prompt}, {"content": self.response}])
+
+    def expired(self, now=None):
+        return (now or time.time()) - self.created > CONVERSATION_TTL
+
+    def to_json(self):
+        return json.dumps({slot: getattr(self, slot) for slot in self.__slots__}, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw):
+        return cls(**json.loads(raw))
+
+
+class ConversationCache:
+    """
+    Bot replies keyed by message id, per channel, so a reply chain of any
+    length is rebuilt by walking parent ids in memory instead of one
+    fetch_message per hop. Bounded per channel (LRU) and by age (TTL). With
+    the redis backend every turn is also written to Redis and misses read
+    through to it, so a thread started on one process or AI worker can be
+    continued on any other.
+    """
+
+    def __init__(self, store=None, summarize=None, backend=CONVERSATION_BACKEND):
+        self.store = store
+        self.summarize = summarize  # coroutine ([Turn] oldest first, previous summary or None) -> summary text
+        self.shared = backend == "redis" and store is not None
+        self._channels = OrderedDict()  # channel_id -> OrderedDict(message_id -> Turn)
+
+    @staticmethod
+    def _key(channel_id, message_id):
+        return f"{CONVERSATION_PREFIX}:{channel_id}:{message_id}"
+
+    def clear(self):
+        self._channels.clear()
+
+    def _remember(self, channel_id, turn):
+        turns = self._channels.get(channel_id)
+        if turns is None:
+            turns = self._channels[channel_id] = OrderedDict()
+        self._channels.move_to_end(channel_id)
+        for message_id in turn.message_ids:
+            turns[message_id] = turn
+            turns.move_to_end(message_id)
+        while len(turns) > CONVERSATION_PER_CHANNEL:
+            turns.popitem(last=False)
+        while len(self._channels) > CONVERSATION_MAX_CHANNELS:
+            self._channels.popitem(last=False)
+
+    async def _save(self, channel_id, turn):
+        if not self.shared:
+            return
+        raw = turn.to_json()
+        ttl = max(1, int(turn.created + CONVERSATION_TTL - time.time()))
+
+        def write(client):
+            pipe = client.pipeline(transaction=False)
+            for message_id in turn.message_ids:
+                pipe.set(self._key(channel_id, message_id), raw, ex=ttl)
+            return pipe.execute()
+        try:
+            await self.store.run(write)
+        except MemoryOffline as e:
+            log.warning(f"Conversation turn not shared, Redis offline. Error: {e}")
+
+    # --- WRITE ---
+    async def record(self, channel_id, turn):
+        if not turn.message_ids:
+            return
+        self._remember(channel_id, turn)
+        await self._save(channel_id, turn)
+
+    # --- READ ---
+    async def get(self, channel_id, message_id):
+        turns = self._channels.get(channel_id)
+        turn = turns.get(message_id) if turns else None
+        if turn is None and self.shared:
+            try:
+                raw = await self.store.run(lambda c: c.get(self._key(channel_id, message_id)))
+            except MemoryOffline:
+                raw = None
+            if raw:
+                turn = Turn.from_json(raw)
+                self._remember(channel_id, turn)
+        if turn is None:
+            return None
+        turns = self._channels[channel_id]
+        if turn.expired():
+            for stale in turn.message_ids:
+                turns.pop(stale, None)
+            return None
+        self._channels.move_to_end(channel_id)
+        turns.move_to_end(message_id)
+        return turn
+
+    async def context(self, channel_id, message_id, budget=CONVERSATION_TOKEN_BUDGET, max_turns=CONVERSATION_MAX_TURNS):
+        """
+        (summary or None, [Turn] oldest first) for the chain ending at the bot
+        reply `message_id`, or None if that reply isn't known. The newest turns
+        are kept within `budget` tokens; older ones are folded into a summary
+        when summarizing is on, otherwise dropped.
+        """
+        chain = []  # Newest first
+        next_id = message_id
+        while next_id is not None and len(chain) < max_turns:
+            turn = await self.get(channel_id, next_id)
+            if turn is None:
+                break
+            chain.append(turn)
+            next_id = turn.parent_id
+        if not chain:
+            return None
+
+        kept, used = [], 0
+        for turn in chain:
+            cost = turn.tokens
+            if kept and used + cost > budget:
+                break
+            kept.append(turn)
+            used += cost
+        dropped = chain[len(kept):]
+
+        summary = None
+        if dropped and self.summarize is not None and CONVERSATION_SUMMARIZE:
+            summary = await self._summary(channel_id, dropped)
+        kept.reverse()
+        return summary, kept
+
+    async def _summary(self, channel_id, dropped):
+        """Summary up to dropped[0] (newest dropped turn), built on the newest summary already stored further back."""
+        newest = dropped[0]
+        if newest.summary:
+            return newest.summary
+        base_index = next((i for i, turn in enumerate(dropped) if turn.summary), len(dropped))
+        previous = dropped[base_index].summary if base_index < len(dropped) else None
+        try:
+            summary = await self.summarize(list(reversed(dropped[:base_index])), previous)
+        except Exception as e:
+            log.warning(f"Conversation summary failed, older turns dropped. Error: {e}")
+            return previous
+        newest.summary = summary
+        await self._save(channel_id, newest)
+        return summary
@@ -0,0 +1,168 @@
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+from memory_store import MemoryStore, MemoryOffline
+
+# --- COOLDOWN CONFIGURATION ---
+COOLDOWN_BACKEND = os.environ.get("COOLDOWN_BACKEND", "memory")  # "memory" (per process) or "redis" (shared)
+COOLDOWN_KEY_PREFIX = "cooldown:"
+
+# Sliding window: at most `limit` hits per `window` seconds; KEYS[1] zset of hit times (ms)
+# ARGV: now_ms, window_ms, limit, member -> 0 if allowed, else ms until the oldest hit leaves the window
+SLIDING_WINDOW_SCRIPT = """
+local key = KEYS[1]
+local now, window, limit = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+if redis.call('ZCARD', key) < limit then
+    redis.call('ZADD', key, now, ARGV[4])
+    redis.call('PEXPIRE', key, window)
+    return 0
+end
+local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+return math.max(1, tonumber(oldest[2]) + window - now)
+"""
+
+
+class _Expiry:
+    __slots__ = ("expires_at", "key")
+
+    def __init__(self, expires_at, key):
+        self.expires_at = expires_at
+        self.key = key
+
+    def __lt__(self, other):
+        return self.expires_at < other.expires_at
+
+
+class MemoryCooldowns:
+    """
+    Per-process cooldowns and sliding-window limits.
+    Every live key has an entry on a min-heap ordered by expiry; each call
+    first pops what has expired, so idle users cost nothing after their
+    cooldown ends and memory stays proportional to *active* keys.
+    All methods return the seconds left (0 = allowed), like the Redis backend.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._expires = {}  # key -> expires_at (cooldowns and windows alike)
+        self._windows = {}  # key -> deque of hit times
+        self._heap = []
+
+    def __len__(self):
+        return len(self._expires)
+
+    def _prune(self, now):
+        heap = self._heap
+        while heap and heap[0].expires_at <= now:
+            entry = heapq.heappop(heap)
+            # Refreshed keys leave stale heap entries behind; only the newest one counts
+            if self._expires.get(entry.key) == entry.expires_at:
+                del self._expires[entry.key]
+                self._windows.pop(entry.key, None)
+
+    def _expire_at(self, key, expires_at):
+        self._expires[key] = expires_at
+        heapq.heappush(self._heap, _Expiry(expires_at, key))
+
+    async def remaining(self, key):
+        now = self.clock()
+        self._prune(now)
+        return max(0.0, self._expires.get(key, now) - now)
+
+    async def set(self, key, seconds):
+        now = self.clock()
+        self._prune(now)
+        self._expire_at(key, now + seconds)
+
+    async def hit(self, key, seconds):
+        """Starts the cooldown if it isn't running; returns the seconds left otherwise."""
+        now = self.clock()
+        self._prune(now)
+        expires_at = self._expires.get(key)
+        if expires_at is not None:
+            return expires_at - now
+        self._expire_at(key, now + seconds)
+        return 0.0
+
+    async def allow(self, key, limit, window):
+        """Sliding window: records a hit if fewer than `limit` happened in the last `window` seconds."""
+        now = self.clock()
+        self._prune(now)
+        hits = self._windows.get(key)
+        if hits is None:
+            hits = self._windows[key] = deque(maxlen=limit)
+        while hits and hits[0] <= now - window:
+            hits.popleft()
+        if len(hits) >= limit:
+            return hits[0] + window - now
+        hits.append(now)
+        self._expire_at(key, now + window)
+        return 0.0
+
+
+class RedisCooldowns:
+    """
+    Cooldowns shared by every bot process: SET NX PX for cooldowns and a Lua
+    sorted-set script for sliding windows, with Redis expiring the keys.
+    If Redis is unreachable, calls fall back to an in-process MemoryCooldowns
+    so users are still limited (just per process) until it comes back.
+    """
+
+    def __init__(self, store=None):
+        self.store = store or MemoryStore()
+        self.fallback = MemoryCooldowns()
+        self._script = None
+        self._seq = itertools.count()
+
+    async def remaining(self, key):
+        try:
+            ms = await self.store.run(lambda c: c.pttl(COOLDOWN_KEY_PREFIX + key))
+        except MemoryOffline:
+            return await self.fallback.remaining(key)
+        return max(0, ms) / 1000
+
+    async def set(self, key, seconds):
+        try:
+            await self.store.run(lambda c: c.set(COOLDOWN_KEY_PREFIX + key, 1, px=int(seconds * 1000)))
+        except MemoryOffline:
+            await self.fallback.set(key, seconds)
+
+    async def hit(self, key, seconds):
+        def op(client):
+            pipe = client.pipeline(transaction=False)
+            pipe.set(COOLDOWN_KEY_PREFIX + key, 1, px=int(seconds * 1000), nx=True)
+            pipe.pttl(COOLDOWN_KEY_PREFIX + key)
+            return pipe.execute()
+        try:
+            started, ms = await self.store.run(op)
+        except MemoryOffline:
+            return await self.fallback.hit(key, seconds)
+        return 0.0 if started else max(1, ms) / 1000
+
+    async def allow(self, key, limit, window):
+        now_ms = int(time.time() * 1000)
+        member = f"{now_ms}:{os.getpid()}:{next(self._seq)}"  # Unique even for hits in the same millisecond
+
+        def op(client):
+            if self._script is None:
+                self._script = client.register_script(SLIDING_WINDOW_SCRIPT)
+            return self._script(keys=[COOLDOWN_KEY_PREFIX + key], args=[now_ms, int(window * 1000), limit, member], client=client)
+        try:
+            wait_ms = await self.store.run(op)
+        except MemoryOffline:
+            return await self.fallback.allow(key, limit, window)
+        return int(wait_ms) / 1000
+
+
+_cooldowns = None
+
+
+def get_cooldowns():
+    """Returns the cooldown service shared by every cog, creating it on first use."""
+    global _cooldowns
+    if _cooldowns is None:
+        _cooldowns = RedisCooldowns() if COOLDOWN_BACKEND == "redis" else MemoryCooldowns()
+    return _cooldowns
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import os
+from memory_store import MemoryOffline
+from logs import get_logger
+
+log = get_logger("fact_ingestion")
+
+# --- FACT INGESTION CONFIGURATION ---
+FACT_BATCH_WINDOW = float(os.environ.get("FACT_BATCH_WINDOW", 5.0))  # Seconds to gather raw facts before one Groq call
+FACT_BATCH_SIZE = int(os.environ.get("FACT_BATCH_SIZE", 20))
+FACT_MAX_ATTEMPTS = int(os.environ.get("FACT_MAX_ATTEMPTS", 3))       # After that the raw text is simply kept
+
+CLEANER_SYSTEM_PROMPT = (
+    "You are a concise fact cleaning machine. Change every input sentence into a concise third-person fact "
+    "(max 10 words). Example: 'My birthday is Dec 10' -> 'Their birthday is December 10th.' "
+    'Reply only with JSON: {"facts": [{"id": <input id>, "fact": "<cleaned fact>"}]}'
+)
+
+
+class FactIngestionWorker:
+    """
+    Background cleaner for facts stored raw by /ingat.
+    Every FACT_BATCH_WINDOW seconds it claims up to FACT_BATCH_SIZE pending
+    facts (from any user / bot process), rewrites them with ONE structured
+    Groq request, writes the cleaned versions back and only then acknowledges
+    the claim, so a crash mid-batch requeues it. Failed items are re-queued
+    until FACT_MAX_ATTEMPTS; after that their raw text is stored as final.
+    """
+
+    def __init__(self, memory, complete, model):
+        self.memory = memory
+        self.complete = complete  # Coroutine function: (**create_kwargs) -> chat completion
+        self.model = model
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(FACT_BATCH_WINDOW)
+            try:
+                claimed = await self.memory.claim_pending_facts(FACT_BATCH_SIZE)
+            except MemoryOffline:
+                continue
+            if not claimed:
+                continue
+            await self.process_batch([item for _, item in claimed])
+            try:
+                await self.memory.ack_pending_facts([claim for claim, _ in claimed])
+            except MemoryOffline:
+                pass  # Requeued once the claim times out; cleaning a fact twice is harmless
+
+    async def process_batch(self, batch):
+        try:
+            cleaned = await self._clean(batch)
+        except Exception as e:
+            log.warning(f"Batch of {len(batch)} failed, will retry. Error: {e}")
+            cleaned = {}
+
+        retry = []
+        for i, item in enumerate(batch):
+            text = cleaned.get(i)
+            if not text:
+                item["attempts"] = item.get("attempts", 0) + 1
+                if item["attempts"] < FACT_MAX_ATTEMPTS:
+                    retry.append(item)
+                    continue
+                text = item["text"]  # Out of attempts: keep the raw text, but no longer flagged raw
+            try:
+                await self.memory.replace_fact(item["user_id"], item["fact_id"], text)
+            except MemoryOffline:
+                retry.append(item)
+
+        if retry:
+            try:
+                await self.memory.push_pending_facts(retry)
+            except MemoryOffline:
+                log.warning(f"Redis offline, {len(retry)} fact(s) stay uncleaned.")
+
+    async def _clean(self, batch):
+        """Returns {batch index: cleaned fact} for every item the model answered."""
+        sentences = [{"id": i, "sentence": item["text"]} for i, item in enumerate(batch)]
+        chat_completion = await self.complete(
+            messages=[
+                {"role": "system", "content": CLEANER_SYSTEM_PROMPT},
+                {"role": "user", "content": json.dumps(sentences, ensure_ascii=False)},
+            ],
+            model=self.model,
+            temperature=0.0,
+            max_tokens=30 * len(batch) + 20,
+            response_format={"type": "json_object"},
+        )
+        result = json.loads(chat_completion.choices[0].message.content)
+        cleaned = {}
+        for entry in result.get("facts", []):
+            try:
+                index = int(entry["id"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            fact = str(entry.get("fact") or "").strip().replace('"', '')
+            if 0 <= index < len(batch) and fact:
+                cleaned[index] = fact
+        return cleaned
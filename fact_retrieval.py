@@ -0,0 +1,134 @@
+import math
+import os
+import re
+import sys
+
+# --- FACT RETRIEVAL CONFIGURATION ---
+FACT_TOP_K = int(os.environ.get("FACT_TOP_K", 5))
+FACT_TOKEN_BUDGET = int(os.environ.get("FACT_TOKEN_BUDGET", 150))  # Max prompt tokens spent on LONG_TERM_MEMORY
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+STOPWORDS = {
+    # EN
+    "a", "an", "the", "is", "are", "was", "were", "be", "to", "of", "and", "or", "in", "on", "at", "for",
+    "with", "my", "me", "i", "you", "your", "their", "they", "them", "it", "this", "that", "what", "do", "does",
+    # ID
+    "yang", "dan", "di", "ke", "dari", "ini", "itu", "aku", "gw", "gue", "lu", "lo", "kamu", "apa", "ada", "adalah",
+}
+
+
+def tokenize(text):
+    return [t for t in re.findall(r"\w+", text.lower()) if t not in STOPWORDS]
+
+
+def estimate_fact_tokens(fact):
+    return len(fact) // 4 + 1
+
+
+# --- RETRIEVAL ---
+def bm25_scores(query_terms, docs_terms, stats=None):
+    """
+    `stats` ({"docs", "avgdl", "df"}, as kept by the memory store) saves
+    counting document frequencies and lengths over every fact per query.
+    """
+    n_docs = len(docs_terms)
+    if not n_docs or not query_terms:
+        return [0.0] * n_docs
+
+    if stats is not None:
+        n_docs, avg_len, doc_freq = stats["docs"] or n_docs, stats["avgdl"] or 1.0, stats["df"]
+    else:
+        avg_len = sum(len(d) for d in docs_terms) / n_docs or 1.0
+        doc_freq = {}
+        for terms in docs_terms:
+            for term in set(terms):
+                doc_freq[term] = doc_freq.get(term, 0) + 1
+
+    scores = []
+    for terms in docs_terms:
+        score = 0.0
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * len(terms) / avg_len)
+        for term in set(query_terms):
+            tf = terms.count(term)
+            if not tf:
+                continue
+            df = doc_freq.get(term) or 1
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            score += idf * tf * (BM25_K1 + 1) / (tf + length_norm)
+        scores.append(score)
+    return scores
+
+
+def select_facts(facts, query, top_k=FACT_TOP_K, token_budget=FACT_TOKEN_BUDGET, stats=None):
+    """
+    Returns the texts of the facts most relevant to `query`: BM25 score first,
+    newest first on ties (so an unrelated prompt still gets the latest facts),
+    capped at top_k and the token budget.
+    `facts` are the stored {"text", "terms"} entries, oldest first; the terms
+    are tokenized once when the fact is stored, not per message, and `stats`
+    come from MemoryStore.search_facts.
+    """
+    docs_terms = [fact.get("terms") or tokenize(fact["text"]) for fact in facts]
+    scores = bm25_scores(tokenize(query), docs_terms, stats)
+    ranked = sorted(range(len(facts)), key=lambda i: (scores[i], i), reverse=True)
+
+    selected, used = [], 0
+    for i in ranked:
+        if len(selected) >= top_k:
+            break
+        cost = estimate_fact_tokens(facts[i]["text"])
+        if used + cost > token_budget:
+            continue
+        selected.append(facts[i]["text"])
+        used += cost
+    return selected
+
+
+# --- BENCHMARK ---
+def _benchmark(counts=(5, 10, 25, 50, 100, 200), queries=200):
+    """
+    Prompt tokens spent on LONG_TERM_MEMORY and ranking time per message, by
+    number of stored facts: every fact (before) vs select_facts, recounting
+    the BM25 statistics per message vs using the stored ones.
+    """
+    import json
+    import random
+    import time
+
+    rng = random.Random(0)
+    subjects = ["python", "guitar", "coffee", "jakarta", "valorant", "cats", "running", "sushi", "linux", "anime"]
+    verbs = ["likes", "plays", "is learning", "lives near", "hates", "collects", "writes about", "dreams of"]
+    prompts = [f"any tips about {rng.choice(subjects)} and {rng.choice(subjects)}?" for _ in range(queries)]
+
+    def stats_for(facts):
+        df = {}
+        for fact in facts:
+            for term in set(fact["terms"]):
+                df[term] = df.get(term, 0) + 1
+        return {"docs": len(facts), "avgdl": sum(len(f["terms"]) for f in facts) / len(facts), "df": df}
+
+    print(f"{'facts':>6} {'all tokens':>11} {'selected':>9} {'recount µs':>11} {'stored µs':>10}")
+    for count in counts:
+        texts = [f"User {rng.choice(verbs)} {rng.choice(subjects)} since {rng.randrange(2000, 2025)}" for _ in range(count)]
+        facts = [{"text": text, "terms": tokenize(text)} for text in texts]
+        stats = stats_for(facts)
+        all_tokens = len(json.dumps(texts, indent=2)) // 4
+        selected = sum(len(json.dumps(select_facts(facts, p), indent=2)) // 4 for p in prompts) / queries
+
+        timings = []
+        for use_stats in (False, True):
+            start = time.perf_counter()
+            for prompt in prompts:
+                # Stored stats only carry the query's terms, like MemoryStore.search_facts returns them
+                query_stats = dict(stats, df={t: stats["df"].get(t, 0) for t in tokenize(prompt)}) if use_stats else None
+                select_facts(facts, prompt, stats=query_stats)
+            timings.append((time.perf_counter() - start) / queries * 1e6)
+        print(f"{count:>6} {all_tokens:>11} {selected:>9.0f} {timings[0]:>11.1f} {timings[1]:>10.1f}")
+
+
+if __name__ == "__main__":
+    # Usage: python fact_retrieval.py bench
+    if len(sys.argv) != 2 or sys.argv[1] != "bench":
+        sys.exit("Usage: python fact_retrieval.py bench")
+    _benchmark()
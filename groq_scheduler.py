@@ -0,0 +1,238 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from logs import get_logger
+from metrics import span, GROQ_REQUEST_SECONDS, GROQ_TOKENS, GROQ_RATE_LIMITED
+
+log = get_logger("groq_scheduler")
+
+# --- SCHEDULER CONFIGURATION ---
+# Defaults match Groq's published limits for llama-3.1-8b-instant (free tier).
+GROQ_RPM = int(os.environ.get("GROQ_RPM", 30))
+GROQ_TPM = int(os.environ.get("GROQ_TPM", 6000))
+GROQ_MAX_QUEUE = int(os.environ.get("GROQ_MAX_QUEUE", 100))       # Jobs waiting across all guilds
+GROQ_MAX_WAIT = float(os.environ.get("GROQ_MAX_WAIT", 20.0))      # Seconds a job may wait for a slot
+GROQ_MAX_RETRIES = int(os.environ.get("GROQ_MAX_RETRIES", 2))     # Retries after a 429
+DEFAULT_RETRY_AFTER = 2.0
+
+
+class SchedulerBusy(Exception):
+    """Raised when the Groq queue is full or a job waited longer than its max wait (GROQ_MAX_WAIT by default)."""
+
+
+def rate_limit_error():
+    """groq.RateLimitError, imported on first use (the groq package takes ~150ms to import)."""
+    import groq
+    return groq.RateLimitError
+
+
+def estimate_tokens(messages):
+    """Rough prompt size (~4 chars per token, plus per-message overhead)."""
+    return sum(len(m.get("content") or "") // 4 + 4 for m in messages)
+
+
+def reserved_tokens(create_kwargs):
+    """What a request reserves from the TPM bucket: its prompt estimate plus its max_tokens."""
+    return estimate_tokens(create_kwargs["messages"]) + create_kwargs.get("max_tokens", 0)
+
+
+def stream_usage(chunk):
+    """The usage block of a streamed chunk; Groq only sends one, in x_groq of the final chunk."""
+    return getattr(chunk, "usage", None) or getattr(getattr(chunk, "x_groq", None), "usage", None)
+
+
+def retry_after_seconds(error):
+    """Reads the retry-after header from a Groq 429, if there is one."""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "level", "updated")
+
+    def __init__(self, capacity, per_second):
+        self.capacity = capacity
+        self.rate = per_second
+        self.level = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def available_within(self, seconds):
+        """Tokens that can be consumed within `seconds`: the current level plus what refills meanwhile."""
+        self._refill()
+        return max(self.level, 0.0) + seconds * self.rate
+
+    def consume(self, amount):
+        # Negative amounts refund; the level may dip below zero to absorb under-estimates
+        self._refill()
+        self.level = min(self.capacity, self.level - amount)
+
+
+class _Job:
+    __slots__ = ("est_tokens", "admitted")
+
+    def __init__(self, est_tokens, admitted):
+        self.est_tokens = est_tokens
+        self.admitted = admitted
+
+
+class GroqScheduler:
+    """
+    Admission control in front of every Groq request.
+    Jobs are queued per guild and per user and admitted round-robin
+    (guild -> user), only when both the requests-per-minute and
+    tokens-per-minute buckets have room. A 429 pauses admission for the
+    server's retry-after and the job is retried.
+    """
+
+    def __init__(self, rpm=GROQ_RPM, tpm=GROQ_TPM, max_queue=GROQ_MAX_QUEUE,
+                 max_wait=GROQ_MAX_WAIT, max_retries=GROQ_MAX_RETRIES):
+        self.requests = TokenBucket(rpm, rpm / 60)
+        self.tokens = TokenBucket(tpm, tpm / 60)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self._queues = OrderedDict()  # guild_id -> OrderedDict(user_id -> deque[_Job])
+        self._size = 0
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._worker = None
+
+    @property
+    def queue_depth(self):
+        return self._size
+
+    def token_budget(self, seconds):
+        """Tokens the TPM bucket can admit within `seconds`, if nothing else asks for any meanwhile."""
+        return self.tokens.available_within(seconds)
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._dispatch_loop())
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    # --- QUEUEING ---
+    def _enqueue(self, guild_id, user_id, job):
+        users = self._queues.setdefault(guild_id, OrderedDict())
+        users.setdefault(user_id, deque()).append(job)
+        self._size += 1
+        self._wakeup.set()
+
+    def _pop_fair(self):
+        if not self._queues:
+            return None
+        guild_id, users = next(iter(self._queues.items()))
+        user_id, jobs = next(iter(users.items()))
+        job = jobs.popleft()
+        self._size -= 1
+
+        # Rotate: this user goes behind the others in the guild, this guild behind the other guilds
+        if jobs:
+            users.move_to_end(user_id)
+        else:
+            del users[user_id]
+        if users:
+            self._queues.move_to_end(guild_id)
+        else:
+            del self._queues[guild_id]
+        return job
+
+    async def _dispatch_loop(self):
+        while True:
+            job = self._pop_fair()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            while not job.admitted.done():
+                delay = max(
+                    self._paused_until - time.monotonic(),
+                    self.requests.wait_time(1),
+                    self.tokens.wait_time(job.est_tokens),
+                )
+                if delay <= 0:
+                    self.requests.consume(1)
+                    self.tokens.consume(job.est_tokens)
+                    job.admitted.set_result(True)
+                    break
+                await asyncio.sleep(delay)
+
+    async def _wait_for_slot(self, guild_id, user_id, est_tokens, max_wait):
+        if self._size >= self.max_queue:
+            raise SchedulerBusy("Groq queue is full")
+        job = _Job(est_tokens, asyncio.get_running_loop().create_future())
+        self._enqueue(guild_id, user_id, job)
+        try:
+            await asyncio.wait_for(asyncio.shield(job.admitted), max_wait)
+        except asyncio.TimeoutError:
+            job.admitted.cancel()  # The dispatcher skips it without spending budget
+            raise SchedulerBusy(f"Waited more than {max_wait:.0f}s for a Groq slot")
+        except asyncio.CancelledError:
+            job.admitted.cancel()  # Caller went away (e.g. a superseded prompt), don't spend budget on it
+            raise
+
+    # --- PUBLIC API ---
+    async def run(self, call, *, guild_id=None, user_id=None, est_tokens=0, max_wait=None):
+        """
+        Runs `call()` (a coroutine factory for one Groq request) once admitted.
+        Retries on 429 after the server-provided retry-after; re-raises the
+        RateLimitError once GROQ_MAX_RETRIES is exhausted. `max_wait` overrides
+        the scheduler's wait for a slot, e.g. for background work nobody is
+        staring at.
+        """
+        self.start()
+        attempt = 0
+        while True:
+            await self._wait_for_slot(guild_id, user_id, est_tokens, max_wait or self.max_wait)
+            try:
+                with span(GROQ_REQUEST_SECONDS):
+                    result = await call()
+            except rate_limit_error() as e:
+                GROQ_RATE_LIMITED.inc()
+                wait = retry_after_seconds(e)
+                self._paused_until = max(self._paused_until, time.monotonic() + wait)
+                log.warning(f"429 received, pausing admissions for {wait:.1f}s.", extra={"fields": {
+                    "guild_id": guild_id, "user_id": user_id, "retry_after_s": round(wait, 1), "attempt": attempt + 1,
+                }})
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                continue
+
+            self.settle(getattr(result, "usage", None), est_tokens)  # None for streams: stream_usage() + settle() once it ends
+            return result
+
+    def settle(self, usage, est_tokens):
+        """
+        Gives back (or charges) the difference between a request's reservation
+        and the tokens it really used, and records them in groq_tokens_total.
+        """
+        if usage is not None and getattr(usage, "total_tokens", None):
+            self.tokens.consume(usage.total_tokens - est_tokens)
+            GROQ_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, type="prompt")
+            GROQ_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, type="completion")
@@ -0,0 +1,153 @@
+import asyncio
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from logs import get_logger
+
+log = get_logger("language_detector")
+
+# --- LANGUAGE DETECTION CONFIGURATION ---
+LANGDETECT_BACKEND = os.environ.get("LANGDETECT_BACKEND", "langdetect")  # "langdetect" or "langid" (optional, faster)
+LANGDETECT_EXECUTOR = os.environ.get("LANGDETECT_EXECUTOR", "thread")    # "thread" or "process"
+LANGDETECT_WORKERS = int(os.environ.get("LANGDETECT_WORKERS", 2))
+LANGDETECT_CACHE_SIZE = int(os.environ.get("LANGDETECT_CACHE_SIZE", 4096))
+
+
+# These run inside the executor, so they must stay module-level (picklable for the process pool).
+def _load_backend(backend):
+    if backend == "langid":
+        import langid
+        langid.classify("warm up")  # Builds the model on first call
+    else:
+        from langdetect import DetectorFactory
+        from langdetect.detector_factory import init_factory
+        DetectorFactory.seed = 0  # Deterministic results, otherwise the cache would pin a random guess
+        init_factory()            # Loads every language profile from disk now instead of on the first message
+    return backend
+
+
+def _detect(backend, text):
+    if backend == "langid":
+        import langid
+        return langid.classify(text)[0]
+    from langdetect import detect, LangDetectException
+    try:
+        return detect(text)
+    except LangDetectException:
+        return None
+
+
+def normalize_text(text):
+    return " ".join(text.split())
+
+
+class LanguageDetector:
+    """
+    Runs language detection off the event loop and memoizes results in a
+    bounded LRU keyed on the normalized text.
+    """
+
+    def __init__(self, backend=LANGDETECT_BACKEND, executor=LANGDETECT_EXECUTOR,
+                 workers=LANGDETECT_WORKERS, cache_size=LANGDETECT_CACHE_SIZE):
+        if backend == "langid":
+            try:
+                import langid  # noqa: F401
+            except ImportError:
+                log.warning("langid is not installed, falling back to langdetect.")
+                backend = "langdetect"
+        self.backend = backend
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        pool_class = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+        # Every worker loads the profiles/model as it starts, whenever the pool decides to start it
+        self._executor = pool_class(max_workers=workers, initializer=_load_backend, initargs=(backend,))
+
+    async def warm_up(self):
+        """Starts the pool (and so loads the backend) before the first message needs it."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, _detect, self.backend, "warm up")
+
+    async def detect(self, text):
+        """Returns the detected language code, or None if the text has no usable features."""
+        key = normalize_text(text)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        loop = asyncio.get_running_loop()
+        lang = await loop.run_in_executor(self._executor, _detect, self.backend, key)
+
+        self._cache[key] = lang
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return lang
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# --- BENCHMARK ---
+def _benchmark(count=2000):
+    """
+    Per-call latency and event loop blocking for a chat-like stream (many
+    repeats), detecting inline on the loop (before) vs through LanguageDetector (after).
+    """
+    import random
+
+    samples = [
+        "lol that was a good game last night", "wkwk iya bener banget", "brb getting food",
+        "gw baru pulang kerja, capek banget hari ini", "hôm nay trời đẹp quá", "วันนี้อากาศดีมาก",
+        "ada yang tau cara setting mic biar gak echo?", "salamat sa tulong kanina",
+    ]
+    rng = random.Random(0)
+    stream = [rng.choice(samples) + ("" if rng.random() < 0.7 else f" {rng.randrange(1000)}") for _ in range(count)]
+
+    async def measure(detect):
+        loop = asyncio.get_running_loop()
+        worst_lag = 0.0
+        done = False
+
+        async def ticker():
+            nonlocal worst_lag
+            while not done:
+                expected = loop.time() + 0.001
+                await asyncio.sleep(0.001)
+                worst_lag = max(worst_lag, loop.time() - expected)
+
+        tick = asyncio.create_task(ticker())
+        await asyncio.sleep(0)
+        latencies = []
+        for text in stream:
+            t0 = time.perf_counter()
+            await detect(text)
+            latencies.append(time.perf_counter() - t0)
+            await asyncio.sleep(0)  # Let the ticker run between messages, like other events would
+        done = True
+        await tick
+        latencies.sort()
+        return (sum(latencies) / count * 1e3, latencies[int(count * 0.99)] * 1e3, worst_lag * 1e3)
+
+    async def inline(text):
+        return _detect(detector.backend, normalize_text(text))
+
+    async def run():
+        await asyncio.get_running_loop().run_in_executor(None, _load_backend, detector.backend)
+        await detector.warm_up()
+        return await measure(inline), await measure(detector.detect)
+
+    detector = LanguageDetector()
+    before, after = asyncio.run(run())
+    detector.close()
+    print(f"{count} messages, backend={detector.backend}, executor={LANGDETECT_EXECUTOR}")
+    print(f"  {'':<8} {'mean ms':>9} {'p99 ms':>9} {'max loop block ms':>18}")
+    for name, (mean, p99, lag) in (("inline", before), ("detector", after)):
+        print(f"  {name:<8} {mean:>9.3f} {p99:>9.3f} {lag:>18.2f}")
+
+
+if __name__ == "__main__":
+    # Usage: python language_detector.py bench [message count]
+    if len(sys.argv) < 2 or sys.argv[1] != "bench":
+        sys.exit("Usage: python language_detector.py bench [message count]")
+    _benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
@@ -1,143 +1,228 @@
 import discord
 from discord.ext import commands
-from replit import db
 import os
+import sys
 import time
 import json
-
-
-ROLE_MV_ID = 1433114931313643681
-ROLE_FRIENDS_ID = 1433120829016899757
-XP_PER_MESSAGE = 15
-XP_COOLDOWN = 60
-
-# 2. DATABASE
-def xp_for_next_level(level):
-    return 100 * (level + 1)
-
-def get_user_data(user_id):
-    user_key = str(user_id)
-    if user_key in db:
+import asyncio
+from collections import OrderedDict
+from leveling_store import create_store
+from announcements import AnnouncementDispatcher
+from cooldowns import get_cooldowns, RedisCooldowns
+from message_router import MessageRouter, XP_ELIGIBLE
+from leveling_tracks import TrackRegistry, check_level_up
+from logs import get_logger
+import metrics
+from metrics import span, CACHE_REQUESTS, LEVELING_STORE_SECONDS
+
+log = get_logger("leveling_cog")
+
+
+# Tracks (role, XP rate, cooldown, curve) are configured in leveling_tracks.py
+XP_FLUSH_INTERVAL = float(os.environ.get("XP_FLUSH_INTERVAL", 5.0))  # Max seconds of XP a crash can lose
+XP_FLUSH_BATCH = int(os.environ.get("XP_FLUSH_BATCH", 50))           # Flush early once this many users are dirty
+XP_CACHE_SIZE = int(os.environ.get("XP_CACHE_SIZE", 5000))           # Hot user records kept in memory
+LEADERBOARD_CACHE_TTL = float(os.environ.get("LEADERBOARD_CACHE_TTL", 30.0))  # Seconds a rendered leaderboard is reused
+
+# 2. WRITE-BEHIND CACHE (storage lives in leveling_store.py, tracks in leveling_tracks.py)
+class XPCache:
+    """
+    In-memory write-behind layer over the leveling store.
+    Reads and XP updates hit the cached record; changed users are marked dirty
+    and written in one batch every XP_FLUSH_INTERVAL seconds (or sooner once
+    XP_FLUSH_BATCH users are dirty). Keys are (guild_id, user_id).
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._records = OrderedDict()  # (guild_id, user_id) -> user_data (LRU)
+        self._dirty = set()
+        self._loading = {}             # key -> Future, so concurrent misses load once
+        self._flush_now = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def get(self, guild_id, user_id):
+        key = (guild_id, user_id)
+        if key in self._records:
+            self._records.move_to_end(key)
+            CACHE_REQUESTS.inc(cache="xp", result="hit")
+            return self._records[key]
+        CACHE_REQUESTS.inc(cache="xp", result="miss")
+        if key in self._loading:
+            return await self._loading[key]
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
         try:
-            return json.loads(db[user_key])
-        except:
-            return {"role_a": {"xp": 0, "level": 0}, "role_b": {"xp": 0, "level": 0}}
-    else:
-        return {"role_a": {"xp": 0, "level": 0}, "role_b": {"xp": 0, "level": 0}}
-
-def save_user_data(user_id, data):
-    user_key = str(user_id)
-    db[user_key] = json.dumps(data)
-
-def check_level_up(role_data):
-    while role_data["xp"] >= xp_for_next_level(role_data["level"]):
-        role_data["xp"] -= xp_for_next_level(role_data["level"])
-        role_data["level"] += 1
-    return role_data
+            with span(LEVELING_STORE_SECONDS, op="load"):
+                user_data = await self.store.load_user(guild_id, user_id)
+            self._records[key] = user_data
+            self._evict()
+            future.set_result(user_data)
+            return user_data
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self._loading[key]
+
+    @property
+    def dirty_count(self):
+        return len(self._dirty)
+
+    def mark_dirty(self, guild_id, user_id):
+        self._dirty.add((guild_id, user_id))
+        if len(self._dirty) >= XP_FLUSH_BATCH:
+            self._flush_now.set()
+
+    def _evict(self):
+        # Only clean records can be dropped; dirty ones wait for the next flush
+        for key in list(self._records):
+            if len(self._records) <= XP_CACHE_SIZE:
+                break
+            if key not in self._dirty:
+                del self._records[key]
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            batch = {key: json.loads(json.dumps(self._records[key])) for key in self._dirty if key in self._records}
+            self._dirty.clear()
+            try:
+                with span(LEVELING_STORE_SECONDS, op="save"):
+                    await self.store.save_users(batch)
+            except Exception as e:
+                self._dirty.update(batch)  # Retry on the next flush
+                log.warning(f"Failed to flush {len(batch)} user(s), will retry. Error: {e}")
+            self._evict()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                # asyncio.timeout, not wait_for: on 3.11 wait_for swallows a cancel that lands
+                # as the event fires, which left close() waiting on this loop forever
+                async with asyncio.timeout(XP_FLUSH_INTERVAL):
+                    await self._flush_now.wait()
+            except TimeoutError:
+                pass
+            self._flush_now.clear()
+            await self.flush()
 
 # 3. COG LEVELING
 class LevelingCog(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
-        self.user_cooldowns = {} 
-        print("Leveling Cog: Modul Leveling telah di-load.")
-
-    # 4. ON_MESSAGE XP
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if message.author.bot:
-            return
+        self.cooldowns = get_cooldowns()  # Shared with the AI cog; expired entries are dropped on their own
+        self.store = create_store()
+        self.xp_cache = XPCache(self.store)
+        self.tracks = TrackRegistry.from_file()
+        self.leaderboard_cache = {}  # (guild_id, role_key) -> (rendered_at, description)
+        self.router = MessageRouter.install(bot)
+        self.announcer = AnnouncementDispatcher(bot)
+        log.info("Modul Leveling telah di-load.")
+
+    async def cog_load(self):
+        self.xp_cache.start()
+        metrics.gauge("xp_dirty_users", "Users with XP not yet written to storage", lambda: self.xp_cache.dirty_count)
+        if isinstance(self.cooldowns, RedisCooldowns):
+            # The live keys are in Redis (and expire there); only the outage fallback lives here
+            metrics.gauge("cooldown_fallback_keys", "Cooldown keys held in this process while Redis is unreachable",
+                          lambda: len(self.cooldowns.fallback))
+        else:
+            metrics.gauge("cooldown_keys", "Live cooldown / rate-limit keys held in this process", lambda: len(self.cooldowns))
+        self.router.subscribe(self.award_xp, XP_ELIGIBLE)
 
-        # Abaikan DM
-        if message.guild is None:
-            return
+    async def cog_unload(self):
+        self.router.unsubscribe(self.award_xp)
+        await self.announcer.close()
+        await self.xp_cache.close()  # Final flush so nothing earned is lost on shutdown
+        await self.store.close()
 
-        # ! PENTING: Cek apakah pesan ini ditujukan untuk AI.
-        # Jika ya, JANGAN berikan XP.
-        if message.content.startswith(self.bot.user.mention):
-            return
-        if message.reference and message.reference.resolved:
-            if message.reference.resolved.author == self.bot.user:
-                return
+    # 4. XP PER MESSAGE
+    async def award_xp(self, message: discord.Message, kind):
+        # The MessageRouter only sends human guild messages that aren't commands
+        # or aimed at the AI (mention / reply to the bot), so no re-checks here.
 
         # --- Logika Leveling Anda ---
-        current_time = time.time()
         user_id = message.author.id
+        guild_id = message.guild.id
 
-        if user_id in self.user_cooldowns:
-            time_since_last = current_time - self.user_cooldowns[user_id]
-            if time_since_last < XP_COOLDOWN:
-                return # Masih cooldown, hentikan
+        # One pass over the author's roles against the precomputed role -> tracks index
+        tracks = []
+        for track in self.tracks.tracks_for_roles(guild_id, message.author.roles):
+            if not await self.cooldowns.hit(f"xp:{guild_id}:{user_id}:{track.key}", track.cooldown):
+                tracks.append(track)
+        if not tracks:
+            return # Tidak punya role / masih cooldown, hentikan
 
-        has_role_mv = any(role.id == ROLE_MV_ID for role in message.author.roles)
-        has_role_friends = any(role.id == ROLE_FRIENDS_ID for role in message.author.roles)
-
-        if not has_role_mv and not has_role_friends:
-            return # Tidak punya role, hentikan
-
-        user_data = get_user_data(user_id)
+        user_data = await self.xp_cache.get(guild_id, user_id)
         leveled_up_roles = []
 
-        if has_role_mv:
-            old_level = user_data["role_a"]["level"]
-            user_data["role_a"]["xp"] += XP_PER_MESSAGE
-            user_data["role_a"] = check_level_up(user_data["role_a"])
-            if user_data["role_a"]["level"] > old_level:
-                leveled_up_roles.append(("Role MV", user_data["role_a"]["level"]))
-
-        if has_role_friends:
-            old_level = user_data["role_b"]["level"]
-            user_data["role_b"]["xp"] += XP_PER_MESSAGE
-            user_data["role_b"] = check_level_up(user_data["role_b"])
-            if user_data["role_b"]["level"] > old_level:
-                leveled_up_roles.append(("Role Friends", user_data["role_b"]["level"]))
-
-        save_user_data(user_id, user_data)
-        self.user_cooldowns[user_id] = current_time
-
-        for role_name, new_level in leveled_up_roles:
-            await message.channel.send(
-                f"🎉 Congrats {message.author.mention}, you reached Level {new_level} for **{role_name}**!"
-            )
+        for track in tracks:
+            role_data = user_data.setdefault(track.key, {"xp": 0, "level": 0})
+            old_level = role_data["level"]
+            role_data["xp"] += track.xp_per_message
+            check_level_up(role_data, track.curve_base)
+            if role_data["level"] > old_level:
+                leveled_up_roles.append((track.name, role_data["level"]))
+
+        # Every track's update goes out in the same storage write
+        self.xp_cache.mark_dirty(guild_id, user_id)
 
-        # PENTING: Setelah semua listener on_message selesai,
-        # kita perlu memproses $command jika ada.
-        await self.bot.process_commands(message)
+        # Queued, merged per user/channel and sent later; never awaited here
+        self.announcer.announce(guild_id, message.channel, message.author, leveled_up_roles)
 
 
     # --- 5. SEMUA COMMAND LEVELING ---
     # Pindahkan SEMUA command Anda ke sini, di dalam kelas LevelingCog
 
     @commands.command(name='level')
+    @commands.guild_only()
     async def level_command(self, ctx):
-        """Display user's level and XP for both roles"""
+        """Display user's level and XP for every track"""
         user_id = ctx.author.id
-        user_data = get_user_data(user_id)
+        user_data = await self.xp_cache.get(ctx.guild.id, user_id)
         embed = discord.Embed(title=f"📊 {ctx.author.display_name}'s Level Stats", color=discord.Color.blue())
         embed.set_thumbnail(url=ctx.author.display_avatar.url)
 
-        # Role MV
-        role_mv_data = user_data["role_a"]
-        role_mv_xp_needed = xp_for_next_level(role_mv_data["level"])
-        embed.add_field(
-            name="🔵 Role MV",
-            value=f"**Level:** {role_mv_data['level']}\n"
-                  f"**XP:** {role_mv_data['xp']}/{role_mv_xp_needed}\n"
-                  f"**Progress:** {int((role_mv_data['xp'] / role_mv_xp_needed) * 100)}%",
-            inline=True
-        )
-        # Role Friends
-        role_friends_data = user_data["role_b"]
-        role_friends_xp_needed = xp_for_next_level(role_friends_data["level"])
-        embed.add_field(
-            name="🟢 Role Friends",
-            value=f"**Level:** {role_friends_data['level']}\n"
-                  f"**XP:** {role_friends_data['xp']}/{role_friends_xp_needed}\n"
-                  f"**Progress:** {int((role_friends_data['xp'] / role_friends_xp_needed) * 100)}%",
-            inline=True
-        )
-        embed.set_footer(text=f"XP Cooldown: {XP_COOLDOWN} seconds | XP per message: {XP_PER_MESSAGE}")
+        for track in self.tracks.tracks(ctx.guild.id):
+            role_data = user_data.get(track.key, {"xp": 0, "level": 0})
+            xp_needed = track.xp_for_next_level(role_data["level"])
+            embed.add_field(
+                name=f"{track.emoji} {track.name}",
+                value=f"**Level:** {role_data['level']}\n"
+                      f"**XP:** {role_data['xp']}/{xp_needed}\n"
+                      f"**Progress:** {int((role_data['xp'] / xp_needed) * 100)}%",
+                inline=True
+            )
+        # The rates this member actually earns at, from the tracks their roles unlock
+        earning = self.tracks.tracks_for_roles(ctx.guild.id, ctx.author.roles)
+        rates = {(track.cooldown, track.xp_per_message) for track in earning}
+        if not earning:
+            footer = "None of your roles earn XP yet"
+        elif len(rates) == 1:
+            cooldown, xp_per_message = rates.pop()
+            footer = f"XP Cooldown: {cooldown:g} seconds | XP per message: {xp_per_message}"
+        else:
+            footer = " | ".join(f"{track.name}: {track.xp_per_message} XP every {track.cooldown:g}s" for track in earning)
+        embed.set_footer(text=footer)
         await ctx.send(embed=embed)
 
 
@@ -146,29 +231,49 @@ class LevelingCog(commands.Cog):
         embed = discord.Embed(title="✅ Bot Test", description="The bot is working perfectly!", color=discord.Color.green())
         embed.add_field(name="Bot Status", value="🟢 Online and Ready", inline=False)
         embed.add_field(name="Server", value=f"{ctx.guild.name if ctx.guild else 'Direct Message'}", inline=True)
-        embed.add_field(name="Latency", value=f"{round(self.bot.latency * 1000)}ms", inline=True)
+        shard = self.bot.get_shard(ctx.guild.shard_id) if ctx.guild and hasattr(self.bot, "get_shard") else None
+        embed.add_field(name="Latency", value=f"{round((shard or self.bot).latency * 1000)}ms", inline=True)
+        if shard:
+            embed.add_field(name="Shard", value=f"{shard.id + 1}/{shard.shard_count}", inline=True)
         embed.set_footer(text=f"Requested by {ctx.author.display_name}")
         await ctx.send(embed=embed)
 
 
+    @commands.hybrid_command(name='shards', description='Show the gateway latency of every shard in this process')
+    async def shards_command(self, ctx):
+        embed = discord.Embed(title="🛰️ Shard Status", color=discord.Color.blurple())
+        latencies = getattr(self.bot, "latencies", [(0, self.bot.latency)])
+        for shard_id, latency in latencies:
+            shard = self.bot.get_shard(shard_id) if hasattr(self.bot, "get_shard") else None
+            guilds = sum(1 for g in self.bot.guilds if g.shard_id == shard_id)
+            status = "🔴 Closed" if shard and shard.is_closed() else "🟢 Online"
+            embed.add_field(name=f"Shard {shard_id}", value=f"{status}\n{latency * 1000:.0f}ms · {guilds} guild(s)", inline=True)
+        embed.set_footer(text=f"{len(latencies)} shard(s) here of {self.bot.shard_count or 1} total")
+        await ctx.send(embed=embed)
+
+
     @commands.hybrid_command(name='addxp', description='Add XP to a user for a specific role')
     @commands.has_permissions(administrator=True)
+    @commands.guild_only()
     async def add_xp(self, ctx, member: discord.Member, amount: int, role: str):
         # (Salin sisa kode command addxp Anda di sini)
-        role = role.lower()
-        if role not in ['mv', 'friends']:
-            await ctx.send("❌ Role must be either 'mv' or 'friends'", ephemeral=True)
+        track = self.tracks.find(ctx.guild.id, role)
+        if track is None:
+            await ctx.send(f"❌ Role must be one of '{self.tracks.choices(ctx.guild.id)}'", ephemeral=True)
             return
 
-        user_data = get_user_data(member.id)
-        role_key = "role_a" if role == "mv" else "role_b"
-        role_name = "Role MV" if role == "mv" else "Role Friends"
+        user_data = await self.xp_cache.get(ctx.guild.id, member.id)
+        role_key = track.key
+        role_name = track.name
 
-        old_level = user_data[role_key]["level"]
-        user_data[role_key]["xp"] += amount
-        user_data[role_key] = check_level_up(user_data[role_key])
+        role_data = user_data.setdefault(role_key, {"xp": 0, "level": 0})
+        old_level = role_data["level"]
+        role_data["xp"] += amount
+        check_level_up(role_data, track.curve_base)  # O(1), however big the grant
 
-        save_user_data(member.id, user_data)
+        self.xp_cache.mark_dirty(ctx.guild.id, member.id)
+        if role_data["level"] > old_level:
+            self.announcer.announce(ctx.guild.id, ctx.channel, member, [(role_name, role_data["level"])])
 
         embed = discord.Embed(title="✅ XP Added", color=discord.Color.green())
         embed.add_field(name="User", value=member.mention, inline=True)
@@ -180,52 +285,80 @@ class LevelingCog(commands.Cog):
         await ctx.send(embed=embed)
 
 
-    # ... (Tambahkan SEMUA command Anda yang lain: removexp, setlevel, resetuser, leaderboard, rank) ...
+    # ... (Tambahkan SEMUA command Anda yang lain: removexp, setlevel, resetuser) ...
     # ... Cukup copy-paste dari kode lama Anda, pastikan 'self' ada di parameter pertama ...
 
     @commands.hybrid_command(name='leaderboard', description='Show top users by level and XP')
+    @commands.guild_only()
     async def leaderboard(self, ctx, role: str = "mv"):
-        role = role.lower()
-        if role not in ['mv', 'friends']:
-            await ctx.send("❌ Role must be either 'mv' or 'friends'", ephemeral=True)
+        track = self.tracks.find(ctx.guild.id, role)
+        if track is None:
+            await ctx.send(f"❌ Role must be one of '{self.tracks.choices(ctx.guild.id)}'", ephemeral=True)
             return
 
-        role_key = "role_a" if role == "mv" else "role_b"
-        role_name = "Role MV" if role == "mv" else "Role Friends"
-
-        all_users = []
-        for user_id in db.keys():
-            try:
-                user_data = json.loads(db[user_id])
-                all_users.append({
-                    'id': int(user_id),
-                    'level': user_data[role_key]['level'],
-                    'xp': user_data[role_key]['xp']
-                })
-            except:
-                continue
-
-        all_users.sort(key=lambda x: (x['level'], x['xp']), reverse=True)
-        top_users = all_users[:10]
+        role_key = track.key
+        role_name = track.name
 
         embed = discord.Embed(title=f"🏆 Leaderboard - {role_name}", description="Top 10 users by level and XP", color=discord.Color.gold())
+        embed.description = await self.render_leaderboard(ctx.guild, role_key)
+
+        embed.set_footer(text=f"Requested by {ctx.author.display_name}")
+        await ctx.send(embed=embed)
+
+
+    async def render_leaderboard(self, guild, role_key):
+        """Top 10 text, read off the rank index and cached for LEADERBOARD_CACHE_TTL seconds."""
+        cache_key = (guild.id, role_key)
+        cached = self.leaderboard_cache.get(cache_key)
+        if cached and time.monotonic() - cached[0] < LEADERBOARD_CACHE_TTL:
+            CACHE_REQUESTS.inc(cache="leaderboard", result="hit")
+            return cached[1]
+        CACHE_REQUESTS.inc(cache="leaderboard", result="miss")
+
+        await self.xp_cache.flush()  # Pending XP must be in the DB before querying it
+        with span(LEVELING_STORE_SECONDS, op="top"):
+            top_users = await self.store.top(guild.id, role_key, limit=10)
 
         if not top_users:
-            embed.description = "No users have earned XP yet!"
+            leaderboard_text = "No users have earned XP yet!"
         else:
             leaderboard_text = ""
-            for idx, user_info in enumerate(top_users, 1):
-                try:
-                    member = ctx.guild.get_member(user_info['id'])
-                    name = member.display_name if member else f"User {user_info['id']}"
-                except:
-                    name = f"User {user_info['id']}"
+            for idx, (user_id, level, xp) in enumerate(top_users, 1):
+                member = guild.get_member(user_id)
+                name = member.display_name if member else f"User {user_id}"
 
                 medal = "🥇" if idx == 1 else "🥈" if idx == 2 else "🥉" if idx == 3 else f"`{idx}.`"
-                leaderboard_text += f"{medal} **{name}** - Level {user_info['level']} ({user_info['xp']} XP)\n"
+                leaderboard_text += f"{medal} **{name}** - Level {level} ({xp} XP)\n"
+
+        self.leaderboard_cache[cache_key] = (time.monotonic(), leaderboard_text)
+        return leaderboard_text
 
-            embed.description = leaderboard_text
+    @commands.hybrid_command(name='rank', description='Show your (or a member\'s) position on the leaderboard')
+    @commands.guild_only()
+    async def rank(self, ctx, member: discord.Member = None, role: str = "mv"):
+        track = self.tracks.find(ctx.guild.id, role)
+        if track is None:
+            await ctx.send(f"❌ Role must be one of '{self.tracks.choices(ctx.guild.id)}'", ephemeral=True)
+            return
+
+        member = member or ctx.author
+        role_key = track.key
+        role_name = track.name
+
+        await self.xp_cache.flush()
+        with span(LEVELING_STORE_SECONDS, op="rank"):
+            position, total = await self.store.rank(ctx.guild.id, role_key, member.id)
+        if position is None:
+            await ctx.send(f"❌ {member.display_name} has no XP for **{role_name}** yet.", ephemeral=True)
+            return
 
+        user_data = await self.xp_cache.get(ctx.guild.id, member.id)
+        role_data = user_data.get(role_key, {"xp": 0, "level": 0})
+        embed = discord.Embed(title=f"🏅 {member.display_name}'s Rank - {role_name}", color=discord.Color.gold())
+        embed.set_thumbnail(url=member.display_avatar.url)
+        embed.add_field(name="Rank", value=f"#{position} of {total}", inline=True)
+        embed.add_field(name="Level", value=role_data["level"], inline=True)
+        embed.add_field(name="XP", value=f"{role_data['xp']}/{track.xp_for_next_level(role_data['level'])}", inline=True)
         embed.set_footer(text=f"Requested by {ctx.author.display_name}")
         await ctx.send(embed=embed)
 
@@ -233,4 +366,62 @@ class LevelingCog(commands.Cog):
 # --- 6. SETUP FUNCTION ---
 # Wajib ada agar main.py bisa memuat Cog ini
 async def setup(bot):
-    await bot.add_cog(LevelingCog(bot))
\ No newline at end of file
+    await bot.add_cog(LevelingCog(bot))
+
+# --- BENCHMARK ---
+def _benchmark(count=20_000, users=500, backend="sqlite"):
+    """
+    XP updates per second for a chatter stream: loading and saving the user on
+    every message (write-through, before) vs through the XPCache (after).
+    sqlite writes to a temporary file; redis uses REDIS_URL, or fakeredis.
+    """
+    import random
+    import tempfile
+    from leveling_store import SQLiteLevelingStore, RedisLevelingStore
+    from leveling_tracks import DEFAULT_TRACKS
+
+    track = DEFAULT_TRACKS[0]
+    rng = random.Random(0)
+    stream = [(1, rng.randrange(users)) for _ in range(count)]
+
+    def make_store(tmp):
+        if backend == "redis":
+            if not os.environ.get("REDIS_URL"):
+                import fakeredis
+                import redis_pool
+                redis_pool._client = fakeredis.FakeAsyncRedis(decode_responses=True)
+            return RedisLevelingStore()
+        return SQLiteLevelingStore(os.path.join(tmp, f"bench-{time.monotonic_ns()}.db"))
+
+    async def run(store, write_behind):
+        cache = XPCache(store)
+        cache.start()
+        start = time.perf_counter()
+        for guild_id, user_id in stream:
+            if write_behind:
+                user_data = await cache.get(guild_id, user_id)
+            else:
+                user_data = await store.load_user(guild_id, user_id)
+            role_data = user_data.setdefault(track.key, {"xp": 0, "level": 0})
+            role_data["xp"] += track.xp_per_message
+            check_level_up(role_data, track.curve_base)
+            if write_behind:
+                cache.mark_dirty(guild_id, user_id)
+            else:
+                await store.save_users({(guild_id, user_id): user_data})
+        await cache.close()  # Includes the final flush
+        elapsed = time.perf_counter() - start
+        await store.close()
+        return elapsed
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, write_behind in (("write-through", False), ("XPCache", True)):
+            elapsed = asyncio.run(run(make_store(tmp), write_behind))
+            print(f"{name:<14} {count} messages, {users} users ({backend}): {elapsed:.2f}s -> {count / elapsed:,.0f} msg/s")
+
+
+if __name__ == "__main__":
+    # Usage: python leveling_cog.py bench [message count] [sqlite|redis]
+    if len(sys.argv) < 2 or sys.argv[1] != "bench":
+        sys.exit("Usage: python leveling_cog.py bench [message count] [sqlite|redis]")
+    _benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 20_000, backend=sys.argv[3] if len(sys.argv) > 3 else "sqlite")
@@ -0,0 +1,268 @@
+import abc
+import asyncio
+import bisect
+import json
+import os
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# --- STORAGE CONFIGURATION ---
+LEVELING_BACKEND = os.environ.get("LEVELING_BACKEND", "sqlite")  # "sqlite" or "redis"
+LEVELING_DB_PATH = os.environ.get("LEVELING_DB_PATH", "leveling.db")
+LEGACY_TRACKS = ("role_a", "role_b")  # The two tracks stored in the old Replit DB records
+SCORE_LEVEL_WEIGHT = 10 ** 9  # Composite rank score = level * weight + xp (XP within a level never reaches 1e9)
+
+
+def rank_score(level, xp):
+    return level * SCORE_LEVEL_WEIGHT + xp
+
+
+class RankIndex:
+    """
+    Order-statistics index for one (guild, track): a sorted list of
+    (-score, user_id), so a user's position is a binary search.
+    """
+
+    def __init__(self, rows=()):
+        self._scores = {user_id: score for user_id, score in rows}
+        self._keys = sorted((-score, user_id) for user_id, score in self._scores.items())
+
+    def __len__(self):
+        return len(self._keys)
+
+    def update(self, user_id, score):
+        old = self._scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            del self._keys[bisect.bisect_left(self._keys, (-old, user_id))]
+        bisect.insort(self._keys, (-score, user_id))
+        self._scores[user_id] = score
+
+    def rank(self, user_id):
+        """0-based position, or None if the user has no XP record."""
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        return bisect.bisect_left(self._keys, (-score, user_id))
+
+
+class LevelingStore(abc.ABC):
+    """
+    Storage interface for leveling data: one record per (guild, user, track).
+    A user's data is handled as {track: {"xp": int, "level": int}}; tracks the
+    user never earned XP in are simply absent.
+    """
+
+    @abc.abstractmethod
+    async def load_user(self, guild_id, user_id):
+        ...
+
+    @abc.abstractmethod
+    async def save_users(self, records):
+        """records: {(guild_id, user_id): user_data}, written as one batch."""
+
+    @abc.abstractmethod
+    async def top(self, guild_id, track, limit=10):
+        """Returns [(user_id, level, xp)] ordered by level then XP, best first."""
+
+    @abc.abstractmethod
+    async def rank(self, guild_id, track, user_id):
+        """Returns (1-based position or None, number of ranked users) in O(log n)."""
+
+    async def close(self):
+        pass
+
+
+# --- SQLITE ENGINE ---
+SQL_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS levels (
+        guild_id INTEGER NOT NULL,
+        user_id  INTEGER NOT NULL,
+        track    TEXT    NOT NULL,
+        xp       INTEGER NOT NULL DEFAULT 0,
+        level    INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (guild_id, user_id, track)
+    ) WITHOUT ROWID""",
+    "CREATE INDEX IF NOT EXISTS levels_rank ON levels (guild_id, track, level DESC, xp DESC)",
+)
+SQL_LOAD_USER = "SELECT track, xp, level FROM levels WHERE guild_id = ? AND user_id = ?"
+SQL_UPSERT = """INSERT INTO levels (guild_id, user_id, track, xp, level) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (guild_id, user_id, track) DO UPDATE SET xp = excluded.xp, level = excluded.level"""
+SQL_TOP = "SELECT user_id, level, xp FROM levels WHERE guild_id = ? AND track = ? ORDER BY level DESC, xp DESC LIMIT ?"
+SQL_TRACK_SCORES = "SELECT user_id, level, xp FROM levels WHERE guild_id = ? AND track = ?"
+
+
+class SQLiteLevelingStore(LevelingStore):
+    """
+    SQLite (WAL) engine. The connection lives on one dedicated thread and every
+    query is shipped there, so the event loop never blocks on disk I/O.
+    Statements are constant strings, which sqlite3 keeps prepared in its cache.
+    Top-N reads come straight off the levels_rank index; rank lookups use a
+    RankIndex per (guild, track), loaded on first use and kept in sync by
+    every save (this process is the only writer of the local DB file).
+    """
+
+    def __init__(self, path=LEVELING_DB_PATH):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="leveling-sqlite")
+        self._conn = None
+        self._rank_indexes = {}  # (guild_id, track) -> RankIndex
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, cached_statements=64)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in SQL_SCHEMA:
+                self._conn.execute(statement)
+            self._conn.commit()
+        return self._conn
+
+    async def _submit(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _load_user(self, guild_id, user_id):
+        user_data = {}
+        for track, xp, level in self._connect().execute(SQL_LOAD_USER, (guild_id, user_id)):
+            user_data[track] = {"xp": xp, "level": level}
+        return user_data
+
+    def _save_users(self, records):
+        conn = self._connect()
+        rows = [
+            (guild_id, user_id, track, data["xp"], data["level"])
+            for (guild_id, user_id), user_data in records.items()
+            for track, data in user_data.items()
+        ]
+        with conn:
+            conn.executemany(SQL_UPSERT, rows)
+        for guild_id, user_id, track, xp, level in rows:
+            index = self._rank_indexes.get((guild_id, track))
+            if index is not None:
+                index.update(user_id, rank_score(level, xp))
+
+    def _top(self, guild_id, track, limit):
+        return self._connect().execute(SQL_TOP, (guild_id, track, limit)).fetchall()
+
+    def _rank(self, guild_id, track, user_id):
+        index = self._rank_indexes.get((guild_id, track))
+        if index is None:
+            rows = self._connect().execute(SQL_TRACK_SCORES, (guild_id, track))
+            index = self._rank_indexes[(guild_id, track)] = RankIndex((uid, rank_score(level, xp)) for uid, level, xp in rows)
+        position = index.rank(user_id)
+        return (position + 1 if position is not None else None), len(index)
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def load_user(self, guild_id, user_id):
+        return await self._submit(self._load_user, guild_id, user_id)
+
+    async def save_users(self, records):
+        await self._submit(self._save_users, records)
+
+    async def top(self, guild_id, track, limit=10):
+        return await self._submit(self._top, guild_id, track, limit)
+
+    async def rank(self, guild_id, track, user_id):
+        return await self._submit(self._rank, guild_id, track, user_id)
+
+    async def close(self):
+        await self._submit(self._close)
+        self._executor.shutdown(wait=True)
+
+
+# --- REDIS ENGINE (optional) ---
+class RedisLevelingStore(LevelingStore):
+    """
+    Redis engine: one hash per (guild, user) with "<track>:xp" / "<track>:level"
+    fields, plus a sorted set per (guild, track) scored by rank_score() that
+    serves top-N (ZREVRANGE) and rank (ZREVRANK) lookups.
+    """
+
+    def __init__(self):
+        from memory_store import MemoryStore  # Same pooled client + per-call timeouts as the AI memory
+        self.store = MemoryStore()
+
+    @staticmethod
+    def _key(guild_id, user_id):
+        return f"leveling:{guild_id}:{user_id}"
+
+    @staticmethod
+    def _rank_key(guild_id, track):
+        return f"leveling_rank:{guild_id}:{track}"
+
+    async def load_user(self, guild_id, user_id):
+        raw = await self.store.run(lambda c: c.hgetall(self._key(guild_id, user_id)))
+        user_data = {}
+        for field, value in raw.items():
+            track, _, attr = field.rpartition(":")
+            user_data.setdefault(track, {"xp": 0, "level": 0})[attr] = int(value)
+        return user_data
+
+    async def save_users(self, records):
+        def write(client):
+            pipe = client.pipeline(transaction=False)
+            for (guild_id, user_id), user_data in records.items():
+                mapping = {}
+                for track, data in user_data.items():
+                    mapping[f"{track}:xp"] = data["xp"]
+                    mapping[f"{track}:level"] = data["level"]
+                    pipe.zadd(self._rank_key(guild_id, track), {user_id: rank_score(data["level"], data["xp"])})
+                pipe.hset(self._key(guild_id, user_id), mapping=mapping)
+            return pipe.execute()
+        await self.store.run(write)
+
+    async def top(self, guild_id, track, limit=10):
+        rows = await self.store.run(lambda c: c.zrevrange(self._rank_key(guild_id, track), 0, limit - 1, withscores=True))
+        return [(int(user_id), *divmod(int(score), SCORE_LEVEL_WEIGHT)) for user_id, score in rows]
+
+    async def rank(self, guild_id, track, user_id):
+        def lookup(client):
+            pipe = client.pipeline(transaction=False)
+            pipe.zrevrank(self._rank_key(guild_id, track), user_id)
+            pipe.zcard(self._rank_key(guild_id, track))
+            return pipe.execute()
+        position, total = await self.store.run(lookup)
+        return (position + 1 if position is not None else None), total
+
+
+def create_store(backend=LEVELING_BACKEND):
+    if backend == "redis":
+        return RedisLevelingStore()
+    return SQLiteLevelingStore()
+
+
+# --- MIGRATION FROM REPLIT DB ---
+async def migrate_from_replit(guild_id, store=None):
+    """
+    Imports the old Replit DB records ("<user_id>" -> JSON with role_a/role_b).
+    Replit data had no guild scope, so everything lands in `guild_id`.
+    """
+    from replit import db
+
+    store = store or create_store()
+    records = {}
+    for key in db.keys():
+        if not key.isdigit():
+            continue
+        try:
+            user_data = json.loads(db[key])
+        except (TypeError, ValueError):
+            continue
+        records[(guild_id, int(key))] = {track: user_data[track] for track in LEGACY_TRACKS if track in user_data}
+    await store.save_users(records)
+    await store.close()
+    return len(records)
+
+
+if __name__ == "__main__":
+    # Usage: python leveling_store.py migrate-replit <guild_id>
+    if len(sys.argv) != 3 or sys.argv[1] != "migrate-replit":
+        sys.exit("Usage: python leveling_store.py migrate-replit <guild_id>")
+    count = asyncio.run(migrate_from_replit(int(sys.argv[2])))
+    print(f"Imported {count} user(s) from Replit DB into the {LEVELING_BACKEND} store.")
@@ -0,0 +1,112 @@
+import json
+import math
+import os
+
+# --- DEFAULT TRACK CONFIGURATION ---
+ROLE_MV_ID = 1433114931313643681
+ROLE_FRIENDS_ID = 1433120829016899757
+XP_PER_MESSAGE = 15
+XP_COOLDOWN = 60
+CURVE_BASE = 100  # XP to go from level L to L+1 = CURVE_BASE * (L + 1)
+
+# Optional per-guild overrides, e.g.
+# {"123456789": [{"key": "role_a", "name": "Role MV", "role_id": 1433114931313643681,
+#                 "aliases": ["mv"], "xp_per_message": 20, "cooldown": 45, "curve_base": 120}]}
+LEVELING_TRACKS_FILE = os.environ.get("LEVELING_TRACKS_FILE")
+
+
+class Track:
+    __slots__ = ("key", "name", "role_id", "aliases", "emoji", "xp_per_message", "cooldown", "curve_base")
+
+    def __init__(self, key, name, role_id, aliases=(), emoji="🔹", xp_per_message=XP_PER_MESSAGE,
+                 cooldown=XP_COOLDOWN, curve_base=CURVE_BASE):
+        self.key = key            # Storage key, e.g. "role_a"
+        self.name = name          # Display name, e.g. "Role MV"
+        self.role_id = role_id
+        self.aliases = tuple(a.lower() for a in aliases)
+        self.emoji = emoji
+        self.xp_per_message = xp_per_message
+        self.cooldown = cooldown
+        self.curve_base = curve_base
+
+    def xp_for_next_level(self, level):
+        return xp_for_next_level(level, self.curve_base)
+
+
+DEFAULT_TRACKS = [
+    Track("role_a", "Role MV", ROLE_MV_ID, aliases=("mv",), emoji="🔵"),
+    Track("role_b", "Role Friends", ROLE_FRIENDS_ID, aliases=("friends",), emoji="🟢"),
+]
+
+
+# --- LEVEL FORMULA ---
+def xp_for_next_level(level, curve_base=CURVE_BASE):
+    return curve_base * (level + 1)
+
+
+def check_level_up(role_data, curve_base=CURVE_BASE):
+    """
+    Closed form for the curve_base * (level + 1) curve: reaching level L takes
+    curve_base * L * (L + 1) / 2 XP in total, so the new level is the largest L
+    with L * (L + 1) <= 2 * total / curve_base. O(1) for any XP grant.
+    """
+    if role_data["xp"] < 0:
+        return role_data  # Negative grants never level down
+    total = curve_base * role_data["level"] * (role_data["level"] + 1) // 2 + role_data["xp"]
+    m = 2 * total // curve_base
+    level = (math.isqrt(4 * m + 1) - 1) // 2
+    role_data["level"] = level
+    role_data["xp"] = total - curve_base * level * (level + 1) // 2
+    return role_data
+
+
+# --- REGISTRY ---
+class TrackRegistry:
+    """
+    Per-guild track tables plus a precomputed role id -> tracks index, so a
+    message only needs one pass over the author's roles.
+    """
+
+    def __init__(self, default_tracks=DEFAULT_TRACKS, guild_tracks=None):
+        self.default_tracks = list(default_tracks)
+        self.guild_tracks = {int(g): list(tracks) for g, tracks in (guild_tracks or {}).items()}
+        self._role_index = {}  # guild_id (None = default) -> {role_id: [Track]}
+
+    @classmethod
+    def from_file(cls, path=LEVELING_TRACKS_FILE):
+        if not path:
+            return cls()
+        with open(path) as f:
+            raw = json.load(f)
+        return cls(guild_tracks={guild_id: [Track(**t) for t in tracks] for guild_id, tracks in raw.items()})
+
+    def tracks(self, guild_id):
+        return self.guild_tracks.get(guild_id, self.default_tracks)
+
+    def _index(self, guild_id):
+        key = guild_id if guild_id in self.guild_tracks else None
+        index = self._role_index.get(key)
+        if index is None:
+            index = {}
+            for track in self.tracks(guild_id):
+                index.setdefault(track.role_id, []).append(track)
+            self._role_index[key] = index
+        return index
+
+    def tracks_for_roles(self, guild_id, roles):
+        index = self._index(guild_id)
+        matched = []
+        for role in roles:
+            matched.extend(index.get(role.id, ()))
+        return matched
+
+    def find(self, guild_id, name):
+        """Looks a track up by alias, key or display name (case-insensitive)."""
+        name = name.lower()
+        for track in self.tracks(guild_id):
+            if name in track.aliases or name == track.key or name == track.name.lower():
+                return track
+        return None
+
+    def choices(self, guild_id):
+        return "', '".join(track.aliases[0] if track.aliases else track.key for track in self.tracks(guild_id))
@@ -0,0 +1,1133 @@
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import time
+from collections import Counter, deque
+
+# Project modules read their configuration from the environment at import time,
+# so they are only imported (inside run()) after configure_env().
+
+# --- LOAD TEST CONFIGURATION ---
+DEFAULT_MIX = "chatter=80,mention=10,reply=6,translate=4"
+DEFAULT_ROLES = "mv=0.6,friends=0.4,lang=0.5"  # Chance that a synthetic member has each role
+RESERVOIR_SIZE = 20000                         # Latency samples kept per series (bounded, so soaks don't grow)
+LOOP_LAG_INTERVAL = 0.02
+SNOWFLAKE_START = 1_300_000_000_000_000_000
+BOT_USER_ID = 1_000_000_000_000_000_001
+TRANSLATE_TARGETS = ("indonesian", "english", "thai", "vietnamese")
+
+CHATTER = (
+    "lol that was a good game last night",
+    "anyone up for ranked later?",
+    "gw baru pulang kerja, capek banget hari ini",
+    "wkwk iya bener banget",
+    "good morning everyone ☀️",
+    "ada yang tau cara setting mic biar gak echo?",
+    "hôm nay trời đẹp quá",
+    "วันนี้อากาศดีมาก",
+    "brb getting food",
+    "that patch broke everything again 😭",
+    "salamat sa tulong kanina",
+    "nice clip, send it in #highlights",
+)
+QUESTIONS = (
+    "what is the best way to learn {topic}?",
+    "can you explain {topic} in two sentences?",
+    "gimana cara mulai belajar {topic}?",
+    "give me three tips for {topic}",
+    "is {topic} worth it in {year}?",
+    "apa bedanya {topic} sama {other}?",
+    "summarize the history of {topic}",
+    "recommend a beginner resource for {topic}",
+)
+TOPICS = (
+    "python", "guitar", "cooking rice", "rust", "drawing", "chess", "japanese", "investing",
+    "photography", "running", "valorant aim", "video editing", "sql", "gardening", "linux",
+)
+
+
+# --- STATISTICS ---
+class Series:
+    """Exact count / mean / max plus a fixed-size reservoir sample for percentiles."""
+    __slots__ = ("count", "total", "max", "samples", "rng")
+
+    def __init__(self, seed=0):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = []
+        self.rng = random.Random(seed)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        if len(self.samples) < RESERVOIR_SIZE:
+            self.samples.append(value)
+        else:
+            slot = self.rng.randrange(self.count)
+            if slot < RESERVOIR_SIZE:
+                self.samples[slot] = value
+
+    def summary(self, scale=1000.0):
+        """Milliseconds by default."""
+        if not self.count:
+            return {"count": 0}
+        ordered = sorted(self.samples)
+
+        def pct(p):
+            return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * scale
+
+        return {
+            "count": self.count,
+            "mean": self.total / self.count * scale,
+            "p50": pct(50),
+            "p95": pct(95),
+            "p99": pct(99),
+            "max": self.max * scale,
+        }
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Peak, not current, off Linux
+
+
+class _WarningCounter(logging.Handler):
+    """Counts the bot's warnings/errors, e.g. handler failures the router logs and swallows."""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.counts = Counter()
+
+    def emit(self, record):
+        self.counts[f"{record.name}:{record.levelname.lower()}"] += 1
+
+
+# --- FAKE GROQ ---
+class FakeGroqServer:
+    """
+    OpenAI-compatible /openai/v1/chat/completions on 127.0.0.1, so the real
+    AsyncGroq client (retries, SSE parsing) is part of the measurement.
+    Latency is time to the first byte; streamed tokens arrive token_delay apart.
+    """
+
+    def __init__(self, latency=0.3, jitter=0.1, rate_limit=0.0, retry_after=0.5, tokens=60, token_delay=0.01, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.rng = random.Random(seed)
+        self.counts = Counter()
+        self.url = None
+        self._runner = None
+
+    async def start(self):
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_post("/openai/v1/chat/completions", self._completions)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def _answer(self, body):
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            # Translator / fact cleaner: echo every input item back, "translated"
+            try:
+                items = json.loads(body["messages"][-1]["content"])
+            except (ValueError, KeyError, IndexError):
+                items = []
+            if isinstance(items, list):
+                return json.dumps({
+                    "translations": [{"id": item.get("id"), "text": f"(translated) {item.get('text', '')}"} for item in items],
+                    "facts": [{"id": item.get("id"), "fact": f"They said: {item.get('sentence', '')}"} for item in items],
+                })
+            return json.dumps({"translations": [], "facts": []})
+        return " ".join(self.rng.choice(TOPICS).split()[0] for _ in range(self.tokens))
+
+    async def _completions(self, request):
+        from aiohttp import web
+        body = await request.json()
+        self.counts["requests"] += 1
+        await asyncio.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+        if self.rng.random() < self.rate_limit:
+            self.counts["rate_limited"] += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached (load test)", "type": "tokens", "code": "rate_limit_exceeded"}},
+                status=429,
+                headers={"retry-after": str(self.retry_after)},
+            )
+
+        text = self._answer(body)
+        prompt_tokens = sum(len(m.get("content") or "") // 4 + 4 for m in body.get("messages", []))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": self.tokens, "total_tokens": prompt_tokens + self.tokens}
+        base = {"id": f"chatcmpl-{self.counts['requests']}", "created": int(time.time()), "model": body.get("model", "fake")}
+
+        if not body.get("stream"):
+            return web.json_response(dict(base, object="chat.completion", usage=usage, choices=[
+                {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop", "logprobs": None}
+            ]))
+
+        self.counts["streamed"] += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+
+        async def event(delta, finish_reason=None, **extra):
+            chunk = dict(base, object="chat.completion.chunk", choices=[
+                {"index": 0, "delta": delta, "finish_reason": finish_reason, "logprobs": None}
+            ], **extra)
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        try:
+            await response.prepare(request)
+            await event({"role": "assistant", "content": ""})
+            for word in text.split(" "):
+                await event({"content": word + " "})
+                if self.token_delay:
+                    await asyncio.sleep(self.token_delay)
+            await event({}, "stop", x_groq={"usage": usage})
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+        except ConnectionResetError:
+            self.counts["abandoned"] += 1  # The bot cancelled the request mid-stream
+        return response
+
+
+# --- FAKE REDIS ---
+def fake_redis(latency=0.0, jitter=0.0, seed=1):
+    """
+    fakeredis client whose every round trip (one command, or one whole
+    pipeline) first waits latency ± jitter seconds, like a Redis across the
+    network. Returns (client, Counter of round trips).
+    """
+    import fakeredis
+    from fakeredis.aioredis import FakeAsyncRedisConnection
+
+    rng = random.Random(seed)
+    trips = Counter()
+
+    class SlowConnection(FakeAsyncRedisConnection):
+        async def send_packed_command(self, command, check_health=True):
+            trips["round_trips"] += 1
+            delay = latency + rng.uniform(-jitter, jitter) if latency else 0.0
+            if delay > 0:
+                await asyncio.sleep(delay)
+            return await super().send_packed_command(command, check_health)
+
+    client = fakeredis.FakeAsyncRedis(decode_responses=True, connection_class=SlowConnection)
+    return client, trips
+
+
+# --- FAKE DISCORD ---
+class FakeDiscord:
+    """
+    The REST side of Discord: every send/edit/typing waits rest_latency and is
+    counted. Replies are tied back to the message they answer, so AI latency
+    can be measured up to the first reply and up to the last edit.
+    """
+
+    def __init__(self, rest_latency=0.05):
+        self.rest_latency = rest_latency
+        self.calls = Counter()
+        self.first_reply = {}  # answered message id -> loop time
+        self.last_update = {}  # answered message id -> loop time
+        self._ids = itertools.count(SNOWFLAKE_START)
+
+    def next_id(self):
+        return next(self._ids)
+
+    async def rest(self, route, answers=None):
+        self.calls[route] += 1
+        if self.rest_latency:
+            await asyncio.sleep(self.rest_latency)
+        if answers is not None:
+            now = asyncio.get_running_loop().time()
+            self.first_reply.setdefault(answers, now)
+            self.last_update[answers] = now
+
+
+class FakeUser:
+    __slots__ = ("id", "display_name", "mention", "bot", "roles")
+
+    def __init__(self, id, display_name, bot=False, roles=()):
+        self.id = id
+        self.display_name = display_name
+        self.mention = f"<@{id}>"
+        self.bot = bot
+        self.roles = list(roles)
+
+
+class FakeGuild:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.shard_id = 0
+        self.members = {}
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+
+class FakeReference:
+    __slots__ = ("resolved", "message_id")
+
+    def __init__(self, resolved):
+        self.resolved = resolved
+        self.message_id = resolved.id
+
+
+class FakeMessage:
+    __slots__ = ("id", "content", "author", "guild", "channel", "reference", "answers")
+
+    def __init__(self, id, content, author, channel, reference=None, answers=None):
+        self.id = id
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.reference = reference
+        self.answers = answers  # For the bot's own messages: id of the message it replies to
+
+    async def reply(self, content=None, **kwargs):
+        return await self.channel.send(content, _answers=self.id, **kwargs)
+
+    async def edit(self, content=None, **kwargs):
+        await self.channel.discord.rest("edit", self.answers)
+        if content is not None:
+            self.content = content
+        return self
+
+    async def delete(self):
+        await self.channel.discord.rest("delete", self.answers)
+
+
+class FakeChannel:
+    def __init__(self, discord, id, name, guild, bot_user, history_size=50):
+        self.discord = discord
+        self.id = id
+        self.name = name
+        self.guild = guild
+        self.bot_user = bot_user
+        self.log = deque(maxlen=history_size)      # Recent human messages, served by history()
+        self.bot_messages = deque(maxlen=20)       # Targets for synthetic replies
+
+    async def send(self, content=None, _answers=None, **kwargs):
+        await self.discord.rest("send", _answers)
+        sent = FakeMessage(self.discord.next_id(), content or "", self.bot_user, self, answers=_answers)
+        self.bot_messages.append(sent)
+        return sent
+
+    async def typing(self):
+        await self.discord.rest("typing")
+
+    async def history(self, limit=100, before=None):
+        await self.discord.rest("history")
+        before_id = before.id if before is not None else float("inf")
+        returned = 0
+        for message in reversed(self.log):
+            if message.id < before_id:
+                yield message
+                returned += 1
+                if returned >= limit:
+                    return
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(message_id, "", None, self)
+
+
+class FakeBot:
+    """What the cogs and the router read off the bot; one per simulated process."""
+
+    def __init__(self, user, channels):
+        self.command_prefix = "$"
+        self.user = user
+        self.latency = 0.05
+        self.guilds = []
+        self._channels = channels  # channel id -> FakeChannel, shared with the traffic generator
+        self.commands_processed = 0
+
+    async def process_commands(self, message):
+        self.commands_processed += 1
+
+    def get_channel(self, channel_id):
+        return self._channels.get(channel_id)
+
+    def get_partial_messageable(self, channel_id, guild_id=None):
+        return self._channels[channel_id]
+
+
+# --- TRAFFIC ---
+def parse_weights(spec):
+    """"a=1,b=2.5" -> {"a": 1.0, "b": 2.5}"""
+    weights = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, value = part.partition("=")
+        weights[name.strip()] = float(value)
+    return weights
+
+
+class Traffic:
+    """Seeded stream of synthetic gateway messages over a fixed set of members and channels."""
+
+    KINDS = ("chatter", "mention", "reply", "translate")
+
+    def __init__(self, discord, bot_user, mix, roles, users, channels, language_roles, track_roles, seed=0):
+        self.discord = discord
+        self.bot_user = bot_user
+        self.rng = random.Random(seed)
+        unknown = set(mix) - set(self.KINDS)
+        if unknown:
+            raise ValueError(f"Unknown message kind(s) {sorted(unknown)}, expected {self.KINDS}")
+        self.kinds = [k for k in self.KINDS if mix.get(k)]
+        self.weights = [mix[k] for k in self.kinds]
+
+        guild = FakeGuild(900_000_000_000_000_001, "Load Test Guild")
+        self.channels = {}
+        for i in range(channels):
+            channel = FakeChannel(discord, 800_000_000_000_000_000 + i, f"channel-{i}", guild, bot_user)
+            self.channels[channel.id] = channel
+        self._channel_list = list(self.channels.values())
+
+        import discord as discord_py
+        role_ids = dict(track_roles)  # name -> role id, e.g. {"mv": ..., "friends": ...}
+        self.members = []
+        for i in range(users):
+            member_roles = [discord_py.Object(id=role_id) for name, role_id in role_ids.items() if self.rng.random() < roles.get(name, 0)]
+            if language_roles and self.rng.random() < roles.get("lang", 0):
+                member_roles.append(discord_py.Object(id=self.rng.choice(language_roles)))
+            member = FakeUser(700_000_000_000_000_000 + i, f"member{i}", roles=member_roles)
+            guild.members[member.id] = member
+            self.members.append(member)
+
+    def _question(self):
+        return self.rng.choice(QUESTIONS).format(
+            topic=self.rng.choice(TOPICS), other=self.rng.choice(TOPICS), year=self.rng.randint(2020, 2030)
+        )
+
+    def next(self):
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        channel = self.rng.choice(self._channel_list)
+        author = self.rng.choice(self.members)
+        mention = self.bot_user.mention
+        reference = None
+        if kind == "reply" and channel.bot_messages:
+            reference = FakeReference(self.rng.choice(channel.bot_messages))
+            content = self._question()
+        elif kind == "translate":
+            content = f"{mention} translate to {self.rng.choice(TRANSLATE_TARGETS)} [{self.rng.randint(2, 10)}]"
+        elif kind in ("mention", "reply"):
+            kind = "mention"  # Nothing to reply to in this channel yet
+            content = f"{mention} {self._question()}"
+        else:
+            content = self.rng.choice(CHATTER)
+        message = FakeMessage(self.discord.next_id(), content, author, channel, reference)
+        if kind == "chatter":
+            channel.log.append(message)
+        return kind, message
+
+
+# --- RUN ---
+def configure_env(args, groq_url):
+    """Points the bot at the fakes. Explicit environment variables still win for tuning knobs."""
+    os.environ.update({
+        "GROQ_API_KEY": "loadtest",
+        "GROQ_BASE_URL": groq_url,
+        "AI_JOB_MODE": args.ai_mode,
+        "AI_STREAM_RESPONSES": "1" if args.stream else "0",
+        "AI_RESPONSE_CACHE": "1" if args.response_cache else "0",
+        "COOLDOWN_BACKEND": args.cooldowns,
+        "LEVELING_BACKEND": args.leveling,
+        "LEVELING_DB_PATH": ":memory:",
+        "METRICS_PORT": "0",
+    })
+    if args.redis != "fake":
+        os.environ["REDIS_URL"] = args.redis
+    # The real Groq limits would make this a test of the token buckets, not of the bot
+    os.environ.setdefault("GROQ_RPM", "1000000")
+    os.environ.setdefault("GROQ_TPM", "1000000000")
+    os.environ.setdefault("GROQ_MAX_QUEUE", "100000")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("LOG_FORMAT", "text")
+
+
+async def monitor_loop_lag(series, interval=LOOP_LAG_INTERVAL):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        series.add(max(0.0, loop.time() - expected))
+
+
+async def sample_memory(samples, started, interval):
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        samples.append((loop.time() - started, rss_bytes()))
+
+
+def growth_per_hour(samples):
+    """Least-squares RSS slope (MB/hour) over the second half of the run, after warm-up."""
+    tail = samples[len(samples) // 2:]
+    if len(tail) < 2:
+        return 0.0
+    n = len(tail)
+    mean_t = sum(t for t, _ in tail) / n
+    mean_m = sum(m for _, m in tail) / n
+    var = sum((t - mean_t) ** 2 for t, _ in tail)
+    if not var:
+        return 0.0
+    slope = sum((t - mean_t) * (m - mean_m) for t, m in tail) / var  # bytes per second
+    return slope * 3600 / 2 ** 20
+
+
+async def run(args):
+    groq = FakeGroqServer(
+        latency=args.groq_latency, jitter=args.groq_jitter, rate_limit=args.groq_429,
+        tokens=args.groq_tokens, token_delay=args.groq_token_delay, seed=args.seed,
+    )
+    configure_env(args, await groq.start())
+
+    import redis_pool
+    redis_trips = Counter()
+    if args.redis == "fake":
+        redis_pool._client, redis_trips = fake_redis(args.redis_latency, args.redis_jitter, args.seed)
+
+    import metrics
+    from logs import ROOT_LOGGER
+    from ai_cog import AICog, ROLE_LANGUAGE_MAP
+    from ai_jobs import consume_jobs
+    from leveling_cog import LevelingCog
+    from leveling_tracks import DEFAULT_TRACKS
+
+    warnings = _WarningCounter()
+    logging.getLogger(ROOT_LOGGER).addHandler(warnings)
+
+    loop = asyncio.get_running_loop()
+    discord = FakeDiscord(rest_latency=args.rest_latency)
+    bot_user = FakeUser(BOT_USER_ID, "Z-Bot", bot=True)
+    traffic = Traffic(
+        discord, bot_user,
+        mix=parse_weights(args.mix),
+        roles=parse_weights(args.roles),
+        users=args.users,
+        channels=args.channels,
+        language_roles=list(ROLE_LANGUAGE_MAP),
+        track_roles=[(track.aliases[0] if track.aliases else track.key, track.role_id) for track in DEFAULT_TRACKS],
+        seed=args.seed,
+    )
+    bot = FakeBot(bot_user, traffic.channels)
+    ai = AICog(bot)
+    leveling = LevelingCog(bot)
+    for cog in (ai, leveling):
+        await cog.cog_load()
+    await ai.warm_up_task
+
+    worker = worker_task = None
+    if args.ai_mode == "queue":
+        worker = AICog(FakeBot(bot_user, traffic.channels))  # Stands in for a `python ai_jobs.py worker` process
+        await worker.cog_load()
+        await worker.warm_up_task
+        worker_task = asyncio.create_task(consume_jobs(worker, worker.bot, args.worker_concurrency, consumer="loadtest"))
+
+    router = bot.router
+    handler = {kind: Series(args.seed) for kind in Traffic.KINDS}
+    first_reply = Series(args.seed)
+    completed = Series(args.seed)
+    loop_lag = Series(args.seed)
+    ai_messages = {}  # message id -> dispatch start, for AI kinds
+    gc.collect()
+    rss_start = rss_bytes()
+    memory = [(0.0, rss_start)]
+    tracemalloc_start = None
+    if args.tracemalloc:
+        import tracemalloc
+        tracemalloc.start(10)
+        tracemalloc_start = tracemalloc.take_snapshot()
+
+    started = loop.time()
+    monitors = [
+        asyncio.create_task(monitor_loop_lag(loop_lag)),
+        asyncio.create_task(sample_memory(memory, started, args.sample_interval)),
+    ]
+    deadline = started + args.duration if args.duration else None
+    produced = itertools.count(1)
+    limit = None if args.duration else args.messages
+
+    def more():
+        if deadline is not None:
+            return loop.time() < deadline
+        return next(produced) <= limit
+
+    async def deliver(kind, message):
+        if kind != "chatter":
+            ai_messages[message.id] = loop.time()
+        t0 = time.perf_counter()
+        await router.dispatch(message)
+        handler[kind].add(time.perf_counter() - t0)
+
+    in_flight = asyncio.Semaphore(args.concurrency)
+
+    async def deliver_limited(kind, message):
+        try:
+            await deliver(kind, message)
+        finally:
+            in_flight.release()
+
+    tasks = set()
+    if args.rate:
+        # Open loop: arrivals on a fixed schedule, at most `concurrency` handlers in flight
+        interval = 1 / args.rate
+        next_at = loop.time()
+        while more():
+            await in_flight.acquire()
+            task = asyncio.create_task(deliver_limited(*traffic.next()))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            next_at += interval
+            delay = next_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                next_at = loop.time()  # Behind schedule: don't burst to catch up
+    else:
+        # Closed loop: `concurrency` senders, each waiting for its previous message to be handled
+        async def sender():
+            while more():
+                await deliver(*traffic.next())
+        await asyncio.gather(*(sender() for _ in range(args.concurrency)))
+    if tasks:
+        await asyncio.gather(*tasks)
+    dispatched = sum(series.count for series in handler.values())
+    elapsed = loop.time() - started
+
+    # In queue mode the answers come after dispatch returned; finished jobs are deleted from the stream
+    if worker_task is not None:
+        drain_deadline = loop.time() + args.drain_timeout
+        while loop.time() < drain_deadline and await ai.jobs.depth():
+            await asyncio.sleep(0.1)
+        worker_task.cancel()
+        await asyncio.gather(worker_task, return_exceptions=True)
+
+    for message_id, dispatched_at in ai_messages.items():
+        if message_id in discord.first_reply:
+            first_reply.add(discord.first_reply[message_id] - dispatched_at)
+            completed.add(discord.last_update[message_id] - dispatched_at)
+
+    for task in monitors:
+        task.cancel()
+    await asyncio.gather(*monitors, return_exceptions=True)
+    gc.collect()
+    rss_end = rss_bytes()
+
+    leaks = []
+    if tracemalloc_start is not None:
+        import tracemalloc
+        for stat in tracemalloc.take_snapshot().compare_to(tracemalloc_start, "lineno")[:10]:
+            leaks.append(f"{stat.size_diff / 1024:+.1f} KiB {stat.count_diff:+d} blocks  {stat.traceback[0]}")
+        tracemalloc.stop()
+
+    for cog in filter(None, (worker, leveling, ai)):
+        await cog.cog_unload()
+    await groq.close()
+
+    cache_counts = {
+        f"{dict(key).get('cache')}:{dict(key).get('result')}": int(value)
+        for key, value in metrics.CACHE_REQUESTS.values.items()
+    }
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("save", "baseline", "command", "func", "tolerance", "min_delta_ms")},
+        "messages": dispatched,
+        "elapsed_s": elapsed,
+        "throughput": dispatched / elapsed if elapsed else 0.0,
+        "handler_ms": {kind: series.summary() for kind, series in handler.items() if series.count},
+        "ai_first_reply_ms": first_reply.summary(),
+        "ai_complete_ms": completed.summary(),
+        "ai_unanswered": len(ai_messages) - first_reply.count,
+        "loop_lag_ms": loop_lag.summary(),
+        "memory": {
+            "rss_start_mb": rss_start / 2 ** 20,
+            "rss_end_mb": rss_end / 2 ** 20,
+            "rss_peak_mb": max(m for _, m in memory + [(0, rss_end)]) / 2 ** 20,
+            "growth_mb": (rss_end - rss_start) / 2 ** 20,
+            "growth_mb_per_hour": growth_per_hour(memory),
+            "top_allocations": leaks,
+        },
+        "groq": dict(groq.counts),
+        "discord": dict(discord.calls),
+        "redis": dict(redis_trips),
+        "caches": cache_counts,
+        "warnings": dict(warnings.counts),
+    }
+
+
+# --- SHARDED GATEWAY ---
+# Runs main.py with its own discord.py pointed at the fake gateway below; sys.argv: gateway url, main.py path
+SHARD_BOOTSTRAP = """
+import runpy, sys, yarl, discord.gateway, discord.http
+discord.http.Route.BASE = sys.argv[1] + "/api/v10"
+discord.gateway.DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(sys.argv[1].replace("http", "ws", 1) + "/gateway")
+sys.argv = sys.argv[2:]
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+SHARD_TIMESTAMP = "2026-01-01T00:00:00+00:00"
+
+
+def discord_user(user_id, name, bot=False):
+    return {"id": str(user_id), "username": name, "global_name": name, "discriminator": "0", "avatar": None, "bot": bot}
+
+
+class FakeGateway:
+    """
+    Discord REST API + gateway websocket on 127.0.0.1 for whole bot processes.
+    Every IDENTIFY gets READY plus a GUILD_CREATE for each guild on its shard
+    ((guild_id >> 22) % shard_count, as Discord routes them). Each process
+    logs in with its own token, so IDENTIFYs, replies and command syncs can
+    be traced back to the process that made them.
+    """
+
+    def __init__(self, guild_ids, shard_count):
+        self.guild_ids = guild_ids
+        self.shard_count = shard_count
+        self.channels = {guild_id + 1: guild_id for guild_id in guild_ids}  # One text channel per guild
+        self.bot_user = discord_user(BOT_USER_ID, "Z-Bot", bot=True)
+        self.connections = {}    # shard id -> websocket
+        self.identified = []     # (token, shard id), in order
+        self.replies = {}        # guild id -> [token of each bot message sent there]
+        self.synced = []         # Tokens that uploaded the global command tree
+        self.unknown = Counter()  # REST routes the fake doesn't serve
+        self.ids = itertools.count(SNOWFLAKE_START + (1 << 40))
+        self.url = None
+        self._runner = None
+
+    def shard_of(self, guild_id):
+        return (guild_id >> 22) % self.shard_count
+
+    async def start(self):
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get("/gateway", self._gateway)
+        app.router.add_route("*", "/api/v10/{path:.*}", self._rest)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+        return self.url
+
+    async def close(self):
+        for ws in list(self.connections.values()):
+            await ws.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    # --- REST ---
+    def _message(self, channel_id, author, content, mentions=(), member=None):
+        message = {
+            "id": str(next(self.ids)), "channel_id": str(channel_id), "guild_id": str(self.channels[channel_id]),
+            "author": author, "content": content, "timestamp": SHARD_TIMESTAMP, "edited_timestamp": None,
+            "tts": False, "mention_everyone": False, "mentions": list(mentions), "mention_roles": [],
+            "attachments": [], "embeds": [], "pinned": False, "type": 0,
+        }
+        if member is not None:
+            message["member"] = member
+        return message
+
+    async def _rest(self, request):
+        from aiohttp import web
+
+        def _json_response(data, status=200):
+            # Exactly "application/json": discord.py leaves anything else (even with a charset) unparsed
+            return web.Response(body=json.dumps(data).encode(), status=status, headers={"Content-Type": "application/json"})
+        token = request.headers.get("Authorization", "").removeprefix("Bot ")
+        path = request.match_info["path"].split("/")
+        route = (request.method, *("{id}" if part.isdigit() else part for part in path))
+
+        if route == ("GET", "users", "@me"):
+            return _json_response(self.bot_user)
+        if route == ("GET", "oauth2", "applications", "@me"):
+            return _json_response({
+                "id": str(BOT_USER_ID), "name": "Z-Bot", "description": "", "icon": None, "bot_public": False,
+                "bot_require_code_grant": False, "owner": discord_user(BOT_USER_ID + 1, "owner"),
+                "verify_key": "0" * 64, "flags": 0,
+            })
+        if route == ("PUT", "applications", "{id}", "commands"):
+            self.synced.append(token)
+            commands = await request.json()
+            return _json_response([
+                dict(command, id=str(next(self.ids)), application_id=str(BOT_USER_ID), version="1") for command in commands
+            ])
+        if route == ("POST", "channels", "{id}", "typing"):
+            return web.Response(status=204)
+        if route == ("POST", "channels", "{id}", "messages"):
+            channel_id = int(path[1])
+            self.replies.setdefault(self.channels[channel_id], []).append(token)
+            body = await request.json() if request.content_type == "application/json" else {}
+            return _json_response(self._message(channel_id, self.bot_user, body.get("content") or ""))
+
+        self.unknown[" ".join(route)] += 1
+        return _json_response({"message": "Unknown route (load test)", "code": 0}, status=404)
+
+    # --- GATEWAY ---
+    async def _gateway(self, request):
+        from aiohttp import web, WSMsgType
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        seq = itertools.count(1)
+
+        async def dispatch(event, data):
+            await ws.send_json({"op": 0, "t": event, "s": next(seq), "d": data})
+
+        await ws.send_json({"op": 10, "t": None, "s": None, "d": {"heartbeat_interval": 41250}})
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            payload = json.loads(msg.data)
+            op, data = payload.get("op"), payload.get("d") or {}
+            if op == 1:  # Heartbeat
+                await ws.send_json({"op": 11, "t": None, "s": None, "d": None})
+            elif op == 2:  # Identify
+                shard_id, shard_count = data.get("shard", (0, 1))
+                self.identified.append((data["token"], shard_id))
+                self.connections[shard_id] = ws
+                guild_ids = [g for g in self.guild_ids if (g >> 22) % shard_count == shard_id]
+                await dispatch("READY", {
+                    "v": 10, "user": self.bot_user, "session_id": f"loadtest-{shard_id}",
+                    "resume_gateway_url": self.url.replace("http", "ws", 1) + "/gateway",
+                    "shard": [shard_id, shard_count], "application": {"id": str(BOT_USER_ID), "flags": 0},
+                    "guilds": [{"id": str(g), "unavailable": True} for g in guild_ids],
+                })
+                for guild_id in guild_ids:
+                    await dispatch("GUILD_CREATE", self._guild(guild_id))
+            elif op == 8:  # Request guild members: every guild is already complete
+                await dispatch("GUILD_MEMBERS_CHUNK", {
+                    "guild_id": data.get("guild_id"), "members": [], "chunk_index": 0, "chunk_count": 1, "nonce": data.get("nonce"),
+                })
+        return ws
+
+    def _guild(self, guild_id):
+        bot_member = {"user": self.bot_user, "roles": [], "joined_at": SHARD_TIMESTAMP, "deaf": False, "mute": False, "flags": 0}
+        return {
+            "id": str(guild_id), "name": f"Guild {guild_id}", "icon": None, "owner_id": str(BOT_USER_ID + 1),
+            "unavailable": False, "large": False, "member_count": 1, "joined_at": SHARD_TIMESTAMP,
+            "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0, "color": 0,
+                       "hoist": False, "managed": False, "mentionable": False, "flags": 0}],
+            "channels": [{"id": str(guild_id + 1), "type": 0, "name": "general", "position": 0,
+                          "permission_overwrites": [], "nsfw": False, "parent_id": None}],
+            "members": [bot_member], "emojis": [], "stickers": [], "threads": [], "stage_instances": [],
+            "guild_scheduled_events": [], "voice_states": [], "presences": [], "features": [],
+            "verification_level": 0, "default_message_notifications": 0, "explicit_content_filter": 0,
+            "mfa_level": 0, "nsfw_level": 0, "premium_tier": 0, "system_channel_flags": 0, "preferred_locale": "en-US",
+        }
+
+    async def mention(self, guild_id, author_id):
+        """Sends an AI mention in the guild, on the connection of the shard Discord would route it to."""
+        author = discord_user(author_id, f"user{author_id % 1000}")
+        member = {"roles": [], "joined_at": SHARD_TIMESTAMP, "deaf": False, "mute": False, "flags": 0}
+        message = self._message(guild_id + 1, author, f"<@{BOT_USER_ID}> which shard are you?", [self.bot_user], member)
+        await self.connections[self.shard_of(guild_id)].send_json(
+            {"op": 0, "t": "MESSAGE_CREATE", "s": None, "d": message}
+        )
+
+
+async def run_shards(args):
+    """
+    Starts `args.processes` main.py processes with disjoint SHARD_IDS against
+    the fake gateway (sharing one fakeredis server, as they would one Redis),
+    sends an AI mention in every guild and checks that each was answered
+    once, by the process running that guild's shard, and that only the
+    process with shard 0 synced the command tree.
+    """
+    import shutil
+    import tempfile
+    import threading
+    from fakeredis import TcpFakeServer
+    from main import parse_shard_ids, split_shards
+
+    redis_server = TcpFakeServer(("127.0.0.1", 0))
+    threading.Thread(target=redis_server.serve_forever, daemon=True).start()
+    guild_ids = [SNOWFLAKE_START + (i << 22) for i in range(args.guilds)]  # Consecutive shards
+    gateway = FakeGateway(guild_ids, args.shards)
+    url = await gateway.start()
+    ranges = split_shards(args.shards, args.processes)
+    tokens = [f"loadtest-process-{i}" for i in range(len(ranges))]
+    owner = {shard: token for token, spec in zip(tokens, ranges) for shard in parse_shard_ids(spec)}
+
+    processes, logs, connected = [], {}, {}
+    workdir = tempfile.mkdtemp(prefix="loadtest-shards-")
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+    async def read_log(token, stream):
+        while line := await stream.readline():
+            text = line.decode(errors="replace").rstrip()
+            logs[token].append(text)
+            try:
+                msg = json.loads(text).get("msg", "")
+            except (ValueError, AttributeError):
+                continue
+            if msg.startswith("Bot is in "):
+                connected[token].set_result(int(msg.split()[3]))
+
+    started = time.perf_counter()
+    readers = []
+    for i, (token, spec) in enumerate(zip(tokens, ranges)):
+        env = dict(
+            os.environ, DISCORD_TOKEN=token, SHARD_COUNT=str(args.shards), SHARD_IDS=spec, SHARD_PROCESSES="1",
+            REDIS_URL=f"redis://127.0.0.1:{redis_server.server_address[1]}/0", COOLDOWN_BACKEND="redis",
+            LEVELING_DB_PATH=os.path.join(workdir, f"leveling-{i}.db"), METRICS_PORT="0",
+            LOG_FORMAT="json", LOG_LEVEL="INFO", AI_JOB_MODE="inline",
+        )
+        env.pop("GROQ_API_KEY", None)  # Every mention gets the fixed "disabled" reply, no Groq needed
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-c", SHARD_BOOTSTRAP, url, main_path,
+            env=env, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+        )
+        processes.append(process)
+        logs[token] = deque(maxlen=200)
+        connected[token] = asyncio.get_running_loop().create_future()
+        readers.append(asyncio.create_task(read_log(token, process.stdout)))
+
+    checks = []
+    try:
+        await asyncio.wait(connected.values(), timeout=args.timeout)
+        guild_counts = {token: f.result() if f.done() else None for token, f in connected.items()}
+        ready_s = time.perf_counter() - started
+
+        if all(count is not None for count in guild_counts.values()):
+            for i, guild_id in enumerate(guild_ids):
+                await gateway.mention(guild_id, BOT_USER_ID + 100 + i)
+            try:
+                async with asyncio.timeout(args.timeout):
+                    while len(gateway.replies) < len(guild_ids):
+                        await asyncio.sleep(0.05)
+            except TimeoutError:
+                pass
+            await asyncio.sleep(0.5)  # Room for duplicate replies to show up
+
+        identified = sorted(shard for _, shard in gateway.identified)
+        checks.append(("every shard identified exactly once", identified == list(range(args.shards)),
+                       f"identified {identified}"))
+        strays = [(tokens.index(token), shard) for token, shard in gateway.identified if owner.get(shard) != token]
+        checks.append(("each process identified only its own SHARD_IDS", bool(gateway.identified) and not strays,
+                       f"(process, shard) outside its range: {strays}" if strays else f"ranges {ranges}"))
+        expected_counts = {token: sum(owner[gateway.shard_of(g)] == token for g in guild_ids) for token in tokens}
+        checks.append(("each process saw only its own guilds", guild_counts == expected_counts,
+                       f"guilds per process {list(guild_counts.values())}, expected {list(expected_counts.values())}"))
+        wrong = {g: [tokens.index(t) for t in gateway.replies.get(g, [])] for g in guild_ids
+                 if gateway.replies.get(g) != [owner[gateway.shard_of(g)]]}
+        checks.append(("each guild answered once, by its shard's process", not wrong,
+                       f"guild -> answering processes: {wrong}" if wrong else f"{len(guild_ids)} guilds"))
+        checks.append(("only the process with shard 0 synced the command tree", gateway.synced == [owner[0]],
+                       f"syncs by process {[tokens.index(t) for t in gateway.synced]}"))
+    finally:
+        for process in processes:
+            if process.returncode is None:
+                process.terminate()
+        for process in processes:
+            try:
+                async with asyncio.timeout(10):
+                    await process.wait()
+            except TimeoutError:
+                process.kill()
+                await process.wait()
+        for reader in readers:
+            reader.cancel()
+        await gateway.close()
+        redis_server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "shards": args.shards,
+        "processes": dict(zip(tokens, ranges)),
+        "ready_s": ready_s,
+        "checks": checks,
+        "unknown_routes": dict(gateway.unknown),
+        "log_tail": {token: list(lines)[-20:] for token, lines in logs.items()},
+    }
+
+
+def print_shard_report(report):
+    """Prints the shard checks; returns 1 if any failed (with each process's last log lines)."""
+    print(f"{len(report['processes'])} processes, {report['shards']} shards "
+          f"({', '.join(report['processes'].values())}), ready in {report['ready_s']:.1f}s")
+    for name, ok, detail in report["checks"]:
+        print(f"  {'PASS' if ok else 'FAIL'}  {name}: {detail}")
+    if report["unknown_routes"]:
+        print(f"  Unserved REST routes: {report['unknown_routes']}")
+    if all(ok for _, ok, _ in report["checks"]):
+        return 0
+    for token, lines in report["log_tail"].items():
+        print(f"--- {token} ({report['processes'][token]}) ---")
+        print("\n".join(lines))
+    return 1
+
+
+# --- REPORTING ---
+def print_report(report):
+    def row(name, s):
+        if not s.get("count"):
+            return f"  {name:<18} {'-':>8}"
+        return (f"  {name:<18} {s['count']:>8} {s['mean']:>9.2f} {s['p50']:>9.2f} "
+                f"{s['p95']:>9.2f} {s['p99']:>9.2f} {s['max']:>9.2f}")
+
+    mem = report["memory"]
+    print(f"{report['messages']} messages in {report['elapsed_s']:.2f}s -> {report['throughput']:,.1f} msg/s")
+    print(f"  {'latency (ms)':<18} {'count':>8} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for kind, s in report["handler_ms"].items():
+        print(row(f"handler:{kind}", s))
+    print(row("ai first reply", report["ai_first_reply_ms"]))
+    print(row("ai complete", report["ai_complete_ms"]))
+    print(row("event loop lag", report["loop_lag_ms"]))
+    print(f"  AI messages never answered: {report['ai_unanswered']}")
+    print(f"  RSS {mem['rss_start_mb']:.1f} -> {mem['rss_end_mb']:.1f} MB (peak {mem['rss_peak_mb']:.1f}, "
+          f"{mem['growth_mb']:+.1f} MB, {mem['growth_mb_per_hour']:+.1f} MB/h over the second half)")
+    for line in mem["top_allocations"]:
+        print(f"    {line}")
+    print(f"  Groq: {report['groq']}  Discord REST: {report['discord']}")
+    if report.get("redis"):
+        latency = report["config"].get("redis_latency") or 0
+        print(f"  Redis: {report['redis']} at {latency * 1000:.1f} ms per round trip")
+    if report["caches"]:
+        print(f"  Caches: {report['caches']}")
+    if report["warnings"]:
+        print(f"  Warnings logged: {report['warnings']}")
+
+
+def compare(baseline, current, tolerance=0.10, min_delta_ms=1.0):
+    """
+    Returns (lines, regressions). Throughput may not drop, and p95 / p99
+    latencies and loop lag may not rise, by more than `tolerance`; latency
+    changes smaller than min_delta_ms are treated as noise.
+    """
+    lines, regressions = [], []
+
+    def check(name, old, new, higher_is_worse, floor=0.0):
+        if old is None or new is None:
+            return
+        change = (new - old) / old if old else (0.0 if new == old else float("inf"))
+        worse = change > tolerance if higher_is_worse else change < -tolerance
+        if worse and abs(new - old) <= floor:
+            worse = False
+        mark = "REGRESSION" if worse else ""
+        lines.append(f"  {name:<32} {old:>11.2f} {new:>11.2f} {change * 100:>+8.1f}%  {mark}")
+        if worse:
+            regressions.append(name)
+
+    if baseline.get("config") != current.get("config"):
+        lines.append("  note: the runs used different settings, comparisons may not be meaningful")
+    lines.append(f"  {'metric':<32} {'baseline':>11} {'current':>11} {'change':>9}")
+    check("throughput msg/s", baseline.get("throughput"), current.get("throughput"), higher_is_worse=False)
+    series = [(f"handler:{kind}", baseline["handler_ms"].get(kind, {}), current["handler_ms"].get(kind, {}))
+              for kind in current.get("handler_ms", {})]
+    series += [(name, baseline.get(f"{name}_ms", {}), current.get(f"{name}_ms", {}))
+               for name in ("ai_first_reply", "ai_complete", "loop_lag")]
+    for name, old, new in series:
+        for stat in ("p95", "p99"):
+            check(f"{name} {stat} ms", old.get(stat), new.get(stat), higher_is_worse=True, floor=min_delta_ms)
+    check("rss growth MB", baseline["memory"]["growth_mb"], current["memory"]["growth_mb"],
+          higher_is_worse=True, floor=5.0)
+    return lines, regressions
+
+
+def report_comparison(baseline, current, tolerance, min_delta_ms):
+    lines, regressions = compare(baseline, current, tolerance, min_delta_ms)
+    print(f"Compared with baseline (tolerance {tolerance * 100:.0f}%):")
+    print("\n".join(lines))
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    print("No regressions.")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for the AI and leveling cogs (fake Discord, fake Groq, fakeredis).")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Drive synthetic traffic and report throughput / latency / memory")
+    run_parser.add_argument("--messages", type=int, default=5000, help="Messages to send (ignored with --duration)")
+    run_parser.add_argument("--duration", type=float, default=0, help="Soak: send for this many seconds instead")
+    run_parser.add_argument("--rate", type=float, default=0, help="Target msg/s, open loop (0 = as fast as handled)")
+    run_parser.add_argument("--concurrency", type=int, default=50, help="Max messages being handled at once")
+    run_parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Message kind weights (default {DEFAULT_MIX})")
+    run_parser.add_argument("--roles", default=DEFAULT_ROLES, help=f"Role probabilities per member (default {DEFAULT_ROLES})")
+    run_parser.add_argument("--users", type=int, default=500)
+    run_parser.add_argument("--channels", type=int, default=20)
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--rest-latency", type=float, default=0.05, help="Seconds per fake Discord REST call")
+    run_parser.add_argument("--groq-latency", type=float, default=0.3, help="Seconds to the first Groq byte")
+    run_parser.add_argument("--groq-jitter", type=float, default=0.1)
+    run_parser.add_argument("--groq-429", type=float, default=0.0, help="Fraction of Groq requests answered with 429")
+    run_parser.add_argument("--groq-tokens", type=int, default=60, help="Tokens per fake completion")
+    run_parser.add_argument("--groq-token-delay", type=float, default=0.01, help="Seconds between streamed tokens")
+    run_parser.add_argument("--no-stream", dest="stream", action="store_false", help="One-shot completions instead of streaming")
+    run_parser.add_argument("--response-cache", action="store_true", help="Enable the AI response cache")
+    run_parser.add_argument("--redis", default="fake", help="'fake' (fakeredis) or a redis:// URL, e.g. a local redis-server")
+    run_parser.add_argument("--redis-latency", type=float, default=0.0, help="Seconds per fakeredis round trip (command or pipeline)")
+    run_parser.add_argument("--redis-jitter", type=float, default=0.0)
+    run_parser.add_argument("--cooldowns", choices=("memory", "redis"), default="memory")
+    run_parser.add_argument("--leveling", choices=("sqlite", "redis"), default="sqlite", help="sqlite runs in :memory:")
+    run_parser.add_argument("--ai-mode", choices=("inline", "queue"), default="inline", help="queue adds an in-process AI worker")
+    run_parser.add_argument("--worker-concurrency", type=int, default=4)
+    run_parser.add_argument("--drain-timeout", type=float, default=30.0, help="Max seconds to wait for queued AI work")
+    run_parser.add_argument("--sample-interval", type=float, default=1.0, help="Seconds between RSS samples")
+    run_parser.add_argument("--tracemalloc", action="store_true", help="Report the top allocation growth sites (slow)")
+    run_parser.add_argument("--save", help="Write the report as JSON here")
+    run_parser.add_argument("--baseline", help="Compare with a saved report; exit 1 on regression")
+    run_parser.add_argument("--tolerance", type=float, default=0.10)
+    run_parser.add_argument("--min-delta-ms", type=float, default=1.0)
+
+    compare_parser = commands.add_parser("compare", help="Compare two saved reports; exit 1 on regression")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance", type=float, default=0.10)
+    compare_parser.add_argument("--min-delta-ms", type=float, default=1.0)
+
+    shards_parser = commands.add_parser("shards", help="Run main.py as several shard processes against a fake gateway; exit 1 on a failed check")
+    shards_parser.add_argument("--shards", type=int, default=4, help="SHARD_COUNT")
+    shards_parser.add_argument("--processes", type=int, default=2, help="Processes the shards are split across")
+    shards_parser.add_argument("--guilds", type=int, default=8)
+    shards_parser.add_argument("--timeout", type=float, default=60.0, help="Max seconds to connect, and to get every reply")
+
+    args = parser.parse_args(argv)
+    if args.command == "shards":
+        return print_shard_report(asyncio.run(run_shards(args)))
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        return report_comparison(baseline, current, args.tolerance, args.min_delta_ms)
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            return report_comparison(json.load(f), report, args.tolerance, args.min_delta_ms)
+    return 0
+
+
+if __name__ == "__main__":
+    # Usage: python loadtest.py run [options] | python loadtest.py compare <baseline.json> <current.json> | python loadtest.py shards [options]
+    sys.exit(main())
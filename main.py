@@ -1,47 +1,167 @@
+from startup import StartupTimer, sync_command_tree  # First import: the startup clock starts here
 import discord
 from discord.ext import commands
 import os
+import sys
 import asyncio
+import subprocess
+import aiohttp
+from message_router import MessageRouter, IGNORED, HUMAN
+from logs import get_logger
+from metrics import start_metrics_server
+from memory_store import ensure_memory_schema
+
+log = get_logger("main")
+
+timer = StartupTimer()
+timer.mark("modules imported")
+
+# --- SHARDING CONFIGURATION ---
+# SHARD_COUNT: total shards across all processes ("auto" = Discord's recommendation)
+# SHARD_IDS: shards this process runs, e.g. "0-3" or "0,2" (default: all of them)
+# SHARD_PROCESSES: >1 makes this process a launcher that splits the shards into
+# that many worker processes (e.g. Procfile: worker: SHARD_PROCESSES=2 python main.py)
+SHARD_COUNT = os.environ.get("SHARD_COUNT", "auto")
+SHARD_IDS = os.environ.get("SHARD_IDS")
+SHARD_PROCESSES = int(os.environ.get("SHARD_PROCESSES", 1))
+
+
+def parse_shard_ids(spec):
+    """'0-3,6' -> [0, 1, 2, 3, 6]"""
+    ids = []
+    for part in spec.split(","):
+        start, _, end = part.strip().partition("-")
+        ids.extend(range(int(start), int(end or start) + 1))
+    return ids
+
+
+def split_shards(shard_count, processes):
+    """Contiguous shard ranges, one per worker process."""
+    per_process, extra = divmod(shard_count, processes)
+    ranges, start = [], 0
+    for i in range(processes):
+        size = per_process + (1 if i < extra else 0)
+        if size:
+            ranges.append(f"{start}-{start + size - 1}")
+        start += size
+    return ranges
+
 
 # --- BOT SETUP ---
 intents = discord.Intents.default()
 intents.members = True
 intents.message_content = True
 
-bot = commands.Bot(command_prefix='$', intents=intents)
+shard_kwargs = {}
+if SHARD_COUNT != "auto":
+    shard_kwargs["shard_count"] = int(SHARD_COUNT)
+    if SHARD_IDS:
+        shard_kwargs["shard_ids"] = parse_shard_ids(SHARD_IDS)
+
+# Guild-scoped state (XP cache, history buffers, rank indexes) stays correct per
+# process because a guild always lives on exactly one shard. User-scoped
+# cooldowns need COOLDOWN_BACKEND=redis once there is more than one process.
+bot = commands.AutoShardedBot(command_prefix='$', intents=intents, **shard_kwargs)
+# One on_message for the whole bot: classifies each message once and feeds the cogs
+router = MessageRouter.install(bot)
+
+# --- STARTUP HOOKS ---
+@bot.event
+async def setup_hook():
+    # Runs once per process, right after login (not on every reconnect like on_ready)
+    timer.mark("logged in")
+    if bot.shard_ids and 0 not in bot.shard_ids:
+        return  # Only the process running shard 0 syncs the (global) slash commands
+    asyncio.create_task(sync_commands())
+
+async def sync_commands():
+    try:
+        with timer.phase("command tree sync"):
+            await sync_command_tree(bot)
+    except Exception as e:
+        log.warning(f'Failed to sync slash commands: {e}')
+
+async def first_event(message, kind):
+    timer.mark("first event handled")
+    router.unsubscribe(first_event)
+    timer.report()
 
 # --- EVENT ON_READY ---
 @bot.event
 async def on_ready():
-    print(f'{bot.user} has connected to Discord!')
-    print(f'Bot is in {len(bot.guilds)} guild(s)')
+    timer.mark("ready")
+    log.info(f'{bot.user} has connected to Discord! Shards {sorted(bot.shards)} of {bot.shard_count}')
+    log.info(f'Bot is in {len(bot.guilds)} guild(s)')
+
+@bot.event
+async def on_shard_ready(shard_id):
+    log.info(f'Shard {shard_id} ready (latency {bot.get_shard(shard_id).latency * 1000:.0f}ms)')
+
+# --- MULTI-PROCESS LAUNCHER ---
+async def recommended_shard_count(token):
+    headers = {"Authorization": f"Bot {token}"}
+    async with aiohttp.ClientSession() as session:
+        async with session.get("https://discord.com/api/v10/gateway/bot", headers=headers) as resp:
+            resp.raise_for_status()
+            return (await resp.json())["shards"]
+
+
+def launch_workers(token):
+    """Runs one `python main.py` per shard range and exits when any of them does."""
+    shard_count = asyncio.run(recommended_shard_count(token)) if SHARD_COUNT == "auto" else int(SHARD_COUNT)
+    processes = []
+    for shard_ids in split_shards(shard_count, SHARD_PROCESSES):
+        env = dict(os.environ, SHARD_COUNT=str(shard_count), SHARD_IDS=shard_ids, SHARD_PROCESSES="1")
+        env.setdefault("COOLDOWN_BACKEND", "redis")  # Cooldowns must be shared between the processes
+        if env.get("METRICS_PORT", "9108") != "0":
+            env["METRICS_PORT"] = str(int(env.get("METRICS_PORT", 9108)) + len(processes))  # One /metrics port per worker
+        processes.append(subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env))
+        log.info(f"Launcher started shards {shard_ids} of {shard_count} (pid {processes[-1].pid})")
+
+    exit_code = 0
     try:
-        synced = await bot.tree.sync()
-        print(f'Synced {len(synced)} slash command(s)')
-    except Exception as e:
-        print(f'Failed to sync slash commands: {e}')
+        exit_code = os.wait()[1] >> 8  # First worker to stop takes the others down with it
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            process.wait()
+    return exit_code
 
 # --- COG LOADER & MAIN LOOP ---
 async def main():
-    # Hanya memuat Cog AI
     cogs_to_load = [
         "ai_cog",
+        "leveling_cog",
     ]
 
     for cog in cogs_to_load:
         try:
-            await bot.load_extension(cog)
-            print(f"Successfully loaded module: {cog}")
+            with timer.phase(f"load {cog}"):
+                await bot.load_extension(cog)
+            log.info(f"Successfully loaded module: {cog}")
         except Exception as e:
-            print(f"ERROR: Failed to load module {cog}: {e}")
+            log.error(f"Failed to load module {cog}: {e}")
+    # Subscribed last, so it fires after the cogs handled the first message
+    router.subscribe(first_event, IGNORED, *HUMAN)
 
     token = os.environ.get('DISCORD_TOKEN')
     if not token:
-        print("ERROR: DISCORD_TOKEN not found!")
+        log.error("DISCORD_TOKEN not found!")
         return
 
+    await start_metrics_server()
+    # Legacy memory blobs are migrated (by one process, the others wait) before any command is served
+    with timer.phase("memory schema"):
+        await ensure_memory_schema()
+
     # Keep_alive dihapus total karena Anda akan deploy di Railway/Render
     await bot.start(token)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if SHARD_PROCESSES > 1:
+        if not os.environ.get('DISCORD_TOKEN'):
+            sys.exit("ERROR: DISCORD_TOKEN not found!")
+        sys.exit(launch_workers(os.environ['DISCORD_TOKEN']))
+    asyncio.run(main())
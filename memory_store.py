@@ -0,0 +1,425 @@
+import asyncio
+import json
+import os
+import time
+from redis_pool import get_redis, REDIS_CALL_TIMEOUT
+from metrics import span, REDIS_CALL_SECONDS, REDIS_ERRORS
+from fact_retrieval import tokenize
+from logs import get_logger
+
+log = get_logger("memory_store")
+
+RAILS_VERSION_KEY = "prompt_rails_version"
+RAILS_UPDATES_CHANNEL = "prompt_rails_updates"
+
+# --- USER MEMORY SCHEMA (v2) ---
+MEMORY_SCHEMA_KEY = "memory_schema_version"
+MEMORY_SCHEMA_VERSION = "2"
+MEMORY_MAX_FACTS = int(os.environ.get("MEMORY_MAX_FACTS", 50))    # Per-user cap, oldest facts are dropped first
+MEMORY_FACT_TTL = int(os.environ.get("MEMORY_FACT_TTL", 0))       # Seconds until a fact expires (0 = never)
+PENDING_FACTS_KEY = "memory:pending_facts"                          # Raw facts waiting for the batched Groq cleaner
+PENDING_PROCESSING_KEY = "memory:pending_facts:processing"          # Claimed by a cleaner, not yet acknowledged
+PENDING_CLAIMED_KEY = "memory:pending_facts:claimed"                # zset: claimed item -> claim time
+PENDING_FACTS_MAX = int(os.environ.get("PENDING_FACTS_MAX", 10000)) # Oldest raw facts beyond this are left uncleaned
+PENDING_CLAIM_TIMEOUT = int(os.environ.get("PENDING_CLAIM_TIMEOUT", 300))  # Unacknowledged claims go back to the queue after this
+MEMORY_MIGRATION_LOCK = "memory_schema_migration"
+MEMORY_MIGRATION_WAIT = float(os.environ.get("MEMORY_MIGRATION_WAIT", 300))  # Seconds a process waits for another's migration
+
+# Every script keeps the user's BM25 statistics (KEYS[4], hash term -> number of
+# facts containing it, plus ":len" -> total terms over all facts) in step with the
+# facts, so retrieval doesn't recount them per message. Users stored before the
+# statistics existed get them rebuilt on first touch.
+# KEYS: facts (zset id->id), texts (hash id->json), expiry (zset id->expires_at), df (hash)
+_TERM_STATS = """
+local facts, texts, expiry, df = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local function count_terms(value, sign)
+    if not value then
+        return
+    end
+    local terms = cjson.decode(value).terms or {}
+    local seen = {}
+    for _, term in ipairs(terms) do
+        if not seen[term] then
+            seen[term] = true
+            if redis.call('HINCRBY', df, term, sign) <= 0 then
+                redis.call('HDEL', df, term)
+            end
+        end
+    end
+    redis.call('HINCRBY', df, ':len', sign * #terms)
+end
+local function drop_fact(id)
+    count_terms(redis.call('HGET', texts, id), -1)
+    redis.call('ZREM', facts, id)
+    redis.call('HDEL', texts, id)
+    redis.call('ZREM', expiry, id)
+end
+local function enforce_cap(cap)
+    local count = redis.call('ZCARD', facts)
+    if cap > 0 and count > cap then
+        for _, old in ipairs(redis.call('ZRANGE', facts, 0, count - cap - 1)) do
+            drop_fact(old)
+        end
+        count = cap
+    end
+    return count
+end
+if redis.call('HEXISTS', df, ':len') == 0 then
+    redis.call('HSET', df, ':len', 0)
+    for _, value in ipairs(redis.call('HVALS', texts)) do
+        count_terms(value, 1)
+    end
+end
+"""
+
+# Every script that reads or appends first drops facts whose TTL has passed.
+_PRUNE_EXPIRED = _TERM_STATS + """
+local now = tonumber(ARGV[1])
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', expiry, '-inf', now)) do
+    drop_fact(id)
+end
+"""
+
+# KEYS[5]: id sequence | ARGV: now, fact json, ttl, cap -> {fact id, total facts}
+ADD_FACT_SCRIPT = _PRUNE_EXPIRED + """
+local id = redis.call('INCR', KEYS[5])
+redis.call('ZADD', facts, id, id)
+redis.call('HSET', texts, id, ARGV[2])
+count_terms(ARGV[2], 1)
+local ttl = tonumber(ARGV[3])
+if ttl > 0 then
+    redis.call('ZADD', expiry, now + ttl, id)
+end
+return {id, enforce_cap(tonumber(ARGV[4]))}
+"""
+
+# ARGV: now, start, stop, query terms... -> {total, total terms, doc freq per query term..., fact json...}
+READ_FACTS_SCRIPT = _PRUNE_EXPIRED + """
+local result = {redis.call('ZCARD', facts), redis.call('HGET', df, ':len')}
+for i = 4, #ARGV do
+    table.insert(result, redis.call('HGET', df, ARGV[i]) or 0)
+end
+local ids = redis.call('ZRANGE', facts, ARGV[2], ARGV[3])
+if #ids > 0 then
+    for _, value in ipairs(redis.call('HMGET', texts, unpack(ids))) do
+        table.insert(result, value)
+    end
+end
+return result
+"""
+
+# ARGV: fact id, new fact json -> 1 if replaced, 0 if the fact is gone
+REPLACE_FACT_SCRIPT = _TERM_STATS + """
+local old = redis.call('HGET', texts, ARGV[1])
+if old then
+    count_terms(old, -1)
+    redis.call('HSET', texts, ARGV[1], ARGV[2])
+    count_terms(ARGV[2], 1)
+    return 1
+end
+return 0
+"""
+
+# ARGV: now, index -> removed fact json (or nil)
+REMOVE_FACT_SCRIPT = _PRUNE_EXPIRED + """
+local ids = redis.call('ZRANGE', facts, ARGV[2], ARGV[2])
+if #ids == 0 then
+    return false
+end
+local value = redis.call('HGET', texts, ids[1])
+drop_fact(ids[1])
+return value
+"""
+
+# KEYS[5]: id sequence, KEYS[6]: prefs, KEYS[7]: legacy blob
+# ARGV: legacy blob as read, cap, fact count n, n fact jsons, then preference key/value pairs
+# -> facts merged, or -1 if the blob changed since it was read (read it again and retry)
+MIGRATE_BLOB_SCRIPT = _TERM_STATS + """
+if redis.call('GET', KEYS[7]) ~= ARGV[1] then
+    return -1
+end
+local n = tonumber(ARGV[3])
+-- Legacy facts are older than any v2 fact, so they rank before them
+local first = redis.call('ZRANGE', facts, 0, 0, 'WITHSCORES')
+local base = #first > 0 and tonumber(first[2]) - n or 0
+for i = 1, n do
+    local id = redis.call('INCR', KEYS[5])
+    redis.call('ZADD', facts, base + i - 1, id)
+    redis.call('HSET', texts, id, ARGV[3 + i])
+    count_terms(ARGV[3 + i], 1)
+end
+enforce_cap(tonumber(ARGV[2]))
+for i = 4 + n, #ARGV, 2 do
+    redis.call('HSETNX', KEYS[6], ARGV[i], ARGV[i + 1])  -- Preferences set since v2 win
+end
+redis.call('DEL', KEYS[7])
+return n
+"""
+
+# KEYS: pending, processing, claimed | ARGV: now, count, claim timeout -> claimed items
+# Claims a cleaner never acknowledged (it crashed or lost Redis) are requeued first.
+CLAIM_PENDING_SCRIPT = """
+local pending, processing, claimed = KEYS[1], KEYS[2], KEYS[3]
+local now = tonumber(ARGV[1])
+for _, value in ipairs(redis.call('ZRANGEBYSCORE', claimed, '-inf', now - tonumber(ARGV[3]))) do
+    redis.call('LREM', processing, 1, value)
+    redis.call('RPUSH', pending, value)
+    redis.call('ZREM', claimed, value)
+end
+local items = {}
+for i = 1, tonumber(ARGV[2]) do
+    local value = redis.call('LMOVE', pending, processing, 'LEFT', 'RIGHT')
+    if not value then
+        break
+    end
+    redis.call('ZADD', claimed, now, value)
+    table.insert(items, value)
+end
+return items
+"""
+
+
+class MemoryOffline(Exception):
+    """Raised when Redis can't be reached (or answers too slowly) for a memory call."""
+
+
+def offline_errors():
+    """Errors that mean "Redis is unavailable"; redis is only imported once a call fails."""
+    import redis
+    return (redis.RedisError, OSError, asyncio.TimeoutError)
+
+
+class MemoryStore:
+    """
+    Non-blocking access to the AI memory keys in Redis:
+    - "prompt_rails": the admin-defined safety rails
+    - "prompt_rails_version": bumped (and published) on every rails change
+    - "memory:{user_id}:facts|texts|expiry|df|seq": the user's facts and their BM25 statistics (see scripts above)
+    - "memory:{user_id}:prefs": hash of user preferences
+    Fact edits run as Lua scripts, so concurrent /ingat and /lupa can't lose updates.
+    """
+
+    def __init__(self, client_factory=get_redis, call_timeout=REDIS_CALL_TIMEOUT):
+        self._client_factory = client_factory
+        self.call_timeout = call_timeout
+        self._scripts = {}
+
+    async def run(self, operation):
+        """Runs operation(client) under the per-call timeout."""
+        try:
+            with span(REDIS_CALL_SECONDS):
+                return await asyncio.wait_for(operation(self._client_factory()), self.call_timeout)
+        except offline_errors() as e:
+            REDIS_ERRORS.inc()
+            raise MemoryOffline(str(e) or type(e).__name__) from e
+
+    async def _call(self, method, *args):
+        return await self.run(lambda client: getattr(client, method)(*args))
+
+    async def ping(self):
+        return await self._call("ping")
+
+    # --- RAILS ---
+    async def get_rails(self):
+        return await self._call("get", "prompt_rails")
+
+    async def get_rails_version(self):
+        return int(await self._call("get", RAILS_VERSION_KEY) or 0)
+
+    async def set_rails(self, rails_str):
+        """Writes the rails, bumps the version and notifies every bot process. Returns the new version."""
+        def write(client):
+            pipe = client.pipeline(transaction=True)
+            pipe.set("prompt_rails", rails_str)
+            pipe.incr(RAILS_VERSION_KEY)
+            pipe.publish(RAILS_UPDATES_CHANNEL, "updated")
+            return pipe.execute()
+        results = await self.run(write)
+        return results[1]
+
+    async def subscribe_rails_updates(self):
+        """Returns a PubSub subscribed to rails changes (holds its own pooled connection)."""
+        async def subscribe(client):
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            await pubsub.subscribe(RAILS_UPDATES_CHANNEL)
+            return pubsub
+        return await self.run(subscribe)
+
+    # --- USER MEMORY ---
+    @staticmethod
+    def _fact_keys(user_id):
+        # The {user_id} hash tag keeps one user's keys in the same cluster slot
+        base = f"memory:{{{user_id}}}"
+        return [f"{base}:facts", f"{base}:texts", f"{base}:expiry", f"{base}:df", f"{base}:seq"]
+
+    @staticmethod
+    def _prefs_key(user_id):
+        return f"memory:{{{user_id}}}:prefs"
+
+    def _script(self, client, source):
+        script = self._scripts.get(source)
+        if script is None:
+            script = self._scripts[source] = client.register_script(source)
+        return script
+
+    async def _eval(self, source, keys, args):
+        return await self.run(lambda client: self._script(client, source)(keys=keys, args=args, client=client))
+
+    async def add_fact(self, user_id, text, raw=False, ttl=MEMORY_FACT_TTL, cap=MEMORY_MAX_FACTS):
+        """
+        Appends a fact atomically (enforcing TTL and cap in Redis). Returns (fact_id, total_count).
+        raw=True marks the fact as not yet cleaned and queues it for the batched cleaner.
+        """
+        fact = {"text": text, "terms": tokenize(text)}
+        if raw:
+            fact["raw"] = True
+        fact_id, count = await self._eval(ADD_FACT_SCRIPT, self._fact_keys(user_id), [time.time(), json.dumps(fact), ttl, cap])
+        if raw:
+            await self.push_pending_facts([{"user_id": str(user_id), "fact_id": fact_id, "text": text}])
+        return fact_id, count
+
+    async def replace_fact(self, user_id, fact_id, text):
+        """Swaps in the cleaned text; a no-op if the user deleted the fact meanwhile."""
+        fact = json.dumps({"text": text, "terms": tokenize(text)})
+        return bool(await self._eval(REPLACE_FACT_SCRIPT, self._fact_keys(user_id)[:4], [fact_id, fact]))
+
+    async def _read_facts(self, user_id, start, stop, terms=()):
+        result = await self._eval(READ_FACTS_SCRIPT, self._fact_keys(user_id)[:4], [time.time(), start, stop, *terms])
+        total, length = int(result[0]), int(result[1] or 0)
+        stats = {
+            "docs": total,
+            "avgdl": length / total if total else 0.0,
+            "df": {term: int(n) for term, n in zip(terms, result[2:2 + len(terms)])},
+        }
+        return total, [json.loads(value) for value in result[2 + len(terms):] if value], stats
+
+    async def get_facts(self, user_id, start=0, stop=-1):
+        """Returns (total_count, facts[start..stop]) where each fact is {"text", "terms"}."""
+        total, facts, _ = await self._read_facts(user_id, start, stop)
+        return total, facts
+
+    async def search_facts(self, user_id, query):
+        """
+        Returns (facts, stats) for ranking every fact against `query`: stats holds the
+        stored fact count, average length and doc frequency of each query term.
+        """
+        _, facts, stats = await self._read_facts(user_id, 0, -1, sorted(set(tokenize(query))))
+        return facts, stats
+
+    async def remove_fact(self, user_id, index):
+        """Removes the fact at 0-based `index`; returns its text, or None if there is none."""
+        value = await self._eval(REMOVE_FACT_SCRIPT, self._fact_keys(user_id)[:4], [time.time(), index])
+        return json.loads(value)["text"] if value else None
+
+    async def push_pending_facts(self, items, cap=PENDING_FACTS_MAX):
+        def write(client):
+            pipe = client.pipeline(transaction=False)
+            pipe.rpush(PENDING_FACTS_KEY, *(json.dumps(item) for item in items))
+            pipe.ltrim(PENDING_FACTS_KEY, -cap, -1)  # Bounded even if no cleaner is draining it
+            return pipe.execute()
+        await self.run(write)
+
+    async def claim_pending_facts(self, count, timeout=PENDING_CLAIM_TIMEOUT):
+        """
+        Moves up to `count` pending facts to the processing list and returns them
+        as (claim, item) pairs; pass the claims to ack_pending_facts once handled.
+        """
+        keys = [PENDING_FACTS_KEY, PENDING_PROCESSING_KEY, PENDING_CLAIMED_KEY]
+        values = await self._eval(CLAIM_PENDING_SCRIPT, keys, [time.time(), count, timeout])
+        return [(value, json.loads(value)) for value in values]
+
+    async def ack_pending_facts(self, claims):
+        def write(client):
+            pipe = client.pipeline(transaction=True)
+            for claim in claims:
+                pipe.lrem(PENDING_PROCESSING_KEY, 1, claim)
+            pipe.zrem(PENDING_CLAIMED_KEY, *claims)
+            return pipe.execute()
+        await self.run(write)
+
+    async def clear_memory(self, user_id):
+        await self._call("delete", *self._fact_keys(user_id), self._prefs_key(user_id))
+
+    async def get_preferences(self, user_id):
+        raw = await self._call("hgetall", self._prefs_key(user_id))
+        return {key: json.loads(value) for key, value in raw.items()}
+
+    async def set_preference(self, user_id, key, value):
+        await self._call("hset", self._prefs_key(user_id), key, json.dumps(value))
+
+    # --- MIGRATION FROM THE v1 JSON BLOBS ---
+    async def migrate_legacy_blobs(self, cap=MEMORY_MAX_FACTS):
+        """
+        Merges every "memory_{user_id}" JSON blob into the user's v2 keys, next to
+        any facts stored since. Each user is one script that re-checks the blob
+        it read, so a blob written meanwhile (e.g. by a not yet updated process)
+        is re-read instead of lost, and re-running after a crash is safe.
+        """
+        if await self._call("get", MEMORY_SCHEMA_KEY) == MEMORY_SCHEMA_VERSION:
+            return 0
+
+        migrated = 0
+        cursor = 0
+        while True:
+            cursor, keys = await self._call("scan", cursor, "memory_*", 200)
+            for legacy_key in keys:
+                user_id = legacy_key[len("memory_"):]
+                if not user_id.isdigit():
+                    continue
+                while True:
+                    raw = await self._call("get", legacy_key)
+                    if raw is None:
+                        break
+                    blob = json.loads(raw)
+                    facts = blob.get("facts", [])
+                    preferences = blob.get("preferences") or {}
+                    args = [raw, cap, len(facts)]
+                    args += [json.dumps({"text": text, "terms": tokenize(text)}) for text in facts]
+                    for key, value in preferences.items():
+                        args += [key, json.dumps(value)]
+                    script_keys = self._fact_keys(user_id) + [self._prefs_key(user_id), legacy_key]
+                    if await self._eval(MIGRATE_BLOB_SCRIPT, script_keys, args) != -1:
+                        migrated += 1
+                        break
+            if cursor == 0:
+                break
+
+        await self._call("set", MEMORY_SCHEMA_KEY, MEMORY_SCHEMA_VERSION)
+        return migrated
+
+    async def ensure_schema(self, wait=MEMORY_MIGRATION_WAIT):
+        """
+        Runs the legacy migration once across every process: the one that takes
+        the lock migrates, the others wait (up to `wait` seconds) for it to finish.
+        Returns the number of blobs this process migrated.
+        """
+        if await self._call("get", MEMORY_SCHEMA_KEY) == MEMORY_SCHEMA_VERSION:
+            return 0
+        if await self.run(lambda c: c.set(MEMORY_MIGRATION_LOCK, os.getpid(), nx=True, ex=int(wait))):
+            try:
+                return await self.migrate_legacy_blobs()
+            finally:
+                await self._call("delete", MEMORY_MIGRATION_LOCK)
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline:
+            await asyncio.sleep(1)
+            if await self._call("get", MEMORY_SCHEMA_KEY) == MEMORY_SCHEMA_VERSION:
+                break
+        return 0
+
+
+async def ensure_memory_schema():
+    """Start-up step for every process that serves memory commands; Redis trouble is logged, not raised."""
+    try:
+        migrated = await MemoryStore(call_timeout=30).ensure_schema()
+    except MemoryOffline as e:
+        log.warning(f"Memory schema not checked, Redis offline. Error: {e}")
+        return
+    if migrated:
+        log.info(f"Migrated {migrated} legacy memory blob(s) to schema v{MEMORY_SCHEMA_VERSION}.")
+
+
+if __name__ == "__main__":
+    # Manual run: python memory_store.py
+    count = asyncio.run(MemoryStore(call_timeout=30).ensure_schema())
+    print(f"Migrated {count} memory blob(s) to schema v{MEMORY_SCHEMA_VERSION}.")
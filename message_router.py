@@ -0,0 +1,133 @@
+import sys
+import time
+from logs import get_logger
+from metrics import counter, span, MESSAGE_HANDLER_SECONDS
+
+log = get_logger("message_router")
+
+# --- MESSAGE CLASSES ---
+IGNORED = "ignored"          # Bots, webhooks and plain DMs
+COMMAND = "command"          # Starts with the command prefix
+AI_MENTION = "ai_mention"    # Starts with the bot's mention
+AI_REPLY = "ai_reply"        # Discord reply to one of the bot's messages
+XP_ELIGIBLE = "xp_eligible"  # Any other human message in a guild
+HUMAN = (COMMAND, AI_MENTION, AI_REPLY, XP_ELIGIBLE)
+
+MESSAGES = counter("messages_total", "Gateway messages seen, by message class")
+
+
+class MessageRouter:
+    """
+    The bot's only on_message handler. Each message is classified once, with
+    cheap in-memory checks only (no I/O), and handed to the handlers that
+    subscribed to its class, in subscription order, exactly once each.
+    Commands are processed here too, so there is no second parse by the
+    default Bot.on_message.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        prefix = bot.command_prefix
+        self._prefixes = (prefix,) if isinstance(prefix, str) else tuple(prefix)  # Static prefixes only
+        self._handlers = {kind: [] for kind in (IGNORED,) + HUMAN}
+        self.counts = {kind: 0 for kind in self._handlers}
+
+    @classmethod
+    def install(cls, bot):
+        """Returns the bot's router, creating it and taking over on_message on first use."""
+        router = getattr(bot, "router", None)
+        if router is None:
+            router = bot.router = cls(bot)
+            bot.on_message = router.dispatch
+            router.subscribe(router._process_commands, COMMAND)
+        return router
+
+    def subscribe(self, handler, *kinds):
+        """handler: coroutine function (message, kind)."""
+        for kind in kinds:
+            self._handlers[kind].append(handler)
+
+    def unsubscribe(self, handler):
+        for handlers in self._handlers.values():
+            while handler in handlers:
+                handlers.remove(handler)
+
+    def classify(self, message):
+        if message.author.bot:
+            return IGNORED
+        content = message.content
+        if self._prefixes and content.startswith(self._prefixes):
+            return COMMAND
+        me = self.bot.user
+        if me is not None:
+            if content.startswith(me.mention):
+                return AI_MENTION
+            reference = message.reference
+            # resolved comes from the gateway payload / message cache, never a fetch
+            if reference is not None and getattr(getattr(reference, "resolved", None), "author", None) == me:
+                return AI_REPLY
+        if message.guild is None:
+            return IGNORED
+        return XP_ELIGIBLE
+
+    async def dispatch(self, message):
+        kind = self.classify(message)
+        self.counts[kind] += 1
+        MESSAGES.inc(kind=kind)
+        with span(MESSAGE_HANDLER_SECONDS, kind=kind):
+            for handler in self._handlers[kind]:
+                try:
+                    await handler(message, kind)
+                except Exception as e:
+                    log.warning(f"{getattr(handler, '__qualname__', handler)} failed on a {kind} message. Error: {e}")
+
+    async def _process_commands(self, message, kind):
+        await self.bot.process_commands(message)
+
+
+# --- BENCHMARK ---
+def _benchmark(count=200_000):
+    """Classifies and dispatches a synthetic message mix with no-op handlers."""
+    import asyncio
+    import random
+    from types import SimpleNamespace as NS
+
+    me = NS(id=1, mention="<@1>", bot=True)
+    bot = NS(command_prefix="$", user=me, process_commands=None)
+    router = MessageRouter(bot)
+
+    async def noop(message, kind):
+        pass
+
+    for kind in HUMAN:
+        router.subscribe(noop, kind)
+
+    guild, human, other_bot = NS(id=10), NS(id=2, bot=False), NS(id=3, bot=True)
+    bot_msg = NS(author=me)
+    samples = [
+        NS(author=human, content="hello there, how is everyone", reference=None, guild=guild),
+        NS(author=human, content="$level", reference=None, guild=guild),
+        NS(author=human, content="<@1> what's the weather", reference=None, guild=guild),
+        NS(author=human, content="thanks!", reference=NS(resolved=bot_msg), guild=guild),
+        NS(author=other_bot, content="beep", reference=None, guild=guild),
+        NS(author=human, content="dm text", reference=None, guild=None),
+    ]
+    weights = [70, 5, 5, 5, 10, 5]
+    stream = random.Random(0).choices(samples, weights, k=count)
+
+    async def run():
+        start = time.perf_counter()
+        for message in stream:
+            await router.dispatch(message)
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(run())
+    print(f"{count} messages in {elapsed:.3f}s ({count / elapsed:,.0f} msg/s, {elapsed / count * 1e6:.2f} µs/msg)")
+    print("Per class:", router.counts)
+
+
+if __name__ == "__main__":
+    # Usage: python message_router.py bench [message count]
+    if len(sys.argv) < 2 or sys.argv[1] != "bench":
+        sys.exit("Usage: python message_router.py bench [message count]")
+    _benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 200_000)
@@ -0,0 +1,186 @@
+import asyncio
+import bisect
+import os
+import time
+from logs import get_logger
+
+# --- METRICS CONFIGURATION ---
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9108))  # 0 disables the /metrics endpoint
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+log = get_logger("metrics")
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    __slots__ = ("name", "help", "values")
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}  # label key -> float
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in self.values.items():
+            yield f"{self.name}{_format_labels(key)} {value}"
+
+
+class Histogram:
+    __slots__ = ("name", "help", "buckets", "series")
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.series = {}  # label key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [0] * (len(self.buckets) + 2)
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {series[-1]}"
+            yield f"{self.name}_sum{_format_labels(key)} {series[-2]}"
+            yield f"{self.name}_count{_format_labels(key)} {series[-1]}"
+
+
+class Gauge:
+    """Read at scrape time from a callback, e.g. a queue's current length."""
+    __slots__ = ("name", "help", "read")
+
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        try:
+            yield f"{self.name} {float(self.read())}"
+        except Exception:
+            pass
+
+
+class span:
+    """Times a block into a histogram: `with span(AI_STAGE_SECONDS, stage="groq"): ...`"""
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, **labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+# --- REGISTRY ---
+_metrics = {}
+
+
+def counter(name, help):
+    return _metrics.setdefault(name, Counter(name, help))
+
+
+def histogram(name, help, buckets=LATENCY_BUCKETS):
+    return _metrics.setdefault(name, Histogram(name, help, buckets))
+
+
+def gauge(name, help, read):
+    """(Re)binds a gauge to a callback; the newest cog instance wins after a reload."""
+    _metrics[name] = Gauge(name, help, read)
+    return _metrics[name]
+
+
+def render():
+    lines = []
+    for metric in _metrics.values():
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Shared hot-path metrics
+MESSAGE_HANDLER_SECONDS = histogram("message_handler_seconds", "Time spent dispatching one message, by message class")
+AI_STAGE_SECONDS = histogram("ai_stage_seconds", "panggil_ai time per stage")
+REDIS_CALL_SECONDS = histogram("redis_call_seconds", "Latency of Redis operations")
+REDIS_ERRORS = counter("redis_errors_total", "Redis operations that failed or timed out")
+GROQ_REQUEST_SECONDS = histogram("groq_request_seconds", "Groq latency until the response (or stream) starts")
+GROQ_TOKENS = counter("groq_tokens_total", "Tokens reported by Groq usage blocks")
+GROQ_RATE_LIMITED = counter("groq_rate_limited_total", "429 responses received from Groq")
+LEVELING_STORE_SECONDS = histogram("leveling_store_seconds", "Leveling storage latency, by operation")
+CACHE_REQUESTS = counter("cache_requests_total", "Cache lookups, by cache and result")
+
+
+# --- HTTP ENDPOINT ---
+async def _handle(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass  # Headers are not needed
+        path = request_line.split(b" ")[1] if request_line.count(b" ") >= 2 else b""
+        if path.split(b"?")[0] == b"/metrics":
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"Not found. Try /metrics\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serves GET /metrics in Prometheus text format. Returns the server, or None if disabled / port busy."""
+    if not port:
+        return None
+    try:
+        server = await asyncio.start_server(_handle, host, port)
+    except OSError as e:
+        log.warning(f"Metrics endpoint disabled, can't bind {host}:{port}. Error: {e}")
+        return None
+    log.info(f"Metrics endpoint on http://{host}:{port}/metrics")
+    return server
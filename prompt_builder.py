@@ -0,0 +1,124 @@
+import asyncio
+import os
+import time
+from memory_store import MemoryOffline
+from logs import get_logger
+
+log = get_logger("prompt_builder")
+
+RAILS_VERSION_CHECK_INTERVAL = float(os.environ.get("RAILS_VERSION_CHECK_INTERVAL", 60.0)) # Backstop if a pub/sub message is missed
+
+# Static part first: persona + rails never change between messages, so keeping them
+# as an identical leading block lets the provider's prompt-prefix cache hit.
+SYSTEM_PREFIX_TEMPLATE = """
+<CORE_SYSTEM_PROMPT>
+{core_prompt}
+</CORE_SYSTEM_PROMPT>
+
+<OPERATIONAL_RAILS>
+{rails_str}
+</OPERATIONAL_RAILS>
+"""
+
+SYSTEM_CONTEXT_TEMPLATE = """
+<CURRENT_CONTEXT>
+Timestamp: {current_time}
+Server: {server_name}
+Channel: #{channel_name}
+User: {user_display_name}
+</CURRENT_CONTEXT>
+
+<LONG_TERM_MEMORY>
+Known facts about {user_display_name}:
+{memory_str}
+</LONG_TERM_MEMORY>
+"""
+
+ID_DENIALS = {
+    "Sorry, I can't directly read chat history, you'll need to tell me what to look for.\" (EN)": "'Waduh, gw gak bisa liat isi chat langsung, lu harus bilang apa yang gw perlu tau.'",
+    "Sorry, I can't process images/audio, describe it to me instead.\" (EN)": "'Waduh, mata gue masih analog, cik. Nggak bisa liat gambar. Ceritain aja isinya apa.'",
+}
+EN_DENIALS = {
+    "Waduh, gw gak bisa liat isi chat langsung, lu harus bilang apa yang gw perlu tau.\" (ID) OR \"": "",
+    "Waduh, mata gue masih analog, cik. Nggak bisa liat gambar. Ceritain aja isinya apa.\" (ID) OR \"": "",
+}
+
+
+def localize_rails(rails_str, lang):
+    """Keeps only the ID or EN ability denials in the rails."""
+    for old, new in (ID_DENIALS if lang == 'id' else EN_DENIALS).items():
+        rails_str = rails_str.replace(old, new)
+    return rails_str
+
+
+class PromptBuilder:
+    """
+    Precomputes the static system-prompt prefix (persona + localized rails)
+    for every language once, and only fills the dynamic context per message.
+    Variants are rebuilt when setup_persona bumps the rails version.
+    """
+
+    def __init__(self, memory, default_rails, personas, default_persona, languages):
+        self.memory = memory
+        self.default_rails = default_rails
+        self.personas = personas
+        self.default_persona = default_persona
+        self.languages = languages
+        self.version = None
+        self._variants = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._variants = None
+
+    def _compile(self, rails_str):
+        variants = {}
+        for lang in self.languages:
+            persona_str = self.personas.get(lang, self.default_persona)
+            variants[lang] = SYSTEM_PREFIX_TEMPLATE.format(core_prompt=persona_str, rails_str=localize_rails(rails_str, lang))
+        return variants
+
+    async def _refresh(self):
+        now = time.monotonic()
+        if self._variants is not None and now - self._checked_at < RAILS_VERSION_CHECK_INTERVAL:
+            return
+        async with self._lock:
+            if self._variants is not None and now - self._checked_at < RAILS_VERSION_CHECK_INTERVAL:
+                return
+            try:
+                version = await self.memory.get_rails_version()
+                if self._variants is None or version != self.version:
+                    rails_str = await self.memory.get_rails() or self.default_rails
+                    self._variants = self._compile(rails_str)
+                    self.version = version
+            except MemoryOffline:
+                if self._variants is None:
+                    self._variants = self._compile(self.default_rails)
+                    self.version = None  # Retry Redis on the next check
+            self._checked_at = now
+
+    async def prefix_for(self, lang):
+        await self._refresh()
+        return self._variants.get(lang) or self._variants[self.languages[0]]
+
+    async def build(self, lang, **context):
+        """Full system prompt: cached static prefix + the per-message context block."""
+        return await self.prefix_for(lang) + SYSTEM_CONTEXT_TEMPLATE.format(**context)
+
+    async def listen_for_updates(self):
+        """Background task: drops the compiled variants whenever any process publishes new rails."""
+        while True:
+            try:
+                pubsub = await self.memory.subscribe_rails_updates()
+                try:
+                    async for _ in pubsub.listen():
+                        self.invalidate()
+                finally:
+                    await pubsub.aclose()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning(f"Rails subscription lost, retrying. Error: {e}")
+            self.invalidate()  # Updates may have been missed while disconnected
+            await asyncio.sleep(5)
@@ -0,0 +1,46 @@
+import os
+
+# --- REDIS CONNECTION POOL CONFIGURATION ---
+REDIS_URL = os.environ.get("REDIS_URL") or "redis://localhost:6379/0"
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", 20))
+REDIS_POOL_TIMEOUT = float(os.environ.get("REDIS_POOL_TIMEOUT", 2.0))     # Max wait for a free connection
+REDIS_SOCKET_TIMEOUT = float(os.environ.get("REDIS_SOCKET_TIMEOUT", 2.0))
+REDIS_CALL_TIMEOUT = float(os.environ.get("REDIS_CALL_TIMEOUT", 3.0))     # Hard cap per command (incl. retries)
+
+_client = None
+
+
+def get_redis():
+    """
+    Returns the shared async Redis client, creating it on first use.
+    The pool is bounded (callers wait up to REDIS_POOL_TIMEOUT for a free
+    connection) and broken connections are re-established with backoff.
+    """
+    global _client
+    if _client is None:
+        # Imported here: redis.asyncio costs ~100ms at startup and isn't needed until the first call
+        import redis.asyncio as aioredis
+        from redis.asyncio.retry import Retry
+        from redis.backoff import ExponentialBackoff
+        from redis.exceptions import ConnectionError, TimeoutError
+
+        pool = aioredis.BlockingConnectionPool.from_url(
+            REDIS_URL,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+            health_check_interval=30,
+            retry=Retry(ExponentialBackoff(cap=1.0, base=0.05), retries=3),
+            retry_on_error=[ConnectionError, TimeoutError],
+            decode_responses=True,
+        )
+        _client = aioredis.Redis(connection_pool=pool)
+    return _client
+
+
+async def close_redis():
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.aclose()
@@ -0,0 +1,208 @@
+import hashlib
+import os
+import random
+import re
+import time
+from memory_store import MemoryOffline
+from metrics import CACHE_REQUESTS
+
+# --- RESPONSE CACHE CONFIGURATION ---
+AI_RESPONSE_CACHE = os.environ.get("AI_RESPONSE_CACHE", "0") == "1"           # Opt-in
+AI_CACHE_TTL = int(os.environ.get("AI_CACHE_TTL", 6 * 3600))
+AI_CACHE_MAX_ENTRIES = int(os.environ.get("AI_CACHE_MAX_ENTRIES", 5000))
+AI_CACHE_SIMILARITY = os.environ.get("AI_CACHE_SIMILARITY", "1") == "1"         # Level 2 (MinHash) on/off
+AI_CACHE_SIMILARITY_THRESHOLD = float(os.environ.get("AI_CACHE_SIMILARITY_THRESHOLD", 0.85))
+
+CACHE_PREFIX = "ai_cache"
+CACHE_USER_NAME = "a server member"  # Stands in for the asker's name in prompts whose answer is shared
+CHANNEL_WORDS = {"channel", "channels", "here", "sini", "kanal"}
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16  # 4 rows per band
+MAX_CANDIDATES = 20
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(1337)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(MINHASH_PERMUTATIONS)]
+
+
+def normalize_prompt(text):
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def mentions_channel(prompt_text, channel_name):
+    """True if the prompt is about the channel it was sent in (its name, or words like "channel"/"here")."""
+    normalized = normalize_prompt(prompt_text)
+    name = normalize_prompt(channel_name or "")
+    return not CHANNEL_WORDS.isdisjoint(normalized.split()) or (bool(name) and name in normalized)
+
+
+def minhash_signature(normalized):
+    """MinHash over character 3-grams (works for short prompts like greetings)."""
+    shingles = {normalized[i:i + 3] for i in range(max(len(normalized) - 2, 1))}
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big") for s in shingles]
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def signature_similarity(sig_a, sig_b):
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / MINHASH_PERMUTATIONS
+
+
+class ResponseCache:
+    """
+    Shared (Redis) cache of AI answers to non-personalized prompts.
+    Level 1: exact match on (normalized prompt, scope()).
+    Level 2: MinHash/LSH near-duplicate match above a similarity threshold.
+    Entries expire after AI_CACHE_TTL and the least recently used are evicted
+    beyond AI_CACHE_MAX_ENTRIES. An evicted entry leaves its LSH bands right
+    away; one that expired is dropped from them by the next lookup that sees it.
+    """
+
+    def __init__(self, store, enabled=AI_RESPONSE_CACHE, ttl=AI_CACHE_TTL, max_entries=AI_CACHE_MAX_ENTRIES,
+                 similarity=AI_CACHE_SIMILARITY, threshold=AI_CACHE_SIMILARITY_THRESHOLD):
+        self.store = store
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self.threshold = threshold
+
+    @staticmethod
+    def scope(lang, version, guild_id, channel_id=None, day=None):
+        """
+        What an answer is shared across: the same language, rails version and
+        guild (plus the channel or day when the prompt context depends on them).
+        """
+        return ":".join(str(part) for part in (lang, version, guild_id, channel_id, day) if part is not None)
+
+    @staticmethod
+    def _digest(normalized, scope):
+        return hashlib.sha1(f"{scope}|{normalized}".encode()).hexdigest()
+
+    @staticmethod
+    def _band_keys(signature, scope):
+        rows = MINHASH_PERMUTATIONS // LSH_BANDS
+        keys = []
+        for band in range(LSH_BANDS):
+            chunk = ",".join(map(str, signature[band * rows:(band + 1) * rows]))
+            band_hash = hashlib.sha1(chunk.encode()).hexdigest()[:16]
+            keys.append(f"{CACHE_PREFIX}:lsh:{scope}:{band}:{band_hash}")
+        return keys
+
+    async def get(self, prompt_text, scope):
+        """Returns the cached response text, or None. Never raises on Redis trouble."""
+        normalized = normalize_prompt(prompt_text)
+        digest = self._digest(normalized, scope)
+        try:
+            entry = await self.store.run(lambda c: c.hmget(f"{CACHE_PREFIX}:entry:{digest}", "response", "tokens"))
+            kind = "hits_exact"
+            if entry[0] is None and self.similarity:
+                digest, entry = await self._find_similar(normalized, scope)
+                kind = "hits_similar"
+            if entry is None or entry[0] is None:
+                CACHE_REQUESTS.inc(cache="ai_response", result="miss")
+                await self.store.run(lambda c: c.hincrby(f"{CACHE_PREFIX}:stats", "misses", 1))
+                return None
+
+            def record_hit(c):
+                pipe = c.pipeline(transaction=False)
+                pipe.zadd(f"{CACHE_PREFIX}:lru", {digest: time.time()})
+                pipe.hincrby(f"{CACHE_PREFIX}:stats", kind, 1)
+                pipe.hincrby(f"{CACHE_PREFIX}:stats", "tokens_saved", int(entry[1] or 0))
+                return pipe.execute()
+            CACHE_REQUESTS.inc(cache="ai_response", result=kind.replace("hits_", "hit_"))
+            await self.store.run(record_hit)
+            return entry[0]
+        except MemoryOffline:
+            return None
+
+    async def _find_similar(self, normalized, scope):
+        signature = minhash_signature(normalized)
+        band_keys = self._band_keys(signature, scope)
+        candidates = list(await self.store.run(lambda c: c.sunion(band_keys)))[:MAX_CANDIDATES]
+        if not candidates:
+            return None, None
+
+        def fetch(c):
+            pipe = c.pipeline(transaction=False)
+            for candidate in candidates:
+                pipe.hmget(f"{CACHE_PREFIX}:entry:{candidate}", "response", "tokens", "sig")
+            return pipe.execute()
+        entries = await self.store.run(fetch)
+
+        best_digest, best_entry, best_score = None, None, self.threshold
+        dead = []
+        for candidate, (response, tokens, sig) in zip(candidates, entries):
+            if response is None or not sig:
+                dead.append(candidate)  # Expired, so it stays in its bands until seen
+                continue
+            score = signature_similarity(signature, [int(x) for x in sig.split(",")])
+            if score >= best_score:
+                best_digest, best_entry, best_score = candidate, (response, tokens), score
+        if dead:
+            await self.store.run(lambda c: self._srem_bands(c, band_keys, dead))
+        return best_digest, best_entry
+
+    @staticmethod
+    def _srem_bands(client, band_keys, digests):
+        pipe = client.pipeline(transaction=False)
+        for band_key in band_keys:
+            pipe.srem(band_key, *digests)
+        return pipe.execute()
+
+    async def _evict(self, digests):
+        """Deletes entries and takes them out of their LSH bands (their signature and scope say which)."""
+        entry_keys = [f"{CACHE_PREFIX}:entry:{d}" for d in digests]
+
+        def fetch(c):
+            pipe = c.pipeline(transaction=False)
+            for entry_key in entry_keys:
+                pipe.hmget(entry_key, "sig", "scope")
+            return pipe.execute()
+        entries = await self.store.run(fetch)
+
+        def delete(c):
+            pipe = c.pipeline(transaction=False)
+            pipe.delete(*entry_keys)
+            for digest, (sig, scope) in zip(digests, entries):
+                if sig and scope is not None:
+                    for band_key in self._band_keys([int(x) for x in sig.split(",")], scope):
+                        pipe.srem(band_key, digest)
+            return pipe.execute()
+        await self.store.run(delete)
+
+    async def put(self, prompt_text, scope, response_text, tokens):
+        normalized = normalize_prompt(prompt_text)
+        digest = self._digest(normalized, scope)
+        entry_key = f"{CACHE_PREFIX}:entry:{digest}"
+        signature = minhash_signature(normalized) if self.similarity else None
+
+        def write(c):
+            pipe = c.pipeline(transaction=False)
+            mapping = {"response": response_text, "tokens": int(tokens)}
+            if signature:
+                mapping["sig"] = ",".join(map(str, signature))
+                mapping["scope"] = scope  # Lets an eviction find the entry's band keys
+            pipe.hset(entry_key, mapping=mapping)
+            pipe.expire(entry_key, self.ttl)
+            pipe.zadd(f"{CACHE_PREFIX}:lru", {digest: time.time()})
+            if signature:
+                for band_key in self._band_keys(signature, scope):
+                    pipe.sadd(band_key, digest)
+                    pipe.expire(band_key, self.ttl)
+            pipe.zcard(f"{CACHE_PREFIX}:lru")
+            return pipe.execute()
+
+        try:
+            size = (await self.store.run(write))[-1]
+            if size > self.max_entries:
+                evicted = await self.store.run(lambda c: c.zpopmin(f"{CACHE_PREFIX}:lru", size - self.max_entries))
+                if evicted:
+                    await self._evict([d for d, _ in evicted])
+        except MemoryOffline:
+            pass
+
+    async def stats(self):
+        raw = await self.store.run(lambda c: c.hgetall(f"{CACHE_PREFIX}:stats"))
+        stats = {k: int(raw.get(k, 0)) for k in ("hits_exact", "hits_similar", "misses", "tokens_saved")}
+        lookups = stats["hits_exact"] + stats["hits_similar"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits_exact"] + stats["hits_similar"]) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,55 @@
+import asyncio
+from metrics import counter
+
+GROQ_CALLS_SAVED = counter("groq_calls_saved_total", "AI requests answered without their own Groq call, by reason")
+
+
+class LeaderCancelled(Exception):
+    """The call being awaited was cancelled; the follower runs the work itself."""
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one: the first caller
+    (the leader) runs the work, callers arriving while it is in flight await
+    the leader's result (or its exception) instead of starting their own.
+    Nothing is kept once the call finishes; repeats later on are the
+    response cache's job.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}  # key -> Future of the leader's result
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key, work):
+        """Returns (result, shared): shared is True if another caller's call produced it."""
+        while True:
+            call = self._calls.get(key)
+            if call is None:
+                break
+            try:
+                result = await asyncio.shield(call)
+            except LeaderCancelled:
+                continue  # Take over as leader (or follow whoever already did)
+            GROQ_CALLS_SAVED.inc(reason=self.name)
+            return result, True
+
+        call = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await work()
+        except asyncio.CancelledError:
+            call.set_exception(LeaderCancelled())
+            raise
+        except Exception as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result, False
+        finally:
+            del self._calls[key]
+            if call.done() and not call.cancelled():
+                call.exception()  # Marks it retrieved when nobody was following
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+from memory_store import MemoryStore, MemoryOffline
+from logs import get_logger
+
+log = get_logger("startup")
+
+# --- STARTUP CONFIGURATION ---
+COMMAND_SYNC_KEY = "command_tree_hash"  # Redis hash: "<application id>:<guild id | global>" -> tree hash
+COMMAND_SYNC_FORCE = os.environ.get("COMMAND_SYNC_FORCE", "0") == "1"  # Sync even if the hash matches
+
+PROCESS_STARTED = time.perf_counter()
+
+
+class StartupTimer:
+    """
+    Per-phase start-up timings. Phases are timed blocks (imports, cog loads,
+    login...); milestones are points measured from process start (first
+    ready, first event handled). report() prints the breakdown once.
+    """
+
+    def __init__(self, started=PROCESS_STARTED):
+        self.started = started
+        self.phases = []      # [(name, seconds)]
+        self.milestones = {}  # name -> seconds since process start
+        self.reported = False
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def mark(self, name):
+        """Records a milestone the first time it is reached."""
+        self.milestones.setdefault(name, time.perf_counter() - self.started)
+
+    def report(self):
+        if self.reported:
+            return
+        self.reported = True
+        lines = [f"  {name:<28} {seconds * 1000:8.1f} ms" for name, seconds in self.phases]
+        lines += [f"  @{name:<27} {seconds * 1000:8.1f} ms" for name, seconds in self.milestones.items()]
+        log.info("Startup timings:\n" + "\n".join(lines))
+
+
+# --- COMMAND TREE SYNC ---
+def command_tree_hash(tree, guild=None):
+    """Stable hash of the payload tree.sync() would upload for `guild` (None = global)."""
+    payload = sorted(
+        (command.to_dict(tree) for command in tree.get_commands(guild=guild)),
+        key=lambda command: (command.get("type", 1), command["name"]),
+    )
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+async def sync_command_tree(bot, guilds=(), store=None):
+    """
+    Syncs the global tree (and every guild in `guilds`) only when its hash
+    differs from the last synced one, so restarts and reconnects skip the
+    slow, heavily rate-limited sync call. Returns the scopes that were synced.
+    If Redis is unreachable the hashes can't be compared and it syncs.
+    """
+    store = store or MemoryStore()
+    synced = []
+    for guild in (None, *guilds):
+        field = f"{bot.application_id}:{guild.id if guild else 'global'}"
+        digest = command_tree_hash(bot.tree, guild)
+        try:
+            last = await store.run(lambda c: c.hget(COMMAND_SYNC_KEY, field))
+        except MemoryOffline:
+            last = None
+        if last == digest and not COMMAND_SYNC_FORCE:
+            continue
+
+        commands = await bot.tree.sync(guild=guild)
+        synced.append(field)
+        log.info(f"Synced {len(commands)} slash command(s) for {field}")
+        try:
+            await store.run(lambda c: c.hset(COMMAND_SYNC_KEY, field, digest))
+        except MemoryOffline:
+            pass
+    if not synced:
+        log.info("Slash commands unchanged, sync skipped.")
+    return synced
@@ -0,0 +1,115 @@
+import asyncio
+import os
+
+# --- CHUNKED TRANSLATION CONFIGURATION ---
+TRANSLATE_MAX_MESSAGES = int(os.environ.get("TRANSLATE_MAX_MESSAGES", 200))  # Largest window one request may translate
+TRANSLATE_CHUNK_TOKENS = int(os.environ.get("TRANSLATE_CHUNK_TOKENS", 700))  # Input per Groq call; its output fills one embed page
+TRANSLATE_CONCURRENCY = int(os.environ.get("TRANSLATE_CONCURRENCY", 4))      # Chunks in flight per request (the scheduler still paces them)
+TRANSLATE_MAX_WAIT = float(os.environ.get("TRANSLATE_MAX_WAIT", 90.0))       # Seconds a chunk may wait for a Groq slot (prompts wait GROQ_MAX_WAIT)
+TRANSLATE_OUTPUT_RATIO = 2                                                   # max_tokens per input token of a chunk
+TRANSLATE_ITEM_OVERHEAD = 8                                                  # Tokens of JSON framing per message
+TRANSLATE_PROMPT_TOKENS = 80                                                 # System prompt per chunk
+
+
+def text_tokens(text):
+    return len(text) // 4 + TRANSLATE_ITEM_OVERHEAD
+
+
+def record_tokens(record):
+    return text_tokens(record.content)
+
+
+def chunk_max_tokens(texts):
+    """max_tokens for one chunk: its input tokens with room for longer scripts and the reply's JSON framing."""
+    return TRANSLATE_OUTPUT_RATIO * sum(text_tokens(text) for text in texts)
+
+
+def chunk_reserved_tokens(texts):
+    """What one chunk's Groq call reserves from the TPM bucket: prompt plus max_tokens."""
+    return TRANSLATE_PROMPT_TOKENS + sum(text_tokens(text) for text in texts) + chunk_max_tokens(texts)
+
+
+def split_pages(records, budget=TRANSLATE_CHUNK_TOKENS):
+    """Consecutive runs of records within `budget` estimated tokens, split on message boundaries."""
+    pages, current, used = [], [], 0
+    for record in records:
+        cost = record_tokens(record)
+        if current and used + cost > budget:
+            pages.append(current)
+            current, used = [], 0
+        current.append(record)
+        used += cost
+    if current:
+        pages.append(current)
+    return pages
+
+
+class ChunkedTranslation:
+    """
+    Map-reduce translation of a history window. The records are split into
+    token-budgeted pages; each page's unknown texts go out as one Groq call,
+    at most `concurrency` at a time. Identical texts are sent once, by the
+    first page that shows them. as_completed() yields every page as soon as
+    the texts it shows are translated, so a slow chunk only holds back its
+    own page (and any later page that repeats one of its texts).
+    """
+
+    def __init__(self, records, translate, known=None, budget=TRANSLATE_CHUNK_TOKENS, concurrency=TRANSLATE_CONCURRENCY):
+        """translate: coroutine function ([text]) -> [translation or None], same order."""
+        self.pages = split_pages(records, budget)
+        self.known = dict(known or {})  # message id -> translation, e.g. from the TranslationCache
+        self.translated = {}            # text -> translation
+        self._translate = translate
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks = None
+
+        # Plan the chunks: each unknown text is translated by the first page that shows it
+        owner = {}  # text -> index of the page whose chunk translates it
+        self.chunks = [[] for _ in self.pages]
+        self._deps = [set() for _ in self.pages]
+        for i, page in enumerate(self.pages):
+            for record in page:
+                text = record.content
+                if record.id in self.known or not text.strip():
+                    continue
+                if text not in owner:
+                    owner[text] = i
+                    self.chunks[i].append(text)
+                self._deps[i].add(owner[text])
+
+    @property
+    def reserved_tokens(self):
+        """TPM budget the whole job needs, for checking up front that it can finish."""
+        return sum(chunk_reserved_tokens(texts) for texts in self.chunks if texts)
+
+    def start(self):
+        """Starts translating; safe to call more than once."""
+        if self._tasks is not None:
+            return
+        self._tasks = [asyncio.create_task(self._run_chunk(texts)) if texts else None for texts in self.chunks]
+
+    async def _run_chunk(self, texts):
+        async with self._semaphore:
+            translations = await self._translate(texts)
+        for text, translation in zip(texts, translations):
+            if translation is not None:
+                self.translated[text] = translation
+
+    async def _page_ready(self, index):
+        results = await asyncio.gather(*(self._tasks[j] for j in self._deps[index]), return_exceptions=True)
+        return index, next((r for r in results if isinstance(r, BaseException)), None)
+
+    def lines(self, index):
+        """[(record, translation or None)] for one page, in window order."""
+        return [(r, self.known.get(r.id) or self.translated.get(r.content)) for r in self.pages[index]]
+
+    async def as_completed(self):
+        """Yields (page index, error or None) in completion order."""
+        self.start()
+        try:
+            for ready in asyncio.as_completed([self._page_ready(i) for i in range(len(self.pages))]):
+                yield await ready
+        finally:
+            for task in self._tasks:
+                if task is not None and not task.done():
+                    task.cancel()